@@ -34,6 +34,7 @@ def create_app():
     from app.routes.dashboard import dashboard_bp
     from app.routes.reports import reports_bp
     from app.routes.stock_adjustment_crud import stock_adjustment_bp
+    from app.routes.periods import periods_bp
 
 
     app.register_blueprint(inventory_bp, url_prefix='/api/inventory')
@@ -48,6 +49,7 @@ def create_app():
     app.register_blueprint(dashboard_bp, url_prefix='/api/dashboard')
     app.register_blueprint(reports_bp, url_prefix='/api/reports')
     app.register_blueprint(stock_adjustment_bp,url_prefix='/api/stock-adjustments')
+    app.register_blueprint(periods_bp, url_prefix='/api/periods')
 
 
     # ==================== SERVE VUE FRONTEND (THIS MUST BE LAST!) ====================
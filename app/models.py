@@ -8,7 +8,14 @@ from sqlalchemy import Enum, CheckConstraint
 class StatusMixin:
     status = db.Column(db.Integer, default=1, nullable=False)  # 1 = Active, 0 = Inactive
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+def trgm_index(table, column):
+    """pg_trgm GIN index so ILIKE '%term%' searches on the column can use an index."""
+    return db.Index(
+        f'ix_{table}_{column}_trgm', column,
+        postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'}
+    )
 
 # ------------------ Transaction Numbers ------------------
 class TransactionNumber(db.Model, StatusMixin):
@@ -19,6 +26,8 @@ class TransactionNumber(db.Model, StatusMixin):
 
 # ------------------ Customer Table ------------------
 class Customer(db.Model, StatusMixin):
+    __table_args__ = (trgm_index('customer', 'name'),)
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False, default='Walk-in')
     phone = db.Column(db.String(20))
@@ -36,6 +45,7 @@ class Category(db.Model, StatusMixin):
 
 class Product(db.Model, StatusMixin):
     __tablename__ = 'product'
+    __table_args__ = (trgm_index('product', 'name'), trgm_index('product', 'sku'))
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -60,6 +70,7 @@ class Product(db.Model, StatusMixin):
 
 class ProductUnit(db.Model, StatusMixin):
     __tablename__ = 'product_unit'
+    __table_args__ = (db.Index('ix_product_unit_unit_code', 'unit_code'),)  # barcode scans
 
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
@@ -101,6 +112,8 @@ class ProductUnit(db.Model, StatusMixin):
 
 # ------------------ Suppliers & Purchase Orders ------------------
 class Supplier(db.Model, StatusMixin):
+    __table_args__ = (trgm_index('supplier', 'name'),)
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     contact = db.Column(db.String(50))
@@ -108,6 +121,14 @@ class Supplier(db.Model, StatusMixin):
 
 class PurchaseOrder(db.Model, StatusMixin):
     __tablename__ = 'purchase_order'
+    __table_args__ = (
+        trgm_index('purchase_order', 'invoice_number'),
+        trgm_index('purchase_order', 'memo'),
+        # open payables, for the creditors aging report
+        db.Index('ix_purchase_order_open_balance', 'supplier_id', 'purchase_date',
+                 postgresql_where=db.text('total_balance > 0 AND status <> 9'),
+                 sqlite_where=db.text('total_balance > 0 AND status <> 9')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     supplier_id = db.Column(db.Integer, db.ForeignKey('supplier.id'), nullable=False)
@@ -136,10 +157,11 @@ class PurchaseOrder(db.Model, StatusMixin):
 
 class PurchaseOrderItem(db.Model, StatusMixin):
     __tablename__ = 'purchase_order_item'
+    __table_args__ = (db.Index('ix_purchase_order_item_updated_at', 'updated_at'),)
 
     id = db.Column(db.Integer, primary_key=True)
     purchase_order_id = db.Column(db.Integer, db.ForeignKey('purchase_order.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
     unit_id = db.Column(db.Integer, db.ForeignKey('product_unit.id'), nullable=True)  # Link to unit
     quantity = db.Column(db.Float, nullable=False)  # Quantity in the selected unit (float for fractions)
     unit_price = db.Column(db.Float, default=0.0)
@@ -175,6 +197,15 @@ class SupplierPayment(db.Model, StatusMixin):
 # ------------------ Sales & Invoices ------------------
 class Sale(db.Model, StatusMixin):
     __tablename__ = 'sale'
+    __table_args__ = (
+        trgm_index('sale', 'sale_number'),
+        trgm_index('sale', 'memo'),
+        db.Index('ix_sale_sale_date_id', 'sale_date', 'id'),  # keyset pagination of the sales list
+        # open receivables, for the debtors aging report
+        db.Index('ix_sale_open_balance', 'customer_id', 'sale_date',
+                 postgresql_where=db.text('balance > 0 AND status <> 9'),
+                 sqlite_where=db.text('balance > 0 AND status <> 9')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     sale_number = db.Column(db.String(50), unique=True, nullable=False)
@@ -215,10 +246,11 @@ class Sale(db.Model, StatusMixin):
 
 class SaleItem(db.Model, StatusMixin):
     __tablename__ = 'sale_item'
+    __table_args__ = (db.Index('ix_sale_item_updated_at', 'updated_at'),)
 
     id = db.Column(db.Integer, primary_key=True)
-    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
     unit_id = db.Column(db.Integer, db.ForeignKey('product_unit.id'), nullable=True)  # Link to unit
 
     product_name = db.Column(db.String(100))
@@ -226,6 +258,10 @@ class SaleItem(db.Model, StatusMixin):
     unit_price = db.Column(db.Float, default=0.0)
     total_price = db.Column(db.Float, default=0.0)
 
+    # COGS fixed at posting: cost per selected unit and for the whole line
+    unit_cost = db.Column(db.Float)
+    cost_total = db.Column(db.Float)
+
     # Optional: Track which transaction added this item
     transaction_no = db.Column(db.Integer, db.ForeignKey('transaction_number.id'), nullable=True)
 
@@ -261,14 +297,14 @@ class InventoryTransaction(db.Model, StatusMixin):
 
     # Source documents
     purchase_order_id = db.Column(db.Integer, db.ForeignKey('purchase_order.id'), nullable=True)
-    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=True)
+    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=True, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     unit_id = db.Column(db.Integer, db.ForeignKey('product_unit.id'), nullable=True)  # Link to unit for transaction
 
     # Transaction details
     quantity = db.Column(db.Float, nullable=False)  # Quantity in the unit
-    unit_price = db.Column(db.Float, default=0.0)
-    total_price = db.Column(db.Float, default=0.0)
+    unit_price = db.Column(db.Float, default=0.0)   # Sale rows: COGS per base unit at posting
+    total_price = db.Column(db.Float, default=0.0)  # Sale rows: COGS of the line
     transaction_type = db.Column(db.String(20), nullable=False)  # 'Purchase' or 'Sale'
 
     # Relationships
@@ -340,9 +376,10 @@ class User(db.Model, StatusMixin):
 # ------------------ Stock Adjustments ------------------
 class StockAdjustment(db.Model, StatusMixin):
     __tablename__ = 'stock_adjustment'
+    __table_args__ = (db.Index('ix_stock_adjustment_updated_at', 'updated_at'),)
 
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
     unit_id = db.Column(db.Integer, db.ForeignKey('product_unit.id'), nullable=True)  # Link to unit
     adjustment_type = db.Column(db.String(20), nullable=False)  # 'Increase', 'Decrease', 'Correction'
     quantity = db.Column(db.Float, default=0.0, nullable=False)  # Quantity in the unit
@@ -364,6 +401,92 @@ class StockAdjustment(db.Model, StatusMixin):
     def __repr__(self):
         return f"<StockAdjustment {self.adjustment_type} {self.quantity} for Product {self.product_id}>"
 
+# ------------------ Cache Versions ------------------
+class CacheVersion(db.Model):
+    """Counter per cached dataset (e.g. 'catalog'); bumped on writes so every worker can tell its copy is stale."""
+    __tablename__ = 'cache_version'
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# ------------------ Idempotency Keys ------------------
+class IdempotencyKey(db.Model):
+    """
+    A client-supplied Idempotency-Key and the response it got
+    (app.utils.idempotency). status_code is NULL until the response is stored.
+    """
+    __tablename__ = 'idempotency_key'
+    __table_args__ = (db.UniqueConstraint('endpoint', 'key', name='uq_idempotency_key_endpoint_key'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    endpoint = db.Column(db.String(100), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    content_type = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+# ------------------ Latest Purchase Cost ------------------
+class ProductCost(db.Model):
+    """
+    Latest purchase price per (product, unit), maintained by the purchase
+    order routes via app.utils.costing.refresh_product_costs().
+    """
+    __tablename__ = 'product_cost'
+    __table_args__ = (db.UniqueConstraint('product_id', 'unit_id', name='uq_product_cost_product_unit'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    unit_id = db.Column(db.Integer, db.ForeignKey('product_unit.id'), nullable=True)
+    unit_price = db.Column(db.Float, default=0.0, nullable=False)  # price paid per purchased unit
+    base_cost = db.Column(db.Float, default=0.0, nullable=False)   # unit_price / conversion_quantity
+    purchase_order_item_id = db.Column(db.Integer, db.ForeignKey('purchase_order_item.id'), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# ------------------ Stock Reconciliation ------------------
+class StockReconcileWatermark(db.Model):
+    """How far the incremental stock reconciliation has read each source table."""
+    __tablename__ = 'stock_reconcile_watermark'
+
+    source = db.Column(db.String(30), primary_key=True)  # e.g. 'sale_item'
+    last_updated_at = db.Column(db.DateTime)
+    last_id = db.Column(db.Integer, default=0, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class StockCheckpoint(db.Model):
+    """Last reconciled state of one product: history-implied vs stored quantity."""
+    __tablename__ = 'stock_checkpoint'
+
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    expected_quantity = db.Column(db.Float, default=0.0, nullable=False)
+    stored_quantity = db.Column(db.Float, default=0.0, nullable=False)
+    drift = db.Column(db.Float, default=0.0, nullable=False, index=True)
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class CostLayer(db.Model):
+    """
+    Inventory still on hand at one cost, in base units (app.utils.cost_layers).
+    FIFO keeps one row per receipt; moving average keeps one row per product.
+    """
+    __tablename__ = 'cost_layer'
+    __table_args__ = (
+        # open layers of a product in consumption order
+        db.Index('ix_cost_layer_open', 'product_id', 'id',
+                 postgresql_where=db.text('remaining > 0'), sqlite_where=db.text('remaining > 0')),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    source = db.Column(db.String(20), nullable=False)  # purchase, adjustment, return, average
+    purchase_order_item_id = db.Column(db.Integer, db.ForeignKey('purchase_order_item.id'), nullable=True, index=True)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    unit_cost = db.Column(db.Float, nullable=False, default=0.0)   # per base unit
+    quantity = db.Column(db.Float, nullable=False, default=0.0)    # base units received
+    remaining = db.Column(db.Float, nullable=False, default=0.0)   # base units not yet consumed
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 # ------------------ Expenses ------------------
 class Expense(db.Model, StatusMixin):
     __tablename__ = 'expense'
@@ -487,10 +610,104 @@ class Account(db.Model, StatusMixin):
     
 # ------------------ General Ledger ------------------
 class GeneralLedger(db.Model, StatusMixin):
+    __table_args__ = (
+        trgm_index('general_ledger', 'description'),
+        db.Index('ix_general_ledger_source', 'source_type', 'source_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
     transaction_type = db.Column(db.String(10), nullable=False)
     amount = db.Column(db.Float, nullable=False)
     description = db.Column(db.String(200))
     transaction_date = db.Column(db.DateTime, default=datetime.utcnow)
-    transaction_no = db.Column(db.Integer, db.ForeignKey('transaction_number.id'))
\ No newline at end of file
+    transaction_no = db.Column(db.Integer, db.ForeignKey('transaction_number.id'), index=True)
+    # Source document of the line (sale, payment, purchase_order, supplier_payment, expense)
+    source_type = db.Column(db.String(30))
+    source_id = db.Column(db.Integer)
+    reversal_of_id = db.Column(db.Integer, db.ForeignKey('general_ledger.id'), index=True)  # set on reversal lines
+
+# ------------------ Account Daily Balance ------------------
+class AccountDailyBalance(db.Model):
+    """
+    Per-account, per-day totals of active GL lines (status != 9), kept in
+    step with general_ledger by app.utils.gl_utils in the posting
+    transaction. The financial reports sum these rows instead of GL lines.
+    """
+    __tablename__ = 'account_daily_balance'
+    __table_args__ = (
+        db.Index('ix_account_daily_balance_day', 'day'),
+    )
+
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    debit = db.Column(db.Float, nullable=False, default=0.0)   # sum of Debit line amounts
+    credit = db.Column(db.Float, nullable=False, default=0.0)  # sum of Credit line amounts
+
+
+class AccountClosure(db.Model):
+    """
+    Every (ancestor, descendant) pair of the account tree, including each
+    account with itself at depth 0. app.utils.account_tree keeps it in step
+    with account.parent_id on every flush, so any subtree can be summed
+    with one join instead of a recursive walk.
+    """
+    __tablename__ = 'account_closure'
+    __table_args__ = (
+        db.Index('ix_account_closure_descendant', 'descendant_id', 'depth'),
+    )
+
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('account.id', ondelete='CASCADE'), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('account.id', ondelete='CASCADE'), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)  # 0 = the account itself, 1 = a direct child, ...
+
+
+# ------------------ Accounting Periods ------------------
+class AccountingPeriod(db.Model):
+    """
+    A closed month (app.utils.periods). GL postings dated on or before the
+    latest closed period_end are rejected; archived_at is set while the
+    month's GL lines live in general_ledger_archive.
+    """
+    __tablename__ = 'accounting_period'
+
+    id = db.Column(db.Integer, primary_key=True)
+    period_start = db.Column(db.Date, nullable=False, unique=True)  # first day of the month
+    period_end = db.Column(db.Date, nullable=False, index=True)     # last day of the month
+    closed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    closed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    archived_at = db.Column(db.DateTime)
+
+
+class PeriodClosingBalance(db.Model):
+    """Cumulative Debit/Credit totals of an account at the end of a closed period."""
+    __tablename__ = 'period_closing_balance'
+
+    period_id = db.Column(db.Integer, db.ForeignKey('accounting_period.id', ondelete='CASCADE'), primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), primary_key=True)
+    debit = db.Column(db.Float, nullable=False, default=0.0)
+    credit = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class GeneralLedgerArchive(db.Model, StatusMixin):
+    """
+    general_ledger rows of archived periods, moved as-is (same ids) and kept
+    for drill-down. No foreign keys, so the rows can move back on restore.
+    """
+    __tablename__ = 'general_ledger_archive'
+    __table_args__ = (
+        db.Index('ix_general_ledger_archive_date', 'transaction_date'),
+        db.Index('ix_general_ledger_archive_account', 'account_id', 'transaction_date'),
+        db.Index('ix_general_ledger_archive_source', 'source_type', 'source_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    account_id = db.Column(db.Integer, nullable=False)
+    transaction_type = db.Column(db.String(10), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    description = db.Column(db.String(200))
+    transaction_date = db.Column(db.DateTime)
+    transaction_no = db.Column(db.Integer, index=True)
+    source_type = db.Column(db.String(30))
+    source_id = db.Column(db.Integer)
+    reversal_of_id = db.Column(db.Integer)
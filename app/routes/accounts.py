@@ -4,6 +4,8 @@ from app import db
 from app.models import Account, AccountTypeEnum, AssetSubtypeEnum, LiabilitySubtypeEnum, EquitySubtypeEnum, RevenueSubtypeEnum, ExpenseSubtypeEnum
 from datetime import datetime, timezone
 from app.utils.auth import token_required, permission_required
+from app.utils.gl_utils import account_codes_changed, invalidate_account_cache
+from app.utils.report_cache import ledger_changed
 
 accounts_bp = Blueprint('accounts', __name__, url_prefix='/accounts')
 
@@ -57,7 +59,10 @@ def add_account():
         updated_at=datetime.now(timezone.utc)
     )
     db.session.add(account)
+    ledger_changed(db.session)  # reports show account names and types
+    account_codes_changed()
     db.session.commit()
+    invalidate_account_cache()
     return jsonify({"message": "Account added", "account_id": account.id, "code": account.code}), 201
 
 @accounts_bp.route('/', methods=['GET'])
@@ -115,7 +120,15 @@ def update_account(id):
     a.description = data.get('description', a.description)
     a.updated_at = datetime.now(timezone.utc)
     a.status = data.get('status', a.status)
-    db.session.commit()
+    try:
+        # the version bumps autoflush, so a parent cycle can be raised here too
+        ledger_changed(db.session)
+        account_codes_changed()
+        db.session.commit()  # account_closure follows a parent change here
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    invalidate_account_cache()
     return jsonify({"message": "Account updated", "account_id": a.id})
 
 @accounts_bp.route('/<int:id>', methods=['DELETE'])
@@ -125,7 +138,10 @@ def delete_account(id):
     a = Account.query.get_or_404(id)
     a.status = 9  # Soft delete
     a.updated_at = datetime.now(timezone.utc)
+    ledger_changed(db.session)
+    account_codes_changed()
     db.session.commit()
+    invalidate_account_cache()
     return jsonify({"message": "Account soft deleted", "account_id": id})
 
 @accounts_bp.route('/expense-items', methods=['POST'])
@@ -172,7 +188,10 @@ def create_expense_account():
     )
 
     db.session.add(account)
+    ledger_changed(db.session)
+    account_codes_changed()
     db.session.commit()
+    invalidate_account_cache()
 
     return jsonify({
         "message": "Expense account created successfully",
@@ -477,18 +496,32 @@ def get_expense_account():
 # # Chart of Accounts
 # # -------------------------------
 def build_chart(accounts):
-    """ Recursively build chart of accounts hierarchy """
-    def build_node(acc):
-        return {
-            "id": acc.id,
-            "name": acc.name,
-            "code": acc.code,
-            "account_type": enum_to_str(acc.account_type),
-            "account_subtype": acc.account_subtype,
-            "children": [build_node(child) for child in acc.children if child.status != 9]
+    """ Build chart of accounts hierarchy from one list of accounts (no per-node queries) """
+    nodes = {
+        a.id: {
+            "id": a.id,
+            "name": a.name,
+            "code": a.code,
+            "account_type": enum_to_str(a.account_type),
+            "account_subtype": a.account_subtype,
+            "children": []
         }
-    top_level = [a for a in accounts if not a.parent_id and a.status != 9]
-    return [build_node(a) for a in top_level]
+        for a in accounts if a.status != 9
+    }
+    return _attach(accounts, nodes)
+
+
+def _attach(accounts, nodes):
+    """Hang nodes under their parents; sub-accounts of a soft-deleted account stay hidden."""
+    top_level = []
+    for a in accounts:
+        if a.id not in nodes:
+            continue
+        if not a.parent_id:
+            top_level.append(nodes[a.id])
+        elif a.parent_id in nodes and a.parent_id != a.id:
+            nodes[a.parent_id]["children"].append(nodes[a.id])
+    return top_level
 
 # @accounts_bp.route('/chart', methods=['GET'])
 # @token_required
@@ -506,35 +539,32 @@ def build_chart_grouped(accounts):
     for atype in AccountTypeEnum:
         grouped[atype.value] = []
 
-    # Recursive function to build hierarchy
-    def build_node(acc):
-        children = [build_node(child) for child in acc.children if child.status != 9]
-        return {
-            "id": acc.id,
-            "name": acc.name,
-            "code": acc.code,
-            "account_subtype": acc.account_subtype,
-            "children": children,
-            "child_count": len(children)
+    nodes = {
+        a.id: {
+            "id": a.id,
+            "name": a.name,
+            "code": a.code,
+            "account_subtype": a.account_subtype,
+            "children": []
         }
+        for a in accounts if a.status != 9
+    }
+    types = {a.id: a.account_type.value for a in accounts}
 
     # Assign accounts to their group
-    top_level_accounts = [a for a in accounts if not a.parent_id and a.status != 9]
-    for acc in top_level_accounts:
-        grouped[acc.account_type.value].append(build_node(acc))
+    for node in _attach(accounts, nodes):
+        grouped[types[node["id"]]].append(node)
 
-    # Compute totals per group
+    # Count every node under each group (for demo purposes the "total" is a count)
     totals = {}
     for atype, acc_list in grouped.items():
-        # For demo purposes, we'll use count of accounts as "total"
-        def count_nodes(nodes):
-            total = 0
-            for n in nodes:
-                total += 1
-                if n['children']:
-                    total += count_nodes(n['children'])
-            return total
-        totals[atype] = count_nodes(acc_list)
+        stack, count = list(acc_list), 0
+        while stack:
+            node = stack.pop()
+            node["child_count"] = len(node["children"])
+            count += 1
+            stack.extend(node["children"])
+        totals[atype] = count
 
     return {"grouped_accounts": grouped, "totals": totals}
 
@@ -551,13 +581,13 @@ def build_chart_grouped(accounts):
 @token_required
 @permission_required("view_ledger")
 def get_chart_of_accounts():
-    accounts = Account.query.all()
+    accounts = Account.query.order_by(Account.code).all()
     return jsonify(build_chart(accounts))
 
 @accounts_bp.route('/chart-report', methods=['GET'])
 @token_required
 @permission_required("view_ledger")
 def chart_of_accounts_report():
-    accounts = Account.query.all()
+    accounts = Account.query.order_by(Account.code).all()
     report = build_chart_grouped(accounts)
     return jsonify(report)
\ No newline at end of file
@@ -2,7 +2,7 @@ from flask import Blueprint, request, jsonify
 from app import db
 from app.models import Account, Expense, ExpenseItem, GeneralLedger
 from app.utils.auth import token_required
-from app.utils.gl_utils import post_to_ledger, generate_transaction_number
+from app.utils.gl_utils import document_lines, generate_transaction_number, post_to_ledger, reverse_ledger
 from datetime import datetime
 
 from flask import request, jsonify
@@ -60,6 +60,7 @@ def create_expense():
             amount = float(item.get('amount', 0))
 
             if not account_id or not item_name or amount <= 0:
+                db.session.rollback()
                 return jsonify({"error": "Each item must have account_id, item_name, and amount > 0"}), 400
 
             total_amount += amount
@@ -101,7 +102,9 @@ def create_expense():
             gl_entries,
             transaction_no_id=txn_id,
             description=f"Expense #{expense.id}: {description}",
-            transaction_date=expense_date_obj
+            transaction_date=expense_date_obj,
+            source_type='expense',
+            source_id=expense.id
         )
 
         # Commit everything
@@ -114,6 +117,9 @@ def create_expense():
             "total_amount": total_amount
         }), 201
 
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
@@ -324,19 +330,11 @@ def update_expense(id):
         expense_date_obj = datetime.strptime(new_expense_date, '%Y-%m-%d')
 
         # --- Reverse previous GL entries ---
-        if expense.transaction_no:
-            original_entries = GeneralLedger.query.filter_by(transaction_no=expense.transaction_no).all()
-            for entry in original_entries:
-                reverse_type = 'Credit' if entry.transaction_type == 'Debit' else 'Debit'
-                reverse_entry = GeneralLedger(
-                    account_id=entry.account_id,
-                    transaction_type=reverse_type,
-                    amount=entry.amount,
-                    description=f"Reversal of {entry.description} before update",
-                    transaction_date=datetime.utcnow(),
-                    transaction_no=entry.transaction_no
-                )
-                db.session.add(reverse_entry)
+        if expense.transaction_no and not reverse_ledger(document_lines('expense', [expense.id])):
+            raise ValueError(
+                f"No GL lines are linked to expense #{expense.id}; "
+                "run the general_ledger source backfill in migrations.sql"
+            )
 
         # --- Update expense header ---
         expense.description = new_description
@@ -360,6 +358,7 @@ def update_expense(id):
             amount = float(item.get('amount', 0))
 
             if not account_id or not item_name or amount <= 0:
+                db.session.rollback()
                 return jsonify({"error": "Each item must have account_id, item_name, and amount > 0"}), 400
 
             total_amount += amount
@@ -401,7 +400,9 @@ def update_expense(id):
             gl_entries,
             transaction_no_id=txn_id,
             description=f"Updated Expense #{expense.id}: {new_description}",
-            transaction_date=expense_date_obj
+            transaction_date=expense_date_obj,
+            source_type='expense',
+            source_id=expense.id
         )
 
         db.session.commit()
@@ -413,6 +414,9 @@ def update_expense(id):
             "total_amount": total_amount
         }), 200
 
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
@@ -450,46 +454,21 @@ def update_expense(id):
 @expenses_bp.route('/<int:id>', methods=['DELETE'])
 def delete_expense(id):
     expense = Expense.query.get_or_404(id)
+    if expense.status == 9:
+        return jsonify({"error": "Expense already deleted"}), 400
 
-    # Reverse GL entries for the main transaction
+    # Reverse the expense's GL lines (every item debit and the payment credit)
     if expense.transaction_no:
-        original_entries = GeneralLedger.query.filter_by(transaction_no=expense.transaction_no).all()
-        for entry in original_entries:
-            reverse_type = 'Credit' if entry.transaction_type == 'Debit' else 'Debit'
-            reverse_entry = GeneralLedger(
-                account_id=entry.account_id,
-                transaction_type=reverse_type,
-                amount=entry.amount,
-                description=f"Reversal of {entry.description} on expense deletion",
-                transaction_date=datetime.utcnow(),
-                transaction_no=entry.transaction_no
-            )
-            db.session.add(reverse_entry)
-
-        # Reverse each expense item individually as double entry
-        for item in expense.items:
-            if item.account_id and item.amount:
-                # Reverse entry for the item account
-                reverse_item_entry = GeneralLedger(
-                    account_id=item.account_id,
-                    transaction_type='Credit',  # Assuming original was Debit
-                    amount=item.amount,
-                    description=f"Reversal of expense item {item.item_name}",
-                    transaction_date=datetime.utcnow(),
-                    transaction_no=expense.transaction_no
-                )
-                db.session.add(reverse_item_entry)
-
-                # Counter-entry for payment account
-                reverse_payment_entry = GeneralLedger(
-                    account_id=expense.payment_account_id,
-                    transaction_type='Debit',  # Assuming original was Credit
-                    amount=item.amount,
-                    description=f"Reversal of payment for expense item {item.item_name}",
-                    transaction_date=datetime.utcnow(),
-                    transaction_no=expense.transaction_no
+        try:
+            reversed_lines = reverse_ledger(document_lines('expense', [expense.id]))
+            if not reversed_lines:
+                raise ValueError(
+                    f"No GL lines are linked to expense #{expense.id}; "
+                    "run the general_ledger source backfill in migrations.sql"
                 )
-                db.session.add(reverse_payment_entry)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), 400
 
     # Soft delete by setting status = 9
     expense.status = 9
@@ -266,9 +266,12 @@
 #     return jsonify({"message": "Category deleted", "category_id": id})
 from flask import Blueprint, request, jsonify
 from app import db
-from app.models import Product, Category, ProductUnit, PurchaseOrderItem
+from app.models import Product, Category, ProductUnit, ProductCost
+from app.utils.costing import latest_cost_prices, refresh_product_costs
+from app.utils.catalog import catalog_changed, invalidate_catalog, search_catalog
+from app.utils.pagination import encode_cursor, decode_cursor
 from datetime import datetime
-from sqlalchemy import or_, text
+from sqlalchemy import func, or_, select, text, tuple_
 from app.utils.auth import token_required
 
 inventory_bp = Blueprint('inventory', __name__, url_prefix='/inventory')
@@ -278,83 +281,7 @@ inventory_bp = Blueprint('inventory', __name__, url_prefix='/inventory')
 # Helper: latest cost price (still used for display in the table)
 # ----------------------------------------------------------------------
 def get_latest_cost_price(product_id):
-    latest_po_item = (
-        PurchaseOrderItem.query
-        .filter_by(product_id=product_id)
-        .filter(PurchaseOrderItem.status != 9)
-        .order_by(PurchaseOrderItem.id.desc())
-        .first()
-    )
-    return latest_po_item.unit_price if latest_po_item else 0.0
-
-
-# ----------------------------------------------------------------------
-# Re-build product.quantity (base units) from purchases & sales
-# ----------------------------------------------------------------------
-from sqlalchemy import text
-
-def rebuild_product_quantities():
-    try:
-        sql = text("""
-        WITH purchase_totals AS (
-            SELECT 
-                poi.product_id,
-                COALESCE(SUM(poi.quantity * COALESCE(pu.conversion_quantity, 1.0)), 0) AS total_purchased_base
-            FROM purchase_order_item poi
-            LEFT JOIN product_unit pu ON poi.unit_id = pu.id
-            WHERE poi.status != 9
-            GROUP BY poi.product_id
-        ),
-        sale_totals AS (
-            SELECT 
-                si.product_id,
-                COALESCE(SUM(si.quantity * COALESCE(pu.conversion_quantity, 1.0)), 0) AS total_sold_base
-            FROM sale_item si
-            LEFT JOIN product_unit pu ON si.unit_id = pu.id
-            WHERE si.status != 9
-            GROUP BY si.product_id
-        ),
-        adjustment_totals AS (
-            SELECT
-                sa.product_id,
-                COALESCE(SUM(
-                    CASE
-                        WHEN UPPER(sa.adjustment_type) = 'INCREASE'
-                            THEN sa.quantity * COALESCE(pu.conversion_quantity, 1.0)
-                        WHEN UPPER(sa.adjustment_type) = 'DECREASE'
-                            THEN -1 * sa.quantity * COALESCE(pu.conversion_quantity, 1.0)
-                        ELSE 0
-                    END
-                ), 0) AS total_adjusted_base
-            FROM stock_adjustment sa
-            LEFT JOIN product_unit pu ON sa.unit_id = pu.id
-            WHERE sa.status != 9
-            GROUP BY sa.product_id
-        )
-
-        UPDATE product p
-        SET quantity =
-            COALESCE(pur.total_purchased_base, 0)
-          - COALESCE(sal.total_sold_base, 0)
-          + COALESCE(adj.total_adjusted_base, 0)
-
-        FROM purchase_totals pur
-        FULL JOIN sale_totals sal 
-            ON pur.product_id = sal.product_id
-        FULL JOIN adjustment_totals adj
-            ON COALESCE(pur.product_id, sal.product_id) = adj.product_id
-
-        WHERE p.id = COALESCE(pur.product_id, sal.product_id, adj.product_id);
-        """)
-
-        db.session.execute(sql)
-        db.session.commit()
-        print("✅ Product quantities rebuilt successfully (including stock adjustments).")
-
-    except Exception as e:
-        db.session.rollback()
-        print(f"❌ Failed to rebuild product quantities: {e}")
-
+    return latest_cost_prices([product_id]).get(product_id, 0.0)
 
 
 # ----------------------------------------------------------------------
@@ -370,7 +297,7 @@ def add_product():
         name=data['name'],
         sku=data['sku'],
         category_id=data.get('category_id'),
-        quantity=0.0,                     # always calculated later
+        quantity=0.0,                     # maintained by purchases, sales & adjustments
         price=0.0,                        # ignored – price lives in units
         wholesale_price=0.0,
         status=1
@@ -396,47 +323,139 @@ def add_product():
         )
         db.session.add(unit)
 
+    catalog_changed()
     db.session.commit()
+    invalidate_catalog()
     return jsonify({"message": "Product added", "product_id": product.id}), 201
 
 
 # ----------------------------------------------------------------------
-# LIST ALL PRODUCTS (for table)
+# LIST PRODUCTS (for table) – keyset paginated, fixed number of queries
 # ----------------------------------------------------------------------
+PRODUCT_SORTS = {
+    "name": Product.name,
+    "sku": Product.sku,
+    "category": func.coalesce(Category.name, ''),
+}
+
+
+def serialize_products(rows):
+    """rows: [(Product, category_name)] -> table dicts, with units and cost
+    loaded in one query each for the whole batch."""
+    product_ids = [p.id for p, _ in rows]
+    units_by_product = {}
+    if product_ids:
+        units = (
+            ProductUnit.query
+            .filter(ProductUnit.product_id.in_(product_ids), ProductUnit.status == 1)
+            .order_by(ProductUnit.id)
+            .all()
+        )
+        for u in units:
+            units_by_product.setdefault(u.product_id, []).append({
+                "id": u.id,
+                "unit_name": u.unit_name,
+                "conversion_quantity": u.conversion_quantity,
+                "retail_price": u.retail_price,
+                "wholesale_price": u.wholesale_price,
+                "is_returnable": u.is_returnable,
+                "unit_code": u.unit_code
+            })
+    costs = latest_cost_prices(product_ids)
+
+    return [{
+        "id": p.id,
+        "name": p.name,
+        "sku": p.sku,
+        "category_id": p.category_id,
+        "category_name": category_name,
+        "quantity": round(p.quantity or 0, 4),
+        # NOTE: price/wholesale_price on product are **not** returned
+        "cost_price": costs.get(p.id, 0.0),
+        "units": units_by_product.get(p.id, []),
+        "status": p.status
+    } for p, category_name in rows]
+
+
 @token_required
 @inventory_bp.route('/products', methods=['GET'])
 def list_products():
-    rebuild_product_quantities()
-    prods = Product.query.filter(Product.status == 1).all()
-    result = []
-
-    for p in prods:
-        cat = Category.query.filter_by(id=p.category_id, status=1).first()
-        units = ProductUnit.query.filter_by(product_id=p.id, status=1).all()
-        units_data = [{
-            "id": u.id,
-            "unit_name": u.unit_name,
-            "conversion_quantity": u.conversion_quantity,
-            "retail_price": u.retail_price,
-            "wholesale_price": u.wholesale_price,
-            "is_returnable": u.is_returnable,
-            "unit_code": u.unit_code
-        } for u in units]
-
-        result.append({
-            "id": p.id,
-            "name": p.name,
-            "sku": p.sku,
-            "category_id": p.category_id,
-            "category_name": cat.name if cat else None,
-            "quantity": round(p.quantity, 4),
-            # NOTE: price/wholesale_price on product are **not** returned
-            "cost_price": get_latest_cost_price(p.id),
-            "units": units_data,
-            "status": p.status
-        })
-
-    return jsonify(result)
+    """
+    Query params (all optional):
+      search       – name / SKU contains (case-insensitive)
+      category_id  – only this category
+      sort         – name (default) | sku | category;  order – asc | desc
+      limit        – page size; when given the response is paginated:
+                     {"items": [...], "next_cursor": str|null, "total": int|null}
+      cursor       – next_cursor of the previous page
+
+    Without limit/cursor the whole catalog is returned as a plain array, as
+    before (dropdowns rely on it). Either way it takes 3 queries: products
+    with their category, active units, latest costs.
+
+    "total" is only computed for the first page, with count(*) OVER () in the
+    page query itself, so there is no second scan; later pages return null
+    and the client keeps the first page's total.
+    """
+    search = (request.args.get('search') or '').strip()
+    category_id = request.args.get('category_id', type=int)
+    sort = request.args.get('sort', 'name')
+    descending = request.args.get('order', 'asc').lower() == 'desc'
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+
+    if sort not in PRODUCT_SORTS:
+        return jsonify({"error": f"sort must be one of {', '.join(PRODUCT_SORTS)}"}), 400
+    sort_col = PRODUCT_SORTS[sort]
+    paginated = limit is not None or cursor is not None
+    limit = max(1, min(limit or 50, 500))
+
+    query = (
+        db.session.query(Product, Category.name)
+        .outerjoin(Category, (Category.id == Product.category_id) & (Category.status == 1))
+        .filter(Product.status == 1)
+    )
+    if search:
+        query = query.filter(or_(Product.name.ilike(f"%{search}%"), Product.sku.ilike(f"%{search}%")))
+    if category_id:
+        query = query.filter(Product.category_id == category_id)
+
+    if not paginated:
+        rows = query.order_by(sort_col, Product.id).all()
+        return jsonify(serialize_products(rows))
+
+    if cursor:
+        try:
+            last_value, last_id = decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        key = tuple_(sort_col, Product.id)
+        query = query.filter(key < (last_value, last_id) if descending else key > (last_value, last_id))
+    else:
+        query = query.add_columns(func.count().over().label('total'))
+
+    order = (sort_col.desc(), Product.id.desc()) if descending else (sort_col, Product.id)
+    page = query.order_by(*order).limit(limit + 1).all()
+
+    total = None
+    if not cursor:
+        total = page[0][2] if page else 0
+    has_more = len(page) > limit
+    page = page[:limit]
+    rows = [(r[0], r[1]) for r in page]
+
+    next_cursor = None
+    if has_more:
+        p, category_name = rows[-1]
+        sort_value = {"name": p.name, "sku": p.sku, "category": category_name or ''}[sort]
+        next_cursor = encode_cursor([sort_value, p.id])
+
+    return jsonify({
+        "items": serialize_products(rows),
+        "next_cursor": next_cursor,
+        "total": total,
+        "limit": limit
+    })
 
 
 # ----------------------------------------------------------------------
@@ -445,7 +464,6 @@ def list_products():
 @token_required
 @inventory_bp.route('/products/<int:id>', methods=['GET'])
 def get_product(id):
-    rebuild_product_quantities()
     p = Product.query.get_or_404(id)
     cat = Category.query.filter_by(id=p.category_id, status=1).first()
 
@@ -469,7 +487,7 @@ def get_product(id):
 def get_product_units(id):
     Product.query.get_or_404(id)  # just to 404 if product missing
     units = ProductUnit.query.filter_by(product_id=id, status=1).all()
-    purchase_price = PurchaseOrderItem.query.filter_by(product_id=id, status=1).first()
+    base_cost = get_latest_cost_price(id)
     product = Product.query.filter_by(id=id).first()
 
     units_data = [{
@@ -480,7 +498,7 @@ def get_product_units(id):
         "wholesale_price": u.wholesale_price,
         "is_returnable": u.is_returnable,
         "unit_code": u.unit_code,
-        "cost_price":purchase_price.unit_price if purchase_price else 0,
+        "cost_price": base_cost * (u.conversion_quantity or 1),
         "quantity":product.quantity if product else 0,
     } for u in units]
 
@@ -548,8 +566,10 @@ def update_product(id):
 
         db.session.flush()
 
-
+    refresh_product_costs([id])  # unit conversions feed base_cost
+    catalog_changed()
     db.session.commit()
+    invalidate_catalog()
     return jsonify({"message": "Product updated", "product_id": id})
 
 
@@ -561,7 +581,9 @@ def update_product(id):
 def delete_product(id):
     product = Product.query.get_or_404(id)
     product.status = 9
+    catalog_changed()
     db.session.commit()
+    invalidate_catalog()
         # cascade deletes units
     # db.session.commit()
     return jsonify({"message": "Product deleted", "product_id": id})
@@ -602,7 +624,9 @@ def update_category(id):
     c.name = data.get('name', c.name)
     c.description = data.get('description', c.description)
     c.updated_at = datetime.utcnow()
+    catalog_changed()
     db.session.commit()
+    invalidate_catalog()
     return jsonify({"message": "Category updated"})
 
 
@@ -611,41 +635,44 @@ def update_category(id):
 def delete_category(id):
     c = Category.query.get_or_404(id)
     db.session.delete(c)
+    catalog_changed()
     db.session.commit()
+    invalidate_catalog()
     return jsonify({"message": "Category deleted"})
 
 
 # ----------------------------------------------------------------------
-# SEARCH PRODUCTS (for autocomplete in sales)
+# BARCODE LOOKUP (scanner on the sales screen) – one indexed probe
 # ----------------------------------------------------------------------
+@inventory_bp.route('/products/barcode/<string:code>', methods=['GET'])
 @token_required
-@inventory_bp.route('/products/search', methods=['GET'])
-def search_products():
-    query = request.args.get('name', '').strip()
-    if not query:
-        return jsonify([])
-
-    # Search by name or SKU (case-insensitive)
-    search_pattern = f"%{query}%"
-    products = Product.query.filter(
-        Product.status == 1,
-        or_(
-            Product.name.ilike(search_pattern),
-            Product.sku.ilike(search_pattern)
-        )
-    ).limit(20).all()  # limit results for performance
-    # details = db.session.query(PurchaseOrderItem.unit_price).filter(PurchaseOrderItem.product_id).first()
-
-
-    result = []
-    for p in products:
-        cat = Category.query.get(p.category_id)
-
-        # Load units
-        units = ProductUnit.query.filter_by(product_id=p.id, status=1).all()
-        purchase_price = PurchaseOrderItem.query.filter_by(product_id=p.id, status=1).first()
+def get_product_by_barcode(code):
+    base_cost = (
+        select(ProductCost.base_cost)
+        .where(ProductCost.product_id == Product.id)
+        .order_by(ProductCost.purchase_order_item_id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    row = (
+        db.session.query(ProductUnit, Product, Category.name, base_cost)
+        .join(Product, Product.id == ProductUnit.product_id)
+        .outerjoin(Category, Category.id == Product.category_id)
+        .filter(ProductUnit.unit_code == code.strip(), ProductUnit.status == 1, Product.status == 1)
+        .first()
+    )
+    if not row:
+        return jsonify({"error": f"No product with barcode {code}"}), 404
 
-        units_data = [{
+    u, p, category_name, cost = row
+    return jsonify({
+        "id": p.id,
+        "name": p.name,
+        "sku": p.sku,
+        "category_id": p.category_id,
+        "category_name": category_name,
+        "quantity": round(float(p.quantity or 0), 4),
+        "unit": {
             "id": u.id,
             "unit_name": u.unit_name,
             "conversion_quantity": float(u.conversion_quantity),
@@ -653,17 +680,21 @@ def search_products():
             "wholesale_price": float(u.wholesale_price or 0),
             "is_returnable": bool(u.is_returnable),
             "unit_code": u.unit_code,
-            "purchase_price":purchase_price.unit_price if purchase_price else 0
-        } for u in units]
-
-        result.append({
-            "id": p.id,
-            "name": p.name,
-            "sku": p.sku,
-            "category_id": p.category_id,
-            "category_name": cat.name if cat else None,
-            "quantity": round(float(p.quantity), 4),
-            "units": units_data  # ← Critical for sales page!
-        })
-
-    return jsonify(result)
\ No newline at end of file
+            "purchase_price": float(cost or 0) * float(u.conversion_quantity or 1)
+        }
+    })
+
+
+# ----------------------------------------------------------------------
+# SEARCH PRODUCTS (for autocomplete in sales)
+# ----------------------------------------------------------------------
+@token_required
+@inventory_bp.route('/products/search', methods=['GET'])
+def search_products():
+    """Autocomplete for the sales screen, answered from the worker-local
+    catalog cache (app/utils/catalog.py) instead of the database."""
+    query = request.args.get('name', '').strip()
+    if not query:
+        return jsonify([])
+
+    return jsonify(search_catalog(query, limit=20))
@@ -2,8 +2,10 @@ from flask import Blueprint, request, jsonify
 from app import db
 from app.models import GeneralLedger, Account
 from datetime import datetime
+from sqlalchemy import select
 
 from app.utils.auth import token_required
+from app.utils.export import export_params, filtered, stream_export
 
 ledger_bp = Blueprint('ledger', __name__, url_prefix='/ledger')
 
@@ -27,7 +29,11 @@ def add_transaction():
         updated_at=datetime.utcnow()
     )
     db.session.add(entry)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except ValueError as e:  # closed accounting period
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
     return jsonify({"message": "Transaction recorded", "entry_id": entry.id})
 
 
@@ -53,6 +59,30 @@ def get_ledger():
     return jsonify(data)
 
 
+# --- Export ledger lines (streaming NDJSON/CSV, params in app.utils.export) ---
+@ledger_bp.route('/export', methods=['GET'])
+@token_required
+def export_ledger():
+    try:
+        params = export_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    stmt = (
+        select(
+            GeneralLedger.id, GeneralLedger.transaction_date, GeneralLedger.account_id,
+            Account.code.label("account_code"), Account.name.label("account_name"),
+            GeneralLedger.transaction_type, GeneralLedger.amount, GeneralLedger.description,
+            GeneralLedger.transaction_no, GeneralLedger.status
+        )
+        .join(Account, Account.id == GeneralLedger.account_id)
+        .where(GeneralLedger.status != 9)
+    )
+    return stream_export(
+        filtered(stmt, GeneralLedger.id, GeneralLedger.transaction_date, params), params, "general_ledger"
+    )
+
+
 # --- Get ledger by account ---
 @token_required
 @ledger_bp.route('/account/<int:account_id>', methods=['GET'])
@@ -90,7 +120,11 @@ def update_entry(entry_id):
     entry.transaction_date = data.get('transaction_date', entry.transaction_date)
     entry.updated_at = datetime.utcnow()
     entry.status = 1
-    db.session.commit()
+    try:
+        db.session.commit()
+    except ValueError as e:  # closed accounting period
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
     return jsonify({"message": "Transaction updated", "entry_id": entry.id})
 
 
@@ -101,5 +135,9 @@ def delete_entry(entry_id):
     entry = GeneralLedger.query.get_or_404(entry_id)
     entry.status = 0
     entry.updated_at = datetime.utcnow()
-    db.session.commit()
+    try:
+        db.session.commit()
+    except ValueError as e:  # closed accounting period
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
     return jsonify({"message": "Transaction marked inactive", "entry_id": entry_id})
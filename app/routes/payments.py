@@ -3,7 +3,8 @@ from datetime import datetime
 from app import db
 from app.models import Account, Payment, Sale, GeneralLedger
 from app.utils.auth import token_required
-from app.utils.gl_utils import post_to_ledger, generate_transaction_number
+from app.utils.gl_utils import document_lines, generate_transaction_number, post_to_ledger, reverse_ledger
+from app.utils.idempotency import idempotent
 from sqlalchemy.orm import joinedload
 
 
@@ -26,10 +27,21 @@ def recalc_sale_payment_status(sale_id):
     return total_paid, status
 
 
+def _checkout_payment_error(payment, sale):
+    """Payments taken at checkout post inside the sale's own GL entry and cannot be reversed alone."""
+    if payment.transaction_no and sale and payment.transaction_no == sale.transaction_no:
+        return jsonify({
+            "error": f"Payment #{payment.id} was taken at checkout of sale #{sale.id}; "
+                     "delete or edit the sale to reverse it"
+        }), 400
+    return None
+
+
 
 # ------------------ Record a Payment ------------------
 @token_required
 @payments_bp.route('/', methods=['POST'])
+@idempotent('add_payment')
 def add_payment():
     data = request.json
     sale = Sale.query.get(data['sale_id'])
@@ -61,20 +73,6 @@ def add_payment():
     # ----------------- Generate Transaction Number -----------------
     txn_id, txn_no_str = generate_transaction_number('PAY', transaction_date=transaction_date)
 
-    # ----------------- Post to General Ledger -----------------
-    entries = [
-        {"account_id": payment_account.code, "transaction_type": "Debit", "amount": amount},  # Cash/Bank
-        {"account_id": 1100, "transaction_type": "Credit", "amount": amount}  # Accounts Receivable
-    ]
-    gl_entries = post_to_ledger(
-        entries,
-        transaction_no_id=txn_id,
-        description=f"Payment for Sale #{sale.id}",
-        transaction_date=transaction_date
-    )
-
-
-    
     # ----------------- Create Payment -----------------
     payment = Payment(
         sale_id=sale.id,
@@ -93,6 +91,24 @@ def add_payment():
     db.session.add(payment)
     db.session.flush()  # So we can access payment.id before commit
 
+    # ----------------- Post to General Ledger -----------------
+    entries = [
+        {"account_id": payment_account.code, "transaction_type": "Debit", "amount": amount},  # Cash/Bank
+        {"account_id": 1100, "transaction_type": "Credit", "amount": amount}  # Accounts Receivable
+    ]
+    try:
+        gl_entries = post_to_ledger(
+            entries,
+            transaction_no_id=txn_id,
+            description=f"Payment for Sale #{sale.id}",
+            transaction_date=transaction_date,
+            source_type='payment',
+            source_id=payment.id
+        )
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+
     # ----------------- Update Sale Totals -----------------
     total_paid, payment_status = recalc_sale_payment_status(sale.id)
     
@@ -143,22 +159,22 @@ def update_payment(payment_id):
     new_amount = data.get('amount', payment.amount)
     new_payment_type = data.get('payment_type', payment.payment_type)
     new_reference = data.get('reference', payment.reference)
+    error = _checkout_payment_error(payment, sale)
+    if error:
+        return error
 
     # Reverse previous GL entries
     if payment.transaction_no:
-        original_entries = GeneralLedger.query.filter_by(transaction_no=payment.transaction_no, status=1).all()
-        for entry in original_entries:
-            reverse_type = 'Credit' if entry.transaction_type == 'Debit' else 'Debit'
-            reverse_entry = GeneralLedger(
-                account_id=entry.account_id,
-                transaction_type=reverse_type,
-                amount=entry.amount,
-                description=f"Reversal of {entry.description} before update",
-                transaction_date=datetime.utcnow(),
-                transaction_no=payment.transaction_no,
-                status=1
-            )
-            db.session.add(reverse_entry)
+        try:
+            reversed_lines = reverse_ledger(document_lines('payment', [payment.id]))
+            if not reversed_lines:
+                raise ValueError(
+                    f"No GL lines are linked to payment #{payment.id}; "
+                    "run the general_ledger source backfill in migrations.sql"
+                )
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), 400
 
     # Update payment fields
     payment.amount = new_amount
@@ -174,7 +190,12 @@ def update_payment(payment_id):
         {"account_id": 1, "transaction_type": "Debit", "amount": new_amount},
         {"account_id": 101, "transaction_type": "Credit", "amount": new_amount}
     ]
-    gl_entries = post_to_ledger(entries, transaction_no_id=txn_id, description=f"Updated payment for Sale #{sale.id}")
+    try:
+        gl_entries = post_to_ledger(entries, transaction_no_id=txn_id, description=f"Updated payment for Sale #{sale.id}",
+                                    source_type='payment', source_id=payment.id)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
     payment.transaction_no = txn_id
 
     # Update sale payment status
@@ -195,22 +216,24 @@ def update_payment(payment_id):
 def delete_payment(payment_id):
     payment = Payment.query.get_or_404(payment_id)
     sale = Sale.query.get(payment.sale_id)
+    if payment.status != 1:
+        return jsonify({"error": "Payment already deleted"}), 400
+    error = _checkout_payment_error(payment, sale)
+    if error:
+        return error
 
     # Reverse GL entries
     if payment.transaction_no:
-        original_entries = GeneralLedger.query.filter_by(transaction_no=payment.transaction_no, status=1).all()
-        for entry in original_entries:
-            reverse_type = 'Credit' if entry.transaction_type == 'Debit' else 'Debit'
-            reverse_entry = GeneralLedger(
-                account_id=entry.account_id,
-                transaction_type=reverse_type,
-                amount=entry.amount,
-                description=f"Reversal of {entry.description} on deletion",
-                transaction_date=datetime.utcnow(),
-                transaction_no=payment.transaction_no,
-                status=1
-            )
-            db.session.add(reverse_entry)
+        try:
+            reversed_lines = reverse_ledger(document_lines('payment', [payment.id]))
+            if not reversed_lines:
+                raise ValueError(
+                    f"No GL lines are linked to payment #{payment.id}; "
+                    "run the general_ledger source backfill in migrations.sql"
+                )
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), 400
 
     # Soft delete payment
     payment.status = 0
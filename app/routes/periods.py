@@ -0,0 +1,162 @@
+from flask import Blueprint, jsonify, request
+from sqlalchemy import func, select, union_all
+
+from app import db
+from app.models import Account, AccountingPeriod, GeneralLedger, GeneralLedgerArchive, PeriodClosingBalance
+from app.utils.auth import token_required, permission_required
+from app.utils.periods import (
+    archive_period, close_period, get_period, period_lines, reopen_period, restore_period, serialize_period
+)
+
+periods_bp = Blueprint('periods', __name__, url_prefix='/periods')
+
+
+# ------------------ List closed periods ------------------
+@periods_bp.route('/', methods=['GET'])
+@token_required
+@permission_required("view_ledger")
+def list_periods():
+    periods = AccountingPeriod.query.order_by(AccountingPeriod.period_start.desc()).all()
+    return jsonify([serialize_period(p) for p in periods])
+
+
+# ------------------ Close a month ------------------
+@periods_bp.route('/close', methods=['POST'])
+@token_required
+@permission_required("close_period")
+def close():
+    data = request.get_json(silent=True) or {}
+    try:
+        period = close_period(data.get('period'), user_id=request.user.id)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    return jsonify(serialize_period(period)), 201
+
+
+@periods_bp.route('/<period>/reopen', methods=['POST'])
+@token_required
+@permission_required("close_period")
+def reopen(period):
+    return _period_action(period, reopen_period, "reopened")
+
+
+@periods_bp.route('/<period>/archive', methods=['POST'])
+@token_required
+@permission_required("close_period")
+def archive(period):
+    return _period_action(period, archive_period, "archived")
+
+
+@periods_bp.route('/<period>/restore', methods=['POST'])
+@token_required
+@permission_required("close_period")
+def restore(period):
+    return _period_action(period, restore_period, "restored")
+
+
+def _period_action(value, action, done):
+    try:
+        period = get_period(value)
+        rows = action(period)
+        db.session.commit()
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    body = {"message": f"Period {value} {done}"}
+    if rows is not None:
+        body["gl_lines_moved"] = rows
+    return jsonify(body)
+
+
+# ------------------ Closing balances ------------------
+@periods_bp.route('/<period>/balances', methods=['GET'])
+@token_required
+@permission_required("view_ledger")
+def closing_balances(period):
+    try:
+        p = get_period(period)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = db.session.execute(
+        select(Account.id, Account.code, Account.name, PeriodClosingBalance.debit, PeriodClosingBalance.credit)
+        .join(Account, Account.id == PeriodClosingBalance.account_id)
+        .where(PeriodClosingBalance.period_id == p.id)
+        .order_by(Account.code)
+    ).all()
+    return jsonify({
+        "period": serialize_period(p),
+        "balances": [{
+            "account_id": r.id,
+            "code": r.code,
+            "account_name": r.name,
+            "debit": float(r.debit),
+            "credit": float(r.credit),
+            "balance": float(r.debit - r.credit),
+        } for r in rows],
+    })
+
+
+# ------------------ Drill-down (live or archived lines) ------------------
+@periods_bp.route('/<period>/ledger', methods=['GET'])
+@token_required
+@permission_required("view_ledger")
+def period_ledger(period):
+    try:
+        p = get_period(period)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        page = int(request.args.get('page', 1))
+        page_size = min(int(request.args.get('page_size', 50)), 500)
+    except ValueError:
+        return jsonify({"error": "page and page_size must be integers"}), 400
+    account_id = request.args.get('account_id', type=int)
+
+    # an archived month keeps the lines reversed from outside it in general_ledger
+    models = [GeneralLedger] + ([GeneralLedgerArchive] if p.archived_at is not None else [])
+    parts = []
+    for model in models:
+        part = select(
+            model.id, model.transaction_date, model.account_id, model.transaction_type, model.amount,
+            model.description, model.transaction_no, model.source_type, model.source_id, model.status,
+        ).where(period_lines(model, p))
+        if account_id:
+            part = part.where(model.account_id == account_id)
+        parts.append(part)
+    rows = (union_all(*parts) if len(parts) > 1 else parts[0]).subquery()
+
+    total = db.session.execute(select(func.count()).select_from(rows)).scalar()
+    lines = db.session.execute(
+        select(rows, Account.name.label('account_name'))
+        .join(Account, Account.id == rows.c.account_id)
+        .order_by(rows.c.transaction_date, rows.c.id)
+        .offset((page - 1) * page_size)
+        .limit(page_size)
+    ).all()
+    return jsonify({
+        "period": serialize_period(p),
+        "page": page,
+        "page_size": page_size,
+        "total_records": total,
+        "data": [{
+            "id": l.id,
+            "transaction_date": l.transaction_date.isoformat() if l.transaction_date else None,
+            "account_id": l.account_id,
+            "account_name": l.account_name,
+            "transaction_type": l.transaction_type,
+            "amount": float(l.amount),
+            "description": l.description,
+            "transaction_no": l.transaction_no,
+            "source_type": l.source_type,
+            "source_id": l.source_id,
+            "status": l.status,
+        } for l in lines],
+    })
@@ -1,21 +1,42 @@
 from flask import Blueprint, jsonify
-from app.models import AccountTypeEnum, Category, GeneralLedger, Payment, ProductUnit, PurchaseOrderItem, SaleItem, PurchaseOrder, Expense,Customer, Supplier, Sale, PurchaseOrder, Product, Account
+from app.models import AccountDailyBalance, AccountTypeEnum, Category, GeneralLedger, Payment, ProductUnit, PurchaseOrderItem, SaleItem, PurchaseOrder, Expense,Customer, Supplier, Sale, PurchaseOrder, Product, Account
 from app import db
 from sqlalchemy import func
 from datetime import datetime, timedelta
 from sqlalchemy.orm import joinedload
 
+from app.utils.account_tree import attach_children, nearest_active_parent, subtree_sums
+from app.utils.aging import CREDITORS, DEBTORS, aging_page, bucket_labels, parse_buckets, party_buckets
 from app.utils.auth import token_required
-from flask import request, jsonify
-from sqlalchemy import func, and_, cast, String,or_,case
+from app.utils.periods import balances_through
+from app.utils.profit_loss import (
+    comparison, load_profit_loss, parse_range, period_columns, statement, totals, year_to_date
+)
+from app.utils.report_cache import cached_report
+from app.utils.report_jobs import get_job, public_view, report_progress, result_body, submit_job
+from app.utils.sales_profit import line_filters, sales_profit_groups, sales_profit_lines, sales_profit_totals
+from flask import Response, request, jsonify, url_for
+from sqlalchemy import func, and_, cast, String,or_,case, literal, select, union_all
 
 
 
 reports_bp = Blueprint('reports', __name__, url_prefix='/reports')
 
+# The financial statements (trial balance, cash flow, P&L, balance sheet)
+# sum account_daily_balance, one row per account and day kept current by
+# post_to_ledger, instead of scanning general_ledger. Opening and as-of
+# balances start from the latest closed period's snapshot
+# (balances_through), so only open days are summed. GL amounts are stored
+# unsigned, so SUM(general_ledger.amount) is debit + credit.
+# Those reports and the GL listing are @cached_report: repeat views are
+# served from the report cache until the ledger version moves.
+ADB = AccountDailyBalance
+gl_amount = ADB.debit + ADB.credit
+
 # ------------------ General Ledger ------------------
 @token_required
 @reports_bp.route('/general-ledger', methods=['GET'])
+@cached_report
 def general_ledger():
     # ---------- Query params ----------
     try:
@@ -64,7 +85,7 @@ def general_ledger():
         query = query.filter(
             or_(
                 db.func.lower(Account.name).ilike(search_str),
-                db.func.lower(GeneralLedger.description).ilike(search_str),
+                GeneralLedger.description.ilike(search_str),  # pg_trgm index
                 db.func.lower(Account.account_subtype).ilike(search_str),
                 db.func.lower(Account.account_type.cast(db.String)).ilike(search_str)
             )
@@ -134,6 +155,7 @@ def general_ledger():
 # ------------------ Hierarchical Trial Balance (with Debit/Credit Columns) ------------------
 @token_required
 @reports_bp.route("/trial-balance", methods=["GET"])
+@cached_report
 def trial_balance():
     """
     Returns a hierarchical Trial Balance with Opening, Movement, and Closing balances.
@@ -152,59 +174,57 @@ def trial_balance():
         return jsonify({"error": "Dates must be in YYYY-MM-DD format"}), 400
 
     filters = [Account.status != 9]
-    gl_filters = [GeneralLedger.status != 9]
 
-    # --- Subqueries ---
+    # --- Subqueries (daily balances) ---
     # Opening balances (split debit/credit)
-    opening_query = (
-        db.session.query(
-            GeneralLedger.account_id,
-            func.sum(case((GeneralLedger.amount > 0, GeneralLedger.amount), else_=0)).label("opening_debit"),
-            func.sum(case((GeneralLedger.amount < 0, -GeneralLedger.amount), else_=0)).label("opening_credit"),
-        )
-        .filter(*gl_filters)
-        .filter(GeneralLedger.transaction_date < start_date if start_date else True)
-        .group_by(GeneralLedger.account_id)
-        .subquery()
-    )
+    opening_query = balances_through(start_date.date() - timedelta(days=1) if start_date else None)
 
     # Movement within the period
     movement_query = (
         db.session.query(
-            GeneralLedger.account_id,
-            func.sum(case((GeneralLedger.amount > 0, GeneralLedger.amount), else_=0)).label("movement_debit"),
-            func.sum(case((GeneralLedger.amount < 0, -GeneralLedger.amount), else_=0)).label("movement_credit"),
+            ADB.account_id,
+            func.sum(ADB.debit).label("movement_debit"),
+            func.sum(ADB.credit).label("movement_credit"),
         )
-        .filter(*gl_filters)
         .filter(
             and_(
-                GeneralLedger.transaction_date >= start_date if start_date else True,
-                GeneralLedger.transaction_date <= end_date if end_date else True,
+                ADB.day >= start_date.date() if start_date else True,
+                ADB.day <= end_date.date() if end_date else True,
             )
         )
-        .group_by(GeneralLedger.account_id)
+        .group_by(ADB.account_id)
         .subquery()
     )
 
+    # --- Roll every account's subtree up in SQL (account_closure) ---
+    figures = union_all(
+        select(opening_query.c.account_id, opening_query.c.debit.label("opening_debit"),
+               opening_query.c.credit.label("opening_credit"),
+               literal(0.0).label("movement_debit"), literal(0.0).label("movement_credit")),
+        select(movement_query.c.account_id, literal(0.0), literal(0.0),
+               movement_query.c.movement_debit, movement_query.c.movement_credit),
+    ).subquery()
+    rolled = subtree_sums(figures, "opening_debit", "opening_credit", "movement_debit", "movement_credit")
+
     # --- Fetch accounts ---
     raw_accounts = (
         db.session.query(
             Account.id,
             Account.name,
             Account.account_type,
-            Account.parent_id,
-            func.coalesce(opening_query.c.opening_debit, 0).label("opening_debit"),
-            func.coalesce(opening_query.c.opening_credit, 0).label("opening_credit"),
-            func.coalesce(movement_query.c.movement_debit, 0).label("movement_debit"),
-            func.coalesce(movement_query.c.movement_credit, 0).label("movement_credit"),
+            nearest_active_parent().label("parent_id"),
+            func.coalesce(rolled.c.opening_debit, 0).label("opening_debit"),
+            func.coalesce(rolled.c.opening_credit, 0).label("opening_credit"),
+            func.coalesce(rolled.c.movement_debit, 0).label("movement_debit"),
+            func.coalesce(rolled.c.movement_credit, 0).label("movement_credit"),
         )
-        .outerjoin(opening_query, opening_query.c.account_id == Account.id)
-        .outerjoin(movement_query, movement_query.c.account_id == Account.id)
+        .outerjoin(rolled, rolled.c.account_id == Account.id)
         .filter(*filters)
+        .order_by(Account.code)
         .all()
     )
 
-    # --- Build dict ---
+    # --- Build dict (figures already include sub-accounts) ---
     accounts_dict = {}
     for a in raw_accounts:
         opening_balance = a.opening_debit - a.opening_credit
@@ -224,26 +244,7 @@ def trial_balance():
             "children": []
         }
 
-    # --- Build hierarchy ---
-    root_accounts = []
-    for acc in accounts_dict.values():
-        if acc["parent_id"] and acc["parent_id"] in accounts_dict:
-            accounts_dict[acc["parent_id"]]["children"].append(acc)
-        else:
-            root_accounts.append(acc)
-
-    # --- Recursive roll-up ---
-    def roll_up(acc):
-        for child in acc["children"]:
-            roll_up(child)
-            acc["opening_debit"] += child["opening_debit"]
-            acc["opening_credit"] += child["opening_credit"]
-            acc["movement_debit"] += child["movement_debit"]
-            acc["movement_credit"] += child["movement_credit"]
-            acc["closing_balance"] += child["closing_balance"]
-
-    for r in root_accounts:
-        roll_up(r)
+    root_accounts = attach_children(accounts_dict)
 
     # --- Group and subtotal ---
     grouped = {}
@@ -423,23 +424,15 @@ def trial_balance_old():
 # ------------------ Profit & Loss ------------------
 @token_required
 @reports_bp.route('/profit-loss', methods=['GET'])
+@cached_report
 def profit_loss():
-    # Total sales
-    total_sales = db.session.query(func.coalesce(func.sum(GeneralLedger.amount), 0)).join(Account).filter(
-        GeneralLedger.status != 9,
-        Account.account_type.ilike('%Revenue%')
-    ).scalar()
-
-    # Total expenses
-    total_expenses = db.session.query(func.coalesce(func.sum(GeneralLedger.amount), 0)).join(Account).filter(
-        GeneralLedger.status != 9,
-        Account.account_type.ilike('%Expense%')
-    ).scalar()
+    pl = load_profit_loss()
+    t = totals(pl, range(len(pl.months)))
 
     result = {
-        "total_sales": float(total_sales),
-        "total_expenses": float(total_expenses),
-        "net_profit": float(total_sales - total_expenses)
+        "total_sales": t["total_revenue"],
+        "total_expenses": t["total_cogs"] + t["total_expenses"],
+        "net_profit": t["net_profit"]
     }
 
     return jsonify(result)
@@ -479,6 +472,7 @@ def profit_loss():
 
 @token_required
 @reports_bp.route("/cash-flow", methods=["GET"])
+@cached_report
 def cash_flow():
     """
     Returns a hierarchical cash flow statement with Opening, Movement, and Closing balances.
@@ -496,56 +490,53 @@ def cash_flow():
     except ValueError:
         return jsonify({"error": "Dates must be in YYYY-MM-DD format"}), 400
 
-    gl_filters = [GeneralLedger.status != 9]
     acc_filters = [Account.status != 9]
 
     # --- Opening balances (before period) ---
-    opening_query = (
-        db.session.query(
-            GeneralLedger.account_id,
-            func.coalesce(func.sum(GeneralLedger.amount), 0).label("opening_balance")
-        )
-        .filter(*gl_filters)
-        .filter(GeneralLedger.transaction_date < start_date if start_date else True)
-        .group_by(GeneralLedger.account_id)
-        .subquery()
-    )
+    opening_query = balances_through(start_date.date() - timedelta(days=1) if start_date else None)
 
     # --- Movement during period ---
     movement_query = (
         db.session.query(
-            GeneralLedger.account_id,
-            func.coalesce(func.sum(GeneralLedger.amount), 0).label("movement")
+            ADB.account_id,
+            func.coalesce(func.sum(gl_amount), 0).label("movement")
         )
-        .filter(*gl_filters)
         .filter(
             and_(
-                GeneralLedger.transaction_date >= start_date if start_date else True,
-                GeneralLedger.transaction_date <= end_date if end_date else True
+                ADB.day >= start_date.date() if start_date else True,
+                ADB.day <= end_date.date() if end_date else True
             )
         )
-        .group_by(GeneralLedger.account_id)
+        .group_by(ADB.account_id)
         .subquery()
     )
 
+    # --- Roll every account's subtree up in SQL (account_closure) ---
+    figures = union_all(
+        select(opening_query.c.account_id, (opening_query.c.debit + opening_query.c.credit).label("opening_balance"),
+               literal(0.0).label("movement")),
+        select(movement_query.c.account_id, literal(0.0), movement_query.c.movement),
+    ).subquery()
+    rolled = subtree_sums(figures, "opening_balance", "movement")
+
     # --- Fetch all accounts with balances ---
     raw_accounts = (
         db.session.query(
             Account.id,
             Account.name,
             Account.account_type,
-            Account.parent_id,
+            nearest_active_parent().label("parent_id"),
             cast(Account.account_type, String).label("account_type_str"),
-            func.coalesce(opening_query.c.opening_balance, 0).label("opening_balance"),
-            func.coalesce(movement_query.c.movement, 0).label("movement")
+            func.coalesce(rolled.c.opening_balance, 0).label("opening_balance"),
+            func.coalesce(rolled.c.movement, 0).label("movement")
         )
-        .outerjoin(opening_query, opening_query.c.account_id == Account.id)
-        .outerjoin(movement_query, movement_query.c.account_id == Account.id)
+        .outerjoin(rolled, rolled.c.account_id == Account.id)
         .filter(*acc_filters)
+        .order_by(Account.code)
         .all()
     )
 
-    # --- Build accounts dict ---
+    # --- Build accounts dict (figures already include sub-accounts) ---
     accounts_dict = {}
     for a in raw_accounts:
         opening = float(a.opening_balance or 0)
@@ -562,24 +553,7 @@ def cash_flow():
             "children": []
         }
 
-    # --- Build hierarchy ---
-    root_accounts = []
-    for acc in accounts_dict.values():
-        if acc["parent_id"] and acc["parent_id"] in accounts_dict:
-            accounts_dict[acc["parent_id"]]["children"].append(acc)
-        else:
-            root_accounts.append(acc)
-
-    # --- Recursive roll-up ---
-    def roll_up(account):
-        for child in account["children"]:
-            roll_up(child)
-            account["opening_balance"] += child["opening_balance"]
-            account["movement"] += child["movement"]
-            account["closing_balance"] += child["closing_balance"]
-
-    for root in root_accounts:
-        roll_up(root)
+    root_accounts = attach_children(accounts_dict)
 
     # --- Classify inflows/outflows ---
     INFLOW_TYPES = ["ASSET", "REVENUE"]       # green
@@ -666,111 +640,68 @@ def debtors_report_old():
 def debtors_aging_report():
     """
     Returns a professional Debtors Aging Report:
-    - Buckets: 0-30, 31-60, 61-90, >90 days
-    - Includes per-customer invoice list with days outstanding
-    - Only customers with outstanding balances > 0
+    - Buckets: 0-30, 31-60, 61-90, >90 days (AGING_BUCKETS, or ?buckets=30,60,90,120)
+    - Includes per-customer bucket totals and invoice list with days outstanding
+    - Only customers with outstanding balances > 0; grand totals per bucket
     - Supports pagination: ?page=1&page_size=10
     """
-    # --- Optional "as of" date ---
-    as_of_str = request.args.get("as_of")
-    as_of = datetime.strptime(as_of_str, "%Y-%m-%d") if as_of_str else datetime.utcnow()
-
-    # --- Pagination parameters ---
-    page = int(request.args.get("page", 1))
-    page_size = int(request.args.get("page_size", 10))
-    offset = (page - 1) * page_size
-
-    # --- Subquery: customers with outstanding balances ---
-    subq = (
-        db.session.query(
-            Sale.customer_id,
-            func.coalesce(func.sum(Sale.balance), 0).label('total_balance')
-        )
-        .filter(Sale.status != 9, Sale.balance > 0)
-        .group_by(Sale.customer_id)
-        .subquery()
-    )
-
-    # --- Total count for pagination metadata ---
-    total_customers = db.session.query(func.count(subq.c.customer_id)).scalar()
-
-    # --- Fetch paginated customers ---
-    customers = (
-        db.session.query(
-            Customer.id.label('customer_id'),
-            Customer.name,
-            Customer.phone,
-            Customer.email,
-            Customer.address,
-            func.coalesce(subq.c.total_balance, 0).label('balance')
-        )
-        .outerjoin(subq, subq.c.customer_id == Customer.id)
-        .filter(Customer.status != 9, subq.c.total_balance > 0)
-        .order_by(Customer.name)
-        .offset(offset)
-        .limit(page_size)
-        .all()
-    )
-
-    # --- Prepare aging buckets ---
-    bucket_case = case(
-        (func.date_part('day', func.age(as_of, Sale.sale_date)) <= 30, '0-30'),
-        (func.date_part('day', func.age(as_of, Sale.sale_date)) <= 60, '31-60'),
-        (func.date_part('day', func.age(as_of, Sale.sale_date)) <= 90, '61-90'),
-        else_='>90'
+    try:
+        as_of, bounds, page, page_size = _aging_params()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    labels = bucket_labels(bounds)
+    customers, invoices, total_customers, totals = aging_page(
+        DEBTORS, as_of, bounds, page, page_size,
+        [Sale.id.label('invoice_id'), Sale.sale_number, Sale.sale_date, Sale.total_amount, Sale.total_paid, Sale.balance],
     )
 
     report = []
-    for c in customers:
-        # Fetch invoices per customer
-        invoices = db.session.query(
-            Sale.id.label('invoice_id'),
-            Sale.sale_number,
-            Sale.sale_date,
-            Sale.total_amount,
-            Sale.total_paid,
-            Sale.balance,
-            func.date_part('day', func.age(as_of, Sale.sale_date)).label('days_outstanding'),
-            bucket_case.label('aging_bucket')
-        ).filter(
-            Sale.customer_id == c.customer_id,
-            Sale.status != 9,
-            Sale.balance > 0
-        ).order_by(Sale.sale_date).all()
-
-        invoice_list = [{
-            "invoice_id": inv.invoice_id,
-            "sale_number": inv.sale_number,
-            "sale_date": inv.sale_date.strftime("%Y-%m-%d"),
-            "total_amount": float(inv.total_amount),
-            "total_paid": float(inv.total_paid),
-            "balance": float(inv.balance),
-            "days_outstanding": int(inv.days_outstanding),
-            "aging_bucket": inv.aging_bucket
-        } for inv in invoices]
-
-        # Compute total balance per customer
-        total_balance = sum(inv["balance"] for inv in invoice_list)
-
+    for row in customers:
+        c = row[0]
         report.append({
-            "customer_id": c.customer_id,
+            "customer_id": c.id,
             "name": c.name,
             "phone": c.phone,
             "email": c.email,
             "address": c.address,
-            "total_balance": total_balance,
-            "invoices": invoice_list
+            "total_balance": float(row.balance),
+            "aging": party_buckets(row, labels),
+            "invoices": [{
+                "invoice_id": inv.invoice_id,
+                "sale_number": inv.sale_number,
+                "sale_date": inv.sale_date.strftime("%Y-%m-%d"),
+                "total_amount": float(inv.total_amount),
+                "total_paid": float(inv.total_paid),
+                "balance": float(inv.balance),
+                "days_outstanding": int(inv.days_outstanding),
+                "aging_bucket": inv.aging_bucket
+            } for inv in invoices.get(c.id, [])]
         })
 
     return jsonify({
         "as_of": as_of.strftime("%Y-%m-%d"),
         "page": page,
         "page_size": page_size,
+        "buckets": labels,
+        "totals": totals,
         "total_customers": total_customers,
         "total_pages": (total_customers + page_size - 1) // page_size,
         "report": report
     })
 
+
+def _aging_params():
+    """as_of, bucket bounds, page, page_size of an aging request; raises ValueError."""
+    as_of_str = request.args.get("as_of")
+    try:
+        as_of = datetime.strptime(as_of_str, "%Y-%m-%d") if as_of_str else datetime.utcnow()
+        page = max(int(request.args.get("page", 1)), 1)
+        page_size = min(max(int(request.args.get("page_size", 10)), 1), 500)
+    except ValueError:
+        raise ValueError("as_of must be YYYY-MM-DD; page and page_size must be integers")
+    return as_of, parse_buckets(request.args.get("buckets")), page, page_size
+
 # ------------------ Creditors Report ------------------
 # @token_required
 # @reports_bp.route('/creditors-report', methods=['GET'])
@@ -800,105 +731,52 @@ def debtors_aging_report():
 def creditors_aging_report():
     """
     Professional Creditor Aging Report:
-    - Buckets: 0-30, 31-60, 61-90, >90 days
-    - Includes per-supplier purchase order list
-    - Only suppliers with outstanding balances > 0
+    - Buckets: 0-30, 31-60, 61-90, >90 days (AGING_BUCKETS, or ?buckets=30,60,90,120)
+    - Includes per-supplier bucket totals and purchase order list
+    - Only suppliers with outstanding balances > 0; grand totals per bucket
     - Supports pagination: ?page=1&page_size=10
     """
-    # --- "As of" date ---
-    as_of_str = request.args.get("as_of")
-    as_of = datetime.strptime(as_of_str, "%Y-%m-%d") if as_of_str else datetime.utcnow()
-
-    # --- Pagination ---
-    page = int(request.args.get("page", 1))
-    page_size = int(request.args.get("page_size", 10))
-    offset = (page - 1) * page_size
-
-    # --- Subquery: suppliers with outstanding balances ---
-    subq = (
-        db.session.query(
-            PurchaseOrder.supplier_id,
-            func.coalesce(func.sum(PurchaseOrder.total_balance), 0).label("total_balance")
-        )
-        .filter(PurchaseOrder.status != 9, PurchaseOrder.total_balance > 0)
-        .group_by(PurchaseOrder.supplier_id)
-        .subquery()
-    )
-
-    # --- Total supplier count ---
-    total_suppliers = db.session.query(func.count(subq.c.supplier_id)).scalar()
-
-    # --- Fetch paginated suppliers ---
-    suppliers = (
-        db.session.query(
-            Supplier.id.label("supplier_id"),
-            Supplier.name,
-            Supplier.contact,
-            Supplier.email,
-            # Supplier.,
-            func.coalesce(subq.c.total_balance, 0).label("balance")
-        )
-        .outerjoin(subq, subq.c.supplier_id == Supplier.id)
-        .filter(Supplier.status != 9, subq.c.total_balance > 0)
-        .order_by(Supplier.name)
-        .offset(offset)
-        .limit(page_size)
-        .all()
-    )
-
-    # --- Aging buckets ---
-    aging_case = case(
-        (func.date_part("day", func.age(as_of, PurchaseOrder.purchase_date)) <= 30, "0-30"),
-        (func.date_part("day", func.age(as_of, PurchaseOrder.purchase_date)) <= 60, "31-60"),
-        (func.date_part("day", func.age(as_of, PurchaseOrder.purchase_date)) <= 90, "61-90"),
-        else_=">90"
+    try:
+        as_of, bounds, page, page_size = _aging_params()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    labels = bucket_labels(bounds)
+    suppliers, orders, total_suppliers, totals = aging_page(
+        CREDITORS, as_of, bounds, page, page_size,
+        [PurchaseOrder.id.label("po_id"), PurchaseOrder.invoice_number, PurchaseOrder.purchase_date,
+         PurchaseOrder.total_amount, PurchaseOrder.total_paid, PurchaseOrder.total_balance],
     )
 
     report = []
-    for s in suppliers:
-        # Fetch purchase orders per supplier
-        pos = db.session.query(
-            PurchaseOrder.id.label("po_id"),
-            PurchaseOrder.invoice_number,
-            PurchaseOrder.purchase_date,
-            PurchaseOrder.total_amount,
-            PurchaseOrder.total_paid,
-            PurchaseOrder.total_balance,
-            func.date_part("day", func.age(as_of, PurchaseOrder.purchase_date)).label("days_outstanding"),
-            aging_case.label("aging_bucket")
-        ).filter(
-            PurchaseOrder.supplier_id == s.supplier_id,
-            PurchaseOrder.status != 9,
-            PurchaseOrder.total_balance > 0
-        ).order_by(PurchaseOrder.purchase_date).all()
-
-        po_list = [{
-            "po_id": po.po_id,
-            "invoice_number": po.invoice_number,
-            "purchase_date": po.purchase_date.strftime("%Y-%m-%d"),
-            "total_amount": float(po.total_amount),
-            "total_paid": float(po.total_paid),
-            "balance": float(po.total_balance),
-            "days_outstanding": int(po.days_outstanding),
-            "aging_bucket": po.aging_bucket
-        } for po in pos]
-
-        total_balance = sum(po["balance"] for po in po_list)
-
+    for row in suppliers:
+        s = row[0]
         report.append({
-            "supplier_id": s.supplier_id,
+            "supplier_id": s.id,
             "name": s.name,
             "contact": s.contact,
             "email": s.email,
             # "address": s.address,
-            "total_balance": total_balance,
-            "purchase_orders": po_list
+            "total_balance": float(row.balance),
+            "aging": party_buckets(row, labels),
+            "purchase_orders": [{
+                "po_id": po.po_id,
+                "invoice_number": po.invoice_number,
+                "purchase_date": po.purchase_date.strftime("%Y-%m-%d"),
+                "total_amount": float(po.total_amount),
+                "total_paid": float(po.total_paid),
+                "balance": float(po.total_balance),
+                "days_outstanding": int(po.days_outstanding),
+                "aging_bucket": po.aging_bucket
+            } for po in orders.get(s.id, [])]
         })
 
     return jsonify({
         "as_of": as_of.strftime("%Y-%m-%d"),
         "page": page,
         "page_size": page_size,
+        "buckets": labels,
+        "totals": totals,
         "total_suppliers": total_suppliers,
         "total_pages": (total_suppliers + page_size - 1) // page_size,
         "report": report
@@ -1032,109 +910,26 @@ def expenses_report():
 
 @token_required
 @reports_bp.route('/profit-loss-professional', methods=['GET'])
+@cached_report
 def profit_loss_professional():
     """
     Returns a professional, nested Profit & Loss report.
-    Revenue → COGS (id=30) → Other Expenses → Net Profit
+    Revenue → COGS → Other Expenses → Net Profit
     Supports date filtering with start_date and end_date query params.
     """
-    # ------------------ Date filters ------------------
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
-    filters = [GeneralLedger.status != 9]
-
-    if start_date_str:
-        try:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-            filters.append(GeneralLedger.transaction_date >= start_date)
-        except ValueError:
-            return jsonify({"error": "start_date must be YYYY-MM-DD"}), 400
-    if end_date_str:
-        try:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-            filters.append(GeneralLedger.transaction_date <= end_date)
-        except ValueError:
-            return jsonify({"error": "end_date must be YYYY-MM-DD"}), 400
-
-    # ------------------ Fetch accounts with balances ------------------
-    accounts = db.session.query(
-        Account.id,
-        Account.name,
-        Account.account_type,
-        Account.account_subtype,
-        Account.parent_id,
-        func.coalesce(func.sum(GeneralLedger.amount), 0).label('balance')
-    ).outerjoin(GeneralLedger, GeneralLedger.account_id == Account.id) \
-     .filter(Account.status != 9,
-             Account.account_type.in_([AccountTypeEnum.REVENUE, AccountTypeEnum.EXPENSE]),
-             *filters) \
-     .group_by(Account.id).all()
-
-    # ------------------ Build account dict ------------------
-    account_dict = {}
-    for a in accounts:
-        account_dict[a.id] = {
-            "id": a.id,
-            "name": a.name,
-            "type": a.account_type.value if hasattr(a.account_type, 'value') else str(a.account_type),
-            "subtype": a.account_subtype.value if hasattr(a.account_subtype, 'value') else str(a.account_subtype),
-            "balance": float(a.balance),
-            "children": [],
-            "parent_id": a.parent_id
-        }
-
-    # ------------------ Build hierarchy ------------------
-    root_accounts = []
-    for acc in account_dict.values():
-        if acc["parent_id"] and acc["parent_id"] in account_dict:
-            account_dict[acc["parent_id"]]["children"].append(acc)
-        elif acc["parent_id"] is None:
-            root_accounts.append(acc)
-
-    # ------------------ Recursive sum function ------------------
-    def sum_children(account):
-        for child in account["children"]:
-            account["balance"] += sum_children(child)
-        return account["balance"]
-
-    for root in root_accounts:
-        sum_children(root)
-
-    # ------------------ Separate Revenue, COGS (id=30), Expenses ------------------
-    revenue_accounts = []
-    cogs_account = account_dict.get(30)  # COGS hardcoded
-    expense_accounts = []
+    try:
+        pl = load_profit_loss(*parse_range(start_date_str, end_date_str))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    for acc in root_accounts:
-        if acc["type"] == "REVENUE" and acc["id"] != 30:
-            revenue_accounts.append(acc)
-        elif acc["type"] == "EXPENSE":
-            expense_accounts.append(acc)
-
-    total_revenue = sum(a["balance"] for a in revenue_accounts)
-    total_cogs = cogs_account["balance"] if cogs_account else 0
-    total_expenses = sum(a["balance"] for a in expense_accounts)
-    net_profit = total_revenue - total_cogs - total_expenses
-
-    # ------------------ Build final ordered list ------------------
-    final_accounts = revenue_accounts[:]
-    if cogs_account:
-        final_accounts.append(cogs_account)  # COGS after revenue
-    final_accounts.extend(expense_accounts)  # then other expenses
-
-    # ------------------ Response ------------------
     return jsonify({
         "period": {
             "start_date": start_date_str if start_date_str else None,
             "end_date": end_date_str if end_date_str else None
         },
-        "accounts": final_accounts,
-        "totals": {
-            "total_revenue": total_revenue,
-            "total_cogs": total_cogs,
-            "total_expenses": total_expenses,
-            "net_profit": net_profit
-        }
+        **statement(pl, range(len(pl.months)))
     })
 
 
@@ -1266,114 +1061,30 @@ def profit_loss_professional():
 
 @token_required
 @reports_bp.route('/profit-loss-periodic', methods=['GET'])
+@cached_report
 def profit_loss_periodic():
     """
-    Returns a professional-style Profit & Loss report grouped by month.
+    Returns a professional-style Profit & Loss report per month, or per
+    quarter / year with ?period=quarter|year.
     Layout:
-      Revenue → COGS (id=30) → Other Expenses → Net Profit
-    Supports start_date and end_date filters.
+      Revenue → COGS → Other Expenses → Net Profit
+    Supports start_date and end_date filters; ?compare=prior_year adds the
+    same period one year earlier and the change against it.
     """
-    from sqlalchemy import extract
-    from collections import defaultdict
-
-    # ------------------ Date filters ------------------
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
-    filters = [GeneralLedger.status != 9]
-
-    if start_date_str:
-        try:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-            filters.append(GeneralLedger.transaction_date >= start_date)
-        except ValueError:
-            return jsonify({"error": "start_date must be YYYY-MM-DD"}), 400
-    if end_date_str:
-        try:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-            filters.append(GeneralLedger.transaction_date <= end_date)
-        except ValueError:
-            return jsonify({"error": "end_date must be YYYY-MM-DD"}), 400
-
-    # ------------------ Fetch account balances grouped by month ------------------
-    records = db.session.query(
-        Account.id.label('account_id'),
-        Account.name.label('account_name'),
-        Account.account_type,
-        Account.account_subtype,
-        Account.parent_id,
-        extract('year', GeneralLedger.transaction_date).label('year'),
-        extract('month', GeneralLedger.transaction_date).label('month'),
-        func.coalesce(func.sum(GeneralLedger.amount), 0).label('balance')
-    ).outerjoin(GeneralLedger, GeneralLedger.account_id == Account.id) \
-     .filter(Account.status != 9,
-             Account.account_type.in_([AccountTypeEnum.REVENUE, AccountTypeEnum.EXPENSE]),
-             *filters) \
-     .group_by(Account.id, extract('year', GeneralLedger.transaction_date), extract('month', GeneralLedger.transaction_date)) \
-     .order_by('year', 'month').all()
-
-    monthly_data = defaultdict(list)
-
-    for r in records:
-        period = f"{int(r.year)}-{int(r.month):02d}" if r.year and r.month else "Unknown"
-        monthly_data[period].append({
-            "id": r.account_id,
-            "name": r.account_name,
-            "type": r.account_type.value if hasattr(r.account_type, 'value') else str(r.account_type),
-            "subtype": r.account_subtype.value if hasattr(r.account_subtype, 'value') else str(r.account_subtype),
-            "balance": float(r.balance),
-            "children": [],
-            "parent_id": r.parent_id
-        })
+    compare = request.args.get('compare') == 'prior_year'
+    try:
+        pl = load_profit_loss(*parse_range(start_date_str, end_date_str), prior_year=compare)
+        columns = period_columns(pl, request.args.get('period', 'month'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # ------------------ Build hierarchy + professional grouping ------------------
-    def build_hierarchy(accounts):
-        acc_map = {a["id"]: dict(a, children=[]) for a in accounts}
-        roots = []
-        for acc in acc_map.values():
-            if acc["parent_id"] and acc["parent_id"] in acc_map:
-                acc_map[acc["parent_id"]]["children"].append(acc)
-            else:
-                roots.append(acc)
-
-        def sum_children(acc):
-            for child in acc["children"]:
-                acc["balance"] += sum_children(child)
-            return acc["balance"]
-
-        for root in roots:
-            sum_children(root)
-        return roots
-
-    # ------------------ Compute professional layout per period ------------------
     final_response = {}
-    for period, accounts in monthly_data.items():
-        hierarchy = build_hierarchy(accounts)
-
-        account_dict = {a["id"]: a for a in accounts}
-        cogs_account = account_dict.get(30)  # hardcoded COGS id=30
-
-        revenue_accounts = [a for a in hierarchy if a["type"] == "REVENUE" and a["id"] != 30]
-        expense_accounts = [a for a in hierarchy if a["type"] == "EXPENSE"]
-
-        total_revenue = sum(a["balance"] for a in revenue_accounts)
-        total_cogs = cogs_account["balance"] if cogs_account else 0
-        total_expenses = sum(a["balance"] for a in expense_accounts)
-        net_profit = total_revenue - total_cogs - total_expenses
-
-        final_accounts = revenue_accounts[:]
-        if cogs_account:
-            final_accounts.append(cogs_account)
-        final_accounts.extend(expense_accounts)
-
-        final_response[period] = {
-            "accounts": final_accounts,
-            "totals": {
-                "total_revenue": round(total_revenue, 2),
-                "total_cogs": round(total_cogs, 2),
-                "total_expenses": round(total_expenses, 2),
-                "net_profit": round(net_profit, 2)
-            }
-        }
+    for label, indexes in columns:
+        final_response[label] = statement(pl, indexes, digits=2)
+        if compare:
+            final_response[label].update(comparison(pl, indexes))
 
     return jsonify({
         "period_filter": {
@@ -1538,121 +1249,29 @@ def profit_loss_periodic():
 #     })
 @token_required
 @reports_bp.route('/profit-loss-ytd', methods=['GET'])
+@cached_report
 def profit_loss_ytd():
     """
     Returns a professional-style Profit & Loss report grouped by year and month.
     Layout:
-      Revenue → COGS (id=30) → Other Expenses → Net Profit → YTD Profit
+      Revenue → COGS → Other Expenses → Net Profit → YTD Profit
+    ?compare=prior_year adds the same month one year earlier per month.
     """
-    from sqlalchemy import extract
-    from collections import defaultdict
-
-    # ------------------ Date filters ------------------
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
-    filters = [GeneralLedger.status != 9]
-
-    if start_date_str:
-        try:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-            filters.append(GeneralLedger.transaction_date >= start_date)
-        except ValueError:
-            return jsonify({"error": "start_date must be YYYY-MM-DD"}), 400
-    if end_date_str:
-        try:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-            filters.append(GeneralLedger.transaction_date <= end_date)
-        except ValueError:
-            return jsonify({"error": "end_date must be YYYY-MM-DD"}), 400
-
-    # ------------------ Fetch balances grouped by month ------------------
-    records = db.session.query(
-        Account.id.label('account_id'),
-        Account.name.label('account_name'),
-        Account.account_type,
-        Account.account_subtype,
-        Account.parent_id,
-        extract('year', GeneralLedger.transaction_date).label('year'),
-        extract('month', GeneralLedger.transaction_date).label('month'),
-        func.coalesce(func.sum(GeneralLedger.amount), 0).label('balance')
-    ).outerjoin(GeneralLedger, GeneralLedger.account_id == Account.id) \
-     .filter(Account.status != 9,
-             Account.account_type.in_([AccountTypeEnum.REVENUE, AccountTypeEnum.EXPENSE]),
-             *filters) \
-     .group_by(Account.id, extract('year', GeneralLedger.transaction_date), extract('month', GeneralLedger.transaction_date)) \
-     .order_by('year', 'month').all()
-
-    monthly_data = defaultdict(list)
-    for r in records:
-        period = f"{int(r.year)}-{int(r.month):02d}" if r.year and r.month else "Unknown"
-        monthly_data[period].append({
-            "id": r.account_id,
-            "name": r.account_name,
-            "type": r.account_type.value if hasattr(r.account_type, 'value') else str(r.account_type),
-            "subtype": r.account_subtype.value if hasattr(r.account_subtype, 'value') else str(r.account_subtype),
-            "balance": float(r.balance),
-            "children": [],
-            "parent_id": r.parent_id
-        })
-
-    # ------------------ Build hierarchy and professional grouping ------------------
-    def build_hierarchy(accounts):
-        acc_map = {a["id"]: dict(a, children=[]) for a in accounts}
-        roots = []
-        for acc in acc_map.values():
-            if acc["parent_id"] and acc["parent_id"] in acc_map:
-                acc_map[acc["parent_id"]]["children"].append(acc)
-            else:
-                roots.append(acc)
-
-        def sum_children(acc):
-            for child in acc["children"]:
-                acc["balance"] += sum_children(child)
-            return acc["balance"]
-
-        for root in roots:
-            sum_children(root)
-        return roots
+    compare = request.args.get('compare') == 'prior_year'
+    try:
+        pl = load_profit_loss(*parse_range(start_date_str, end_date_str), prior_year=compare)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
+    months = period_columns(pl, 'month')
     final_response = {}
-    annual_totals = defaultdict(lambda: {"total_revenue": 0, "total_cogs": 0, "total_expenses": 0, "net_profit": 0})
-    ytd_totals = defaultdict(lambda: 0.0)
-
-    for period in sorted(monthly_data.keys()):
-        hierarchy = build_hierarchy(monthly_data[period])
-        account_dict = {a["id"]: a for a in monthly_data[period]}
-        cogs_account = account_dict.get(30)
-
-        revenue_accounts = [a for a in hierarchy if a["type"] == "REVENUE" and a["id"] != 30]
-        expense_accounts = [a for a in hierarchy if a["type"] == "EXPENSE"]
-
-        total_revenue = sum(a["balance"] for a in revenue_accounts)
-        total_cogs = cogs_account["balance"] if cogs_account else 0
-        total_expenses = sum(a["balance"] for a in expense_accounts)
-        net_profit = total_revenue - total_cogs - total_expenses
-
-        year = int(period.split("-")[0]) if period != "Unknown" else "Unknown"
-        annual_totals[year]["total_revenue"] += total_revenue
-        annual_totals[year]["total_cogs"] += total_cogs
-        annual_totals[year]["total_expenses"] += total_expenses
-        annual_totals[year]["net_profit"] += net_profit
-        ytd_totals[year] += net_profit
-
-        final_accounts = revenue_accounts[:]
-        if cogs_account:
-            final_accounts.append(cogs_account)
-        final_accounts.extend(expense_accounts)
-
-        final_response[period] = {
-            "accounts": final_accounts,
-            "totals": {
-                "total_revenue": round(total_revenue, 2),
-                "total_cogs": round(total_cogs, 2),
-                "total_expenses": round(total_expenses, 2),
-                "net_profit": round(net_profit, 2),
-                "ytd_profit": round(ytd_totals[year], 2)
-            }
-        }
+    for (label, indexes), ytd_profit in zip(months, year_to_date(pl, months)):
+        final_response[label] = statement(pl, indexes, digits=2)
+        final_response[label]["totals"]["ytd_profit"] = round(ytd_profit, 2)
+        if compare:
+            final_response[label].update(comparison(pl, indexes))
 
     return jsonify({
         "period_filter": {
@@ -1661,8 +1280,8 @@ def profit_loss_ytd():
         },
         "monthly_data": final_response,
         "annual_totals": {
-            str(y): {k: round(v, 2) for k, v in t.items()}
-            for y, t in annual_totals.items()
+            year: {k: round(v, 2) for k, v in totals(pl, indexes).items()}
+            for year, indexes in period_columns(pl, 'year')
         }
     })
 
@@ -1771,6 +1390,7 @@ def profit_loss_ytd():
 # ---------------------------------------
 @token_required
 @reports_bp.route("/balance-sheet", methods=["GET"])
+@cached_report
 def balance_sheet_report():
     """
     Professional Balance Sheet Report
@@ -1785,16 +1405,17 @@ def balance_sheet_report():
     as_of_str = request.args.get("as_of")
     as_of = datetime.strptime(as_of_str, "%Y-%m-%d") if as_of_str else datetime.utcnow()
 
+    # --- Cumulative balances as of the date (closed snapshot + open days) ---
+    balances = balances_through(as_of.date())
+
     # --- CASE expression for proper accounting balances ---
     balance_expr = func.coalesce(
         func.sum(
             case(
                 # Assets & Expenses: Debit increases, Credit decreases
-                ( (Account.account_type.in_(["ASSET", "EXPENSE"])) & (GeneralLedger.transaction_type == "Debit"), GeneralLedger.amount ),
-                ( (Account.account_type.in_(["ASSET", "EXPENSE"])) & (GeneralLedger.transaction_type == "Credit"), -GeneralLedger.amount ),
+                (Account.account_type.in_(["ASSET", "EXPENSE"]), balances.c.debit - balances.c.credit),
                 # Liabilities, Equity, Revenue: Credit increases, Debit decreases
-                ( (Account.account_type.in_(["LIABILITY", "EQUITY", "REVENUE"])) & (GeneralLedger.transaction_type == "Debit"), -GeneralLedger.amount ),
-                ( (Account.account_type.in_(["LIABILITY", "EQUITY", "REVENUE"])) & (GeneralLedger.transaction_type == "Credit"), GeneralLedger.amount ),
+                (Account.account_type.in_(["LIABILITY", "EQUITY", "REVENUE"]), balances.c.credit - balances.c.debit),
                 else_=0.0
             )
         ),
@@ -1810,7 +1431,7 @@ def balance_sheet_report():
             Account.name.label("account_name"),
             balance_expr.label("balance")
         )
-        .outerjoin(GeneralLedger, GeneralLedger.account_id == Account.id)
+        .outerjoin(balances, balances.c.account_id == Account.id)
         .filter(Account.status != 9)
         .group_by(Account.account_type, Account.account_subtype, Account.id, Account.name)
         .order_by(Account.account_type, Account.account_subtype, Account.name)
@@ -2142,6 +1763,7 @@ def purchase_report():
 
     # Get total count for pagination
     total_records = base_query.count()
+    report_progress(50, "counted")
 
     # Fetch paginated results
     results = (
@@ -2275,164 +1897,38 @@ def purchase_report():
 @reports_bp.route("/sales-profit", methods=["GET"])
 @token_required
 def sales_profit_report():
-    page = int(request.args.get("page", 1))
-    per_page = 100
-
-    search = request.args.get("search", "").strip()
-    start_date = request.args.get("start_date")
-    end_date = request.args.get("end_date")
-
-    # ---- Latest purchase price per product ----
-    last_purchase = (
-        db.session.query(
-            PurchaseOrderItem.product_id,
-            func.max(PurchaseOrder.purchase_date).label("last_purchase_date")
-        )
-        .join(PurchaseOrder, PurchaseOrder.id == PurchaseOrderItem.purchase_order_id)
-        .filter(PurchaseOrder.status != 9, PurchaseOrderItem.unit_price > 0)
-        .group_by(PurchaseOrderItem.product_id)
-        .subquery()
-    )
-
-    final_purchase_price = (
-        db.session.query(
-            PurchaseOrderItem.product_id,
-            PurchaseOrderItem.unit_price
-        )
-        .join(PurchaseOrder, PurchaseOrder.id == PurchaseOrderItem.purchase_order_id)
-        .join(
-            last_purchase,
-            and_(
-                last_purchase.c.product_id == PurchaseOrderItem.product_id,
-                PurchaseOrder.purchase_date == last_purchase.c.last_purchase_date
-            )
-        )
-    ).subquery()
-
-    # ---- Aggregate payments per sale ----
-    sale_payments = (
-        db.session.query(
-            Payment.sale_id,
-            func.coalesce(func.sum(Payment.amount), 0).label("amount_paid")
-        )
-        .filter(Payment.status != 9)
-        .group_by(Payment.sale_id)
-        .subquery()
-    )
-
-    # ---- Query sale items joined with sale and product ----
-    query = (
-        db.session.query(
-            Sale.id.label("sale_id"),
-            Sale.sale_number,
-            Sale.sale_date,
-            Sale.total_amount,
-            Sale.total_paid,
-            Sale.balance,
-            Customer.name.label("customer_name"),
-            Product.id.label("product_id"),
-            Product.name.label("product_name"),
-            Category.name.label("category_name"),
-            SaleItem.quantity,
-            SaleItem.unit_price.label("selling_price"),
-            # SaleItem.label("selling_price"),
-            SaleItem.unit_id.label("unit"),
-
-            final_purchase_price.c.unit_price.label("purchase_price"),
-        )
-        .join(SaleItem, Sale.id == SaleItem.sale_id)
-        .join(Product, SaleItem.product_id == Product.id)
-        .join(Customer, Sale.customer_id == Customer.id)
-        .outerjoin(Category, Product.category_id == Category.id)
-        .outerjoin(final_purchase_price, Product.id == final_purchase_price.c.product_id)
-        .filter(Sale.status != 9)
-    )
+    """
+    Sale lines with COGS and profit, newest first, or grouped with
+    ?group_by=product|category|customer|day. Filters: start_date, end_date
+    (YYYY-MM-DD, inclusive), search. Totals cover every matching line.
+    """
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+        per_page = min(max(int(request.args.get("per_page", 100)), 1), 500)
+    except ValueError:
+        return jsonify({"error": "page and per_page must be integers"}), 400
+    group_by = request.args.get("group_by", "").strip().lower() or None
 
-    # ---- Search Filter ----
-    if search:
-        query = query.filter(
-            or_(
-                Product.name.ilike(f"%{search}%"),
-                Sale.sale_number.ilike(f"%{search}%"),
-                Customer.name.ilike(f"%{search}%"),
-                Category.name.ilike(f"%{search}%")
-            )
+    try:
+        criteria = line_filters(
+            request.args.get("start_date"), request.args.get("end_date"), request.args.get("search", "").strip()
         )
-
-    # ---- Date Filter ----
-    if start_date:
-        query = query.filter(cast(Sale.sale_date, String) >= start_date)
-    if end_date:
-        query = query.filter(cast(Sale.sale_date, String) <= end_date)
-
-    total_records = query.count()
-    results = query.order_by(Sale.sale_date.desc()).paginate(page=page, per_page=per_page, error_out=False)
-
-    # ---- Prepare data and compute totals using Sale table ----
-    raw_data = []
-    sale_summary = {}
-
-    for row in results.items:
-        purchase_price = row.purchase_price or 0
-        cost = purchase_price * row.quantity
-        line_sales = row.selling_price * row.quantity
-        profit = line_sales - cost
-
-        # Track sale summary for totals
-        if row.sale_id not in sale_summary:
-            # Use Sale table totals and Payment table aggregated amount
-            amount_paid = row.total_paid or 0
-            balance = row.balance or 0
-
-            sale_summary[row.sale_id] = {
-                "sale_total": row.total_amount,
-                "amount_paid": amount_paid,
-                "balance": balance,
-                "profit_total": 0,
-                "cost_total": 0
-            }
-
-        sale_summary[row.sale_id]["profit_total"] += profit
-        sale_summary[row.sale_id]["cost_total"] += cost
-        print("unit ..   ", row.unit)
-        unit_name = db.session.query(ProductUnit).filter(ProductUnit.id==row.unit).first()
-        raw_data.append({
-            "sale_id": row.sale_id,
-            "invoice_number": row.sale_number,
-            "sale_date": row.sale_date,
-            "customer": row.customer_name,
-            "product": row.product_name,
-            "category": row.category_name,
-            "unit":unit_name.unit_name if unit_name else "",
-            "qty": row.quantity,
-            "selling_price": row.selling_price,
-            "purchase_price": purchase_price,
-            "line_sales": line_sales,
-            "line_cost": cost,
-            "profit": profit,
-        })
-
-    # ---- Compute overall totals ----
-    total_sales = total_cost = total_profit = total_cash = total_credit = 0
-    for sale in sale_summary.values():
-        total_sales += sale["sale_total"]
-        total_cost += sale["cost_total"]
-        total_profit += sale["profit_total"]
-        total_cash += sale["amount_paid"]
-        total_credit += sale["balance"] if sale["balance"] > 0 else 0
+        total_lines, totals = sales_profit_totals(criteria)
+        report_progress(50, "totals")
+        if group_by:
+            data, total_records = sales_profit_groups(criteria, group_by, page, per_page)
+        else:
+            data, total_records = sales_profit_lines(criteria, page, per_page), total_lines
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     return jsonify({
         "page": page,
         "per_page": per_page,
+        "group_by": group_by,
         "total_records": total_records,
-        "totals": {
-            "total_sales": total_sales,
-            "total_cost": total_cost,
-            "total_profit": total_profit,
-            "total_cash_received": total_cash,
-            "total_credit_outstanding": total_credit
-        },
-        "data": raw_data
+        "totals": totals,
+        "data": data
     }), 200
 
 
@@ -2867,6 +2363,8 @@ def customer_payments_report():
         .all()
     )
 
+    report_progress(50, "payments loaded")
+
     # Group by customer in Python + calculate totals
     from collections import defaultdict
 
@@ -2928,4 +2426,59 @@ def customer_payments_report():
         "filtered_by_customer": bool(customer_id)
     }
 
-    return jsonify(response), 200
\ No newline at end of file
+    return jsonify(response), 200
+
+
+# ------------------ Background report jobs ------------------
+# Any GET report above can run off the request thread (app/utils/report_jobs.py):
+#   POST /jobs {"report": "sales-profit", "params": {"start_date": ...}} -> 202
+#   GET  /jobs/<id>          status and progress
+#   GET  /jobs/<id>/result   the report body once done, with an ETag
+@reports_bp.route('/jobs', methods=['POST'])
+@token_required
+def report_job_create():
+    data = request.get_json(silent=True) or {}
+    try:
+        job = submit_job(
+            data.get("report"), data.get("params"), request.user.id, request.headers.get("Authorization")
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    body = public_view(job)
+    body["status_url"] = url_for("reports.report_job_status", job_id=job["job_id"])
+    response = jsonify(body)
+    response.status_code = 202
+    response.headers["Location"] = body["status_url"]
+    return response
+
+
+@reports_bp.route('/jobs/<job_id>', methods=['GET'])
+@token_required
+def report_job_status(job_id):
+    job = get_job(job_id, request.user.id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    body = public_view(job)
+    if job["status"] == "done":
+        body["result_url"] = url_for("reports.report_job_result", job_id=job_id)
+    return jsonify(body), 200
+
+
+@reports_bp.route('/jobs/<job_id>/result', methods=['GET'])
+@token_required
+def report_job_result(job_id):
+    job = get_job(job_id, request.user.id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] != "done":
+        return jsonify(public_view(job)), 409
+
+    try:
+        body = result_body(job)
+    except OSError:
+        return jsonify({"error": "Job result has expired"}), 410
+    response = Response(body, mimetype="application/json")
+    response.set_etag(job["etag"])
+    response.headers["Cache-Control"] = "private, no-cache"  # immutable, but revalidate via ETag
+    return response.make_conditional(request)
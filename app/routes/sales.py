@@ -7,9 +7,17 @@ from app.models import (
 )
 from flask import current_app   # ← ADD THIS LINE (very important!)
 from app.utils.auth import token_required
-from app.utils.gl_utils import post_to_ledger, generate_transaction_number_partone
+from app.utils.gl_utils import document_lines, post_to_ledger, reverse_ledger, generate_transaction_number_partone
+from app.utils.checkout import load_basket, deduct_stock, write_sale_lines
+from app.utils.cost_layers import return_stock
+from app.utils.stock import adjust_stock
+from app.utils.idempotency import idempotent
+from app.utils.costing import latest_cost_prices
+from app.utils.metrics import track_queries
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.utils.export import export_params, filtered, stream_export
 from datetime import datetime
-from sqlalchemy import desc, func, or_
+from sqlalchemy import desc, func, or_, select, tuple_
 
 sales_bp = Blueprint('sales', __name__, url_prefix='/sales')
 
@@ -19,15 +27,12 @@ def update_timestamps(obj):
         obj.created_at = datetime.utcnow()
 # Helper: Get latest purchase unit_price for COGS
 def get_latest_cost_price(product_id):
-    latest = PurchaseOrderItem.query \
-        .filter_by(product_id=product_id, status=1) \
-        .order_by(desc(PurchaseOrderItem.id)) \
-        .first()
-    return float(latest.unit_price) if latest else 0.0
+    return latest_cost_prices([product_id]).get(product_id, 0.0)
 
 # ------------------ Create Sale with Product Units ------------------ #
 @token_required
 @sales_bp.route('/', methods=['POST'])
+@idempotent('create_sale')
 def create_sale():
     data = request.get_json()
     items = data.get('items', [])
@@ -49,190 +54,200 @@ def create_sale():
     if amount_paid > 0 and not payment_account_id:
         return jsonify({"error": "Payment account required when amount_paid > 0"}), 400
 
-    try:
-        total_amount = 0.0
-        cogs_total = 0.0
-        txn_id, txn_str = generate_transaction_number_partone('INV', transaction_date=sale_date)
-
-        # Create Sale header
-        sale = Sale(
-            sale_number=txn_str,
-            customer_id=customer_id,
-            total_amount=0,  # will update later
-            total_paid=amount_paid,
-            balance=0,
-            sale_date=sale_date,
-            memo=memo,
-            status=1
-        )
-        db.session.add(sale)
-        db.session.flush()  # get sale.id
-
-        # Process each item
-        for item_data in items:
-            product_id = item_data['product_id']
-            unit_id = item_data.get('unit_id')
-            quantity = float(item_data['quantity'])  # quantity in selected unit
-            retail_price= float(item_data["unit_price"])
-
-
-            product = Product.query.get_or_404(product_id)
-
-            # Get unit
-            if not unit_id:
-                return jsonify({"error": f"unit_id required for product {product.name}"}), 400
-
-            unit = ProductUnit.query.filter_by(id=unit_id, product_id=product_id, status=1).first()
-            if not unit:
-                return jsonify({"error": f"Invalid or inactive unit for product {product.name}"}), 400
-
-            # Check stock in base units
-            required_base_qty = quantity * unit.conversion_quantity
-            if product.quantity < required_base_qty:
-                return jsonify({"error": f"Insufficient stock for {product.name} ({unit.unit_name})"}), 400
-
-            # Use unit retail price
-            unit_price = float(retail_price or 0)
-            item_total = unit_price * quantity
-
-            # Deduct stock in base units
-            product.quantity -= required_base_qty
+    with track_queries("checkout", lines=len(items)) as metric:
+        try:
+            txn_id, txn_str = generate_transaction_number_partone('INV', transaction_date=sale_date)
 
-            # Create SaleItem
-            sale_item = SaleItem(
-                sale_id=sale.id,
-                product_id=product.id,
-                unit_id=unit.id,
-                product_name=product.name,
-                quantity=quantity,  # in selected unit
-                unit_price=unit_price,
-                total_price=item_total,
+            # Create Sale header
+            sale = Sale(
+                sale_number=txn_str,
+                customer_id=customer_id,
+                total_amount=0,  # will update later
+                total_paid=amount_paid,
+                balance=0,
+                sale_date=sale_date,
+                memo=memo,
                 status=1
             )
-            db.session.add(sale_item)
-
-            # Inventory Transaction (outflow in base units)
-            inv_txn = InventoryTransaction(
-                transaction_no=txn_id,
-                sale_id=sale.id,
-                product_id=product.id,
-                unit_id=unit.id,
-                quantity=required_base_qty,  # stored in base units
-                unit_price=get_latest_cost_price(product.id),  # for COGS
-                total_price=get_latest_cost_price(product.id) * required_base_qty,
-                transaction_type='Sale',
-                status=1
+            db.session.add(sale)
+            db.session.flush()  # get sale.id
+            metric["sale_id"] = sale.id
+
+            # Resolve the whole basket up front, then write all lines in bulk
+            lines = load_basket(items)
+            deduct_stock(lines)
+            cogs_total = write_sale_lines(sale, txn_id, lines)
+            total_amount = sum(line["total_price"] for line in lines)
+
+            # Update sale totals
+            sale.total_amount = total_amount
+            sale.balance = total_amount - amount_paid
+
+            # Set status
+            if amount_paid >= total_amount:
+                sale.status = 1  # Fully paid
+            elif amount_paid > 0:
+                sale.status = 4  # Partial
+            else:
+                sale.status = 3  # Credit
+
+            # Post to General Ledger
+            if amount_paid > 0:
+                payment_account = Account.query.get(payment_account_id)
+                if not payment_account:
+                    raise ValueError("Invalid payment account")
+
+                entries = [
+                    # Debit payment account (Cash/Bank/Mobile)
+                    {"account_id": payment_account.code, "transaction_type": "Debit", "amount": amount_paid},
+                    # Credit Sales Revenue
+                    {"account_id": 4000, "transaction_type": "Credit", "amount": amount_paid},
+                ]
+
+                if sale.balance > 0:
+                    # Debit Accounts Receivable for credit portion
+                    entries.append({"account_id": 1100, "transaction_type": "Debit", "amount": sale.balance})
+                    # Credit Sales Revenue for full amount
+                    entries.append({"account_id": 4000, "transaction_type": "Credit", "amount": sale.balance})
+
+                # COGS & Inventory
+                entries += [
+                    {"account_id": 5000, "transaction_type": "Debit", "amount": cogs_total},  # COGS
+                    {"account_id": 1200, "transaction_type": "Credit", "amount": cogs_total},  # Inventory
+                ]
+            else:
+                # Full credit sale
+                entries = [
+                    {"account_id": 1100, "transaction_type": "Debit", "amount": total_amount},  # A/R
+                    {"account_id": 4000, "transaction_type": "Credit", "amount": total_amount},  # Sales
+                    {"account_id": 5000, "transaction_type": "Debit", "amount": cogs_total},
+                    {"account_id": 1200, "transaction_type": "Credit", "amount": cogs_total},
+                ]
+
+            post_to_ledger(
+                entries,
+                transaction_no_id=txn_id,
+                description=f"Sale Invoice #{txn_str}",
+                transaction_date=sale_date,
+                source_type='sale',
+                source_id=sale.id
             )
-            db.session.add(inv_txn)
-
-            total_amount += item_total
-            cogs_total += get_latest_cost_price(product.id) * required_base_qty
 
-        # Update sale totals
-        sale.total_amount = total_amount
-        sale.balance = total_amount - amount_paid
+            sale.transaction_no = txn_id
+
+            # Record payment if any
+            if amount_paid > 0:
+                payment = Payment(
+                    sale_id=sale.id,
+                    amount=amount_paid,
+                    payment_type=data.get('payment_type', 'Cash'),
+                    payment_date=sale_date,
+                    reference=txn_str,
+                    payment_account_id=payment_account_id,
+                    transaction_no=txn_id,
+                    status=1
+                )
+                db.session.add(payment)
+
+            db.session.commit()
+
+            return jsonify({
+                "message": "Sale created successfully",
+                "sale_id": sale.id,
+                "sale_number": txn_str,
+                "total_amount": total_amount,
+                "amount_paid": amount_paid,
+                "balance": sale.balance,
+                "sale_date": sale_date.strftime("%Y-%m-%d")
+            }), 201
+
+        except ValueError as ve:
+            db.session.rollback()
+            return jsonify({"error": str(ve)}), 400
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.exception(f"Sale error: {e}")
+            return jsonify({"error": "Failed to create sale"}), 500
 
-        # Set status
-        if amount_paid >= total_amount:
-            sale.status = 1  # Fully paid
-        elif amount_paid > 0:
-            sale.status = 4  # Partial
-        else:
-            sale.status = 3  # Credit
-
-        # Post to General Ledger
-        if amount_paid > 0:
-            payment_account = Account.query.get(payment_account_id)
-            if not payment_account:
-                raise ValueError("Invalid payment account")
-
-            entries = [
-                # Debit payment account (Cash/Bank/Mobile)
-                {"account_id": payment_account.code, "transaction_type": "Debit", "amount": amount_paid},
-                # Credit Sales Revenue
-                {"account_id": 4000, "transaction_type": "Credit", "amount": amount_paid},
-            ]
-
-            if sale.balance > 0:
-                # Debit Accounts Receivable for credit portion
-                entries.append({"account_id": 1100, "transaction_type": "Debit", "amount": sale.balance})
-                # Credit Sales Revenue for full amount
-                entries.append({"account_id": 4000, "transaction_type": "Credit", "amount": sale.balance})
-
-            # COGS & Inventory
-            entries += [
-                {"account_id": 5000, "transaction_type": "Debit", "amount": cogs_total},  # COGS
-                {"account_id": 1200, "transaction_type": "Credit", "amount": cogs_total},  # Inventory
-            ]
-        else:
-            # Full credit sale
-            entries = [
-                {"account_id": 1100, "transaction_type": "Debit", "amount": total_amount},  # A/R
-                {"account_id": 4000, "transaction_type": "Credit", "amount": total_amount},  # Sales
-                {"account_id": 5000, "transaction_type": "Debit", "amount": cogs_total},
-                {"account_id": 1200, "transaction_type": "Credit", "amount": cogs_total},
-            ]
-
-        post_to_ledger(
-            entries,
-            transaction_no_id=txn_id,
-            description=f"Sale Invoice #{txn_str}",
-            transaction_date=sale_date
+# ------------------ Get All Sales ------------------ #
+def serialize_sales(rows, include_items=True):
+    """rows: [(Sale, customer_name)] -> list dicts. Items and their unit names
+    for the whole batch come from one query."""
+    items_by_sale = {}
+    if include_items and rows:
+        items = (
+            db.session.query(SaleItem, ProductUnit.unit_name)
+            .outerjoin(ProductUnit, ProductUnit.id == SaleItem.unit_id)
+            .filter(SaleItem.sale_id.in_([s.id for s, _ in rows]), SaleItem.status == 1)
+            .order_by(SaleItem.id)
+            .all()
         )
+        for i, unit_name in items:
+            items_by_sale.setdefault(i.sale_id, []).append({
+                "product_id": i.product_id,
+                "product_name": i.product_name,
+                "unit_name": unit_name or "Unknown",
+                "quantity": float(i.quantity),
+                "unit_price": float(i.unit_price),
+                "total_price": float(i.total_price)
+            })
 
-        sale.transaction_no = txn_id
-
-        # Record payment if any
-        if amount_paid > 0:
-            payment = Payment(
-                sale_id=sale.id,
-                amount=amount_paid,
-                payment_type=data.get('payment_type', 'Cash'),
-                payment_date=sale_date,
-                reference=txn_str,
-                payment_account_id=payment_account_id,
-                transaction_no=txn_id,
-                status=1
-            )
-            db.session.add(payment)
-
-        db.session.commit()
-
-        return jsonify({
-            "message": "Sale created successfully",
-            "sale_id": sale.id,
-            "sale_number": txn_str,
-            "total_amount": total_amount,
-            "amount_paid": amount_paid,
-            "balance": sale.balance,
-            "sale_date": sale_date.strftime("%Y-%m-%d")
-        }), 201
+    result = []
+    for s, customer_name in rows:
+        sale = {
+            "id": s.id,
+            "sale_id": s.id,
+            "sale_number": s.sale_number,
+            "memo": s.memo or "",
+            "customer_name": customer_name,
+            "total_amount": float(s.total_amount or 0),
+            "total_paid": float(s.total_paid or 0),
+            "balance": float(s.balance or 0),
+            "sale_date": s.sale_date.strftime("%Y-%m-%d"),
+            "status": s.status
+        }
+        if include_items:
+            sale["items"] = items_by_sale.get(s.id, [])
+        result.append(sale)
+    return result
 
-    except ValueError as ve:
-        db.session.rollback()
-        return jsonify({"error": str(ve)}), 400
-    except Exception as e:
-        db.session.rollback()
-        print(f"Sale error: {e}")
-        return jsonify({"error": "Failed to create sale"}), 500
 
-# ------------------ Get All Sales ------------------ #
 @token_required
 @sales_bp.route('/', methods=['GET'])
 def get_sales():
+    """
+    Query params (all optional):
+      search, start_date, end_date – filters, as before
+      include_items – true (default) | false: omit the item lines (list views)
+      limit         – page size; when given the response is paginated, newest
+                      first on (sale_date, id):
+                      {"items": [...], "next_cursor": str|null, "limit": int}
+      cursor        – next_cursor of the previous page
+
+    Without limit/cursor every matching sale is returned as a plain array, as
+    before. Either way it takes at most 2 queries: sales with customer name,
+    then the item lines of those sales.
+    """
     search = request.args.get('search', '').strip()
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
+    include_items = request.args.get('include_items', 'true').lower() not in ('false', '0', 'no')
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
 
-    query = Sale.query.join(Customer).filter(Sale.status.in_([1, 3, 4]))
+    query = (
+        db.session.query(Sale, Customer.name)
+        .join(Customer, Customer.id == Sale.customer_id)
+        .filter(Sale.status.in_([1, 3, 4]))
+    )
 
     if search:
         query = query.filter(
-            # or_(
-                Sale.sale_number.ilike(f"%{search}%")|
-                Sale.memo.ilike(f"%{search}%")|
+            or_(
+                Sale.sale_number.ilike(f"%{search}%"),
+                Sale.memo.ilike(f"%{search}%"),
                 Customer.name.ilike(f"%{search}%")
-            # )
+            )
         )
 
     if start_date:
@@ -240,38 +255,54 @@ def get_sales():
     if end_date:
         query = query.filter(Sale.sale_date <= end_date)
 
-    sales = query.order_by(Sale.id.desc()).all()
+    if limit is None and cursor is None:
+        rows = query.order_by(Sale.id.desc()).all()
+        return jsonify(serialize_sales(rows, include_items))
 
-    result = []
-    for s in sales:
-        items = SaleItem.query.filter_by(sale_id=s.id, status=1).all()
-        items_data = []
-        for i in items:
-            unit = ProductUnit.query.get(i.unit_id) if i.unit_id else None
-            items_data.append({
-                "product_id": i.product_id,
-                "product_name": i.product_name,
-                "unit_name": unit.unit_name if unit else "Unknown",
-                "quantity": float(i.quantity),
-                "unit_price": float(i.unit_price),
-                "total_price": float(i.total_price)
-            })
+    limit = max(1, min(limit or 50, 500))
+    if cursor:
+        try:
+            last_date, last_id = decode_cursor(cursor)
+            last_date = datetime.fromisoformat(last_date)
+        except (ValueError, TypeError):
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.filter(tuple_(Sale.sale_date, Sale.id) < (last_date, last_id))
 
-        result.append({
-            "id": s.id,
-            "sale_id": s.id,
-            "sale_number": s.sale_number,
-            "memo": s.memo if hasattr(s, 'memo') else "",
-            "customer_name": s.customer.name,
-            "total_amount": float(s.total_amount), 
-            "total_paid": float(s.total_paid),
-            "balance": float(s.balance),
-            "sale_date": s.sale_date.strftime("%Y-%m-%d"),
-            "status": s.status,
-            "items": items_data
-        })
+    page = query.order_by(Sale.sale_date.desc(), Sale.id.desc()).limit(limit + 1).all()
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = page[-1][0]
+        next_cursor = encode_cursor([last.sale_date.isoformat(), last.id])
+
+    return jsonify({
+        "items": serialize_sales(page, include_items),
+        "next_cursor": next_cursor,
+        "limit": limit
+    })
 
-    return jsonify(result)
+# ------------------ Export Sales (streaming) ------------------ #
+@sales_bp.route('/export', methods=['GET'])
+@token_required
+def export_sales():
+    """Sale headers as NDJSON/CSV; params in app.utils.export."""
+    try:
+        params = export_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    stmt = (
+        select(
+            Sale.id, Sale.sale_number, Sale.sale_date, Sale.customer_id,
+            Customer.name.label("customer_name"), Sale.total_amount, Sale.total_paid,
+            Sale.balance, Sale.payment_status, Sale.memo, Sale.status, Sale.transaction_no
+        )
+        .join(Customer, Customer.id == Sale.customer_id)
+        .where(Sale.status.in_([1, 3, 4]))
+    )
+    return stream_export(filtered(stmt, Sale.id, Sale.sale_date, params), params, "sales")
 
 # ------------------ Get Single Sale ------------------ #
 @token_required
@@ -313,6 +344,8 @@ def get_sale(sale_id):
 @sales_bp.route('/<int:sale_id>/delete', methods=['DELETE'])
 def delete_sale(sale_id):
     sale = Sale.query.get_or_404(sale_id)
+    if sale.status == 9:
+        return jsonify({"error": "Sale already deleted"}), 400
 
     try:
         # 1️⃣ Soft delete sale
@@ -323,17 +356,12 @@ def delete_sale(sale_id):
         # 2️⃣ Soft delete sale items & restore stock correctly
         sale_items = SaleItem.query.filter_by(sale_id=sale.id, status=1).all()
 
+        restored = []
         for item in sale_items:
             item.status = 9
             update_timestamps(item)
             db.session.add(item)
 
-            product = db.session.get(Product, item.product_id)
-            if not product:
-                continue
-
-            previous_qty = float(product.quantity or 0)
-
             # ✅ Apply unit conversion
             multiplier = 1
             if item.unit_id:
@@ -342,15 +370,25 @@ def delete_sale(sale_id):
                     multiplier = unit.conversion_quantity
 
             restored_qty = float(item.quantity) * multiplier
-            new_qty = previous_qty + restored_qty
-
-            # ✅ Update product stock
-            product.quantity = new_qty
-            db.session.add(product)
-
-            # ✅ OPTIONAL (Recommended): log stock adjustment
+            return_stock(item.product_id, restored_qty, (item.unit_cost or 0) / (multiplier or 1))
+            restored.append((item, restored_qty))
+
+        # ✅ Update product stock: one quantity = quantity + delta UPDATE, never
+        # an absolute write that could undo a concurrent sale
+        deltas = {}
+        for item, restored_qty in restored:
+            deltas[item.product_id] = deltas.get(item.product_id, 0.0) + restored_qty
+        on_hand = adjust_stock(deltas)
+        running = {pid: float(qty or 0) - deltas[pid] for pid, qty in on_hand.items()}
+
+        # ✅ OPTIONAL (Recommended): log stock adjustment
+        for item, restored_qty in restored:
+            if item.product_id not in running:
+                continue  # product gone
+            previous_qty = running[item.product_id]
+            running[item.product_id] = new_qty = previous_qty + restored_qty
             adjustment = StockAdjustment(
-                product_id=product.id,
+                product_id=item.product_id,
                 unit_id=item.unit_id,
                 adjustment_type="INCREASE",
                 quantity=item.quantity,   # original unit qty
@@ -375,26 +413,15 @@ def delete_sale(sale_id):
             update_timestamps(txn)
             db.session.add(txn)
 
-        # 5️⃣ Reverse all related General Ledger entries
-        gl_entries = GeneralLedger.query.filter(
-            or_(
-                GeneralLedger.description.ilike(f"%Sale #{sale_id}%"),
-                GeneralLedger.description.ilike(f"%Payment for Sale #{sale_id}%")
-            )
-        ).all()
-
-        for entry in gl_entries:
-            reverse_type = 'Credit' if entry.transaction_type == 'Debit' else 'Debit'
-            reverse_entry = GeneralLedger(
-                account_id=entry.account_id,
-                transaction_type=reverse_type,
-                amount=entry.amount,
-                description=f"Reversal of {entry.description}",
-                transaction_date=datetime.utcnow(),
-                transaction_no=entry.transaction_no,
-                status=1
+        # 5️⃣ Reverse the sale's and its payments' GL lines (one INSERT ... SELECT)
+        reversed_lines = reverse_ledger(or_(
+            document_lines('sale', [sale.id]),
+            document_lines('payment', [p.id for p in payments])
+        ))
+        if sale.transaction_no and not reversed_lines:
+            raise ValueError(
+                f"No GL lines are linked to sale #{sale.id}; run the general_ledger source backfill in migrations.sql"
             )
-            db.session.add(reverse_entry)
 
         db.session.commit()
 
@@ -402,6 +429,9 @@ def delete_sale(sale_id):
             "message": f"Sale #{sale_id} soft deleted, stock restored correctly, GL reversed"
         }), 200
 
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": f"Failed to delete sale: {str(e)}"}), 500
@@ -464,7 +494,7 @@ def get_sale_for_edit(sale_id):
                 })
         
         
-        purchase_price = PurchaseOrderItem.query.filter_by(product_id=si.product_id, status=1).first()
+        last_purchase_price = get_latest_cost_price(si.product_id)
 
 
         # Currently selected unit (if exists)
@@ -486,7 +516,7 @@ def get_sale_for_edit(sale_id):
             "unit_id": si.unit_id,
             "unit_name": selected_unit.unit_name if selected_unit else None,
             "current_stock_base": current_stock_base,
-            "last_purchase_price":purchase_price.unit_price if purchase_price else 0,
+            "last_purchase_price": last_purchase_price,
             "units": units,  # ← all available units for editing
             # Helpful for frontend validation/display
             "max_quantity_allowed": current_stock_base if not selected_unit else current_stock_base / selected_unit.conversion_quantity if selected_unit.conversion_quantity > 0 else 0
@@ -678,6 +708,8 @@ def create_or_update_sale_old():
                 quantity=quantity,
                 unit_price=unit_price,
                 total_price=total_price,
+                unit_cost=latest_cost * (unit.conversion_quantity or 1),
+                cost_total=cogs_amount,
                 status=1
             )
             db.session.add(sale_item)
@@ -762,7 +794,9 @@ def create_or_update_sale_old():
             entries,
             transaction_no_id=txn_id,
             description=f"Sale Invoice #{txn_str} - {'Update' if sale_id else 'Create'}",
-            transaction_date=sale_date
+            transaction_date=sale_date,
+            source_type='sale',
+            source_id=sale.id
         )
 
         sale.transaction_no = txn_id
@@ -938,6 +972,8 @@ def create_or_update_sale():
                 quantity=quantity,
                 unit_price=unit_price,
                 total_price=quantity * unit_price,
+                unit_cost=latest_cost * unit.conversion_quantity,
+                cost_total=cogs_amount,
                 status=1
             )
             db.session.add(sale_item)
@@ -995,7 +1031,9 @@ def create_or_update_sale():
             entries,
             transaction_no_id=txn_id,
             description=f"Sale Invoice #{txn_str} - {'Update' if sale_id else 'Create'}",
-            transaction_date=sale_date
+            transaction_date=sale_date,
+            source_type='sale',
+            source_id=sale.id
         )
 
         # Record new payment if amount_paid > 0
@@ -1,6 +1,10 @@
 from flask import Blueprint, request, jsonify
+from sqlalchemy import select
+
 from app import db
 from app.models import ProductUnit, StockAdjustment, Product
+from app.utils.cost_layers import consume, costing_method, current_unit_cost, receive
+from app.utils.stock import InsufficientStockError, adjust_stock, reserve_stock
 
 stock_adjustment_bp = Blueprint(
     "stock_adjustment_bp",
@@ -36,6 +40,40 @@ def serialize_adjustment(adj):
         'status': adj.status,
     }
 
+# ------------------------------------------------
+# Stock movement
+# ------------------------------------------------
+# product.quantity only ever moves by a delta applied in SQL, so an
+# adjustment cannot overwrite a sale or purchase committed meanwhile.
+# previous / new quantities come from the UPDATE's RETURNING. The same
+# signed delta moves the cost layers (FIFO / moving average): found stock
+# enters at the current cost, lost stock is consumed like a sale.
+def _base_qty(adjustment_qty, unit_id):
+    unit = db.session.get(ProductUnit, unit_id) if unit_id else None
+    return float(adjustment_qty or 0) * float(unit.conversion_quantity if unit else 1)
+
+
+def _effect(adjustment_type, base_qty):
+    return base_qty if adjustment_type.upper() == "INCREASE" else -base_qty
+
+
+def _move_stock(product_id, delta, allow_negative=False):
+    """Move stock and cost layers by a signed base-unit delta; returns the new quantity. Raises InsufficientStockError."""
+    if delta < 0 and not allow_negative:
+        on_hand = reserve_stock({product_id: -delta})[product_id]
+    elif delta:
+        on_hand = adjust_stock({product_id: delta})[product_id]
+    else:
+        return db.session.execute(select(Product.quantity).where(Product.id == product_id)).scalar() or 0
+
+    if costing_method() != "latest":
+        if delta > 0:
+            receive(product_id, delta, current_unit_cost(product_id), source="adjustment")
+        else:
+            consume({product_id: -delta})
+    return on_hand
+
+
 # ------------------------------------------------
 # GET ALL
 # ------------------------------------------------
@@ -74,35 +112,26 @@ def create_adjustment():
     if not product:
         return jsonify({"error": "Product not found"}), 404
 
-    previous_qty = float(product.quantity or 0)
-
     adj_type = data["adjustment_type"].upper()
-    qty = float(data.get("quantity_change", 0))
+    if adj_type not in ("INCREASE", "DECREASE"):
+        return jsonify({"error": "adjustment_type must be INCREASE or DECREASE"}), 400
+    try:
+        qty = float(data.get("quantity_change", 0))
+    except (TypeError, ValueError):
+        return jsonify({"error": "quantity_change must be a number"}), 400
 
     # ✅ Unit conversion (optional but recommended)
-    unit_multiplier = 1
-    if data.get("unit_id"):
-        unit = db.session.get(ProductUnit, data["unit_id"])
-        if not unit:
-            return jsonify({"error": "Invalid unit"}), 400
-        unit_multiplier = unit.conversion_quantity
-
-    actual_qty = qty * unit_multiplier
-
-    if adj_type == "INCREASE":
-        new_qty = previous_qty + actual_qty
-
-    elif adj_type == "DECREASE":
-        new_qty = previous_qty - actual_qty
-        if new_qty < 0:
-            return jsonify({"error": "Stock cannot go below zero"}), 400
-
-    else:
-        return jsonify({"error": "adjustment_type must be INCREASE or DECREASE"}), 400
+    if data.get("unit_id") and not db.session.get(ProductUnit, data["unit_id"]):
+        return jsonify({"error": "Invalid unit"}), 400
+    actual_qty = _base_qty(qty, data.get("unit_id"))
 
     # ✅ Update product stock
-    product.quantity = new_qty
-    db.session.add(product)   # IMPORTANT
+    try:
+        new_qty = float(_move_stock(product.id, _effect(adj_type, actual_qty)))
+    except InsufficientStockError:
+        db.session.rollback()
+        return jsonify({"error": "Stock cannot go below zero"}), 400
+    previous_qty = new_qty - _effect(adj_type, actual_qty)
 
     adjustment = StockAdjustment(
         product_id=product.id,
@@ -184,33 +213,25 @@ def update_adjustment(id):
     if not adjustment or adjustment.status == 9:
         return jsonify({"error": "Stock adjustment not found"}), 404
 
-    data = request.get_json()
-    product = adjustment.product
-
-    # First reverse original effect
-    if adjustment.adjustment_type.upper() == "INCREASE":
-        product.quantity -= adjustment.quantity
-    else:
-        product.quantity += adjustment.quantity
-
-    previous_qty = product.quantity
+    data = request.get_json() or {}
 
     new_type = data.get("adjustment_type", adjustment.adjustment_type).upper()
-    new_qty = int(data.get("quantity_change", adjustment.quantity))
-
-    # Apply new effect
-    if new_type == "INCREASE":
-        final_qty = previous_qty + new_qty
-
-    elif new_type == "DECREASE":
-        final_qty = previous_qty - new_qty
-        if final_qty < 0:
-            return jsonify({"error": "Stock cannot go below zero"}), 400
-
-    else:
+    if new_type not in ("INCREASE", "DECREASE"):
         return jsonify({"error": "adjustment_type must be INCREASE or DECREASE"}), 400
-
-    product.quantity = final_qty
+    try:
+        new_qty = float(data.get("quantity_change", adjustment.quantity))
+    except (TypeError, ValueError):
+        return jsonify({"error": "quantity_change must be a number"}), 400
+
+    # Undo the old effect and apply the new one as one delta
+    old_effect = _effect(adjustment.adjustment_type, _base_qty(adjustment.quantity, adjustment.unit_id))
+    new_effect = _effect(new_type, _base_qty(new_qty, adjustment.unit_id))
+    try:
+        final_qty = float(_move_stock(adjustment.product_id, new_effect - old_effect))
+    except InsufficientStockError:
+        db.session.rollback()
+        return jsonify({"error": "Stock cannot go below zero"}), 400
+    previous_qty = final_qty - new_effect
 
     adjustment.adjustment_type = new_type
     adjustment.quantity = new_qty
@@ -236,33 +257,25 @@ def patch_adjustment(id):
     if not adjustment or adjustment.status == 9:
         return jsonify({"error": "Stock adjustment not found"}), 404
 
-    data = request.get_json()
-    product = adjustment.product
-
-    # Undo old effect
-    if adjustment.adjustment_type.upper() == "INCREASE":
-        product.quantity -= adjustment.quantity
-    else:
-        product.quantity += adjustment.quantity
-
-    previous_qty = product.quantity
+    data = request.get_json() or {}
 
     new_type = data.get("adjustment_type", adjustment.adjustment_type).upper()
-    new_qty = int(data.get("quantity_change", adjustment.quantity))
-
-    if new_type == "INCREASE":
-        final_qty = previous_qty + new_qty
-
-    elif new_type == "DECREASE":
-        final_qty = previous_qty - new_qty
-        if final_qty < 0:
-            return jsonify({"error": "Stock cannot go below zero"}), 400
-
-    else:
+    if new_type not in ("INCREASE", "DECREASE"):
         return jsonify({"error": "adjustment_type must be INCREASE or DECREASE"}), 400
-
-    # Apply
-    product.quantity = final_qty
+    try:
+        new_qty = float(data.get("quantity_change", adjustment.quantity))
+    except (TypeError, ValueError):
+        return jsonify({"error": "quantity_change must be a number"}), 400
+
+    # Undo the old effect and apply the new one as one delta
+    old_effect = _effect(adjustment.adjustment_type, _base_qty(adjustment.quantity, adjustment.unit_id))
+    new_effect = _effect(new_type, _base_qty(new_qty, adjustment.unit_id))
+    try:
+        final_qty = float(_move_stock(adjustment.product_id, new_effect - old_effect))
+    except InsufficientStockError:
+        db.session.rollback()
+        return jsonify({"error": "Stock cannot go below zero"}), 400
+    previous_qty = final_qty - new_effect
 
     adjustment.adjustment_type = new_type
     adjustment.quantity = new_qty
@@ -290,13 +303,13 @@ def delete_adjustment(id):
     if not adjustment or adjustment.status == 9:
         return jsonify({"error": "Stock adjustment not found"}), 404
 
-    product = adjustment.product
-
-    # Reverse the effect
-    if adjustment.adjustment_type.upper() == "INCREASE":
-        product.quantity -= adjustment.quantity
-    else:
-        product.quantity += adjustment.quantity
+    # Reverse the effect (even if the stock it added has been sold since);
+    # taking back an INCREASE consumes the oldest layers, as a sale would
+    _move_stock(
+        adjustment.product_id,
+        -_effect(adjustment.adjustment_type, _base_qty(adjustment.quantity, adjustment.unit_id)),
+        allow_negative=True,
+    )
 
     adjustment.status = 9
 
@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify
-from sqlalchemy import or_
+from sqlalchemy import or_, select
 # Suppliers Blueprint for managing supplier and purchase order operations.
 # This module provides CRUD operations for suppliers and purchase orders, including:
 # - Retrieving all suppliers or a single supplier by ID.
@@ -15,7 +15,12 @@ from sqlalchemy import or_
 from app import db
 from app.models import Account, Category, GeneralLedger, InventoryTransaction, Product, ProductUnit, Supplier, PurchaseOrder, PurchaseOrderItem, SupplierPayment
 from app.utils.auth import token_required
-from app.utils.gl_utils import post_to_ledger, generate_transaction_number
+from app.utils.gl_utils import document_lines, post_to_ledger, reverse_ledger, generate_transaction_number
+from app.utils.stock import adjust_stock
+from app.utils.costing import refresh_product_costs
+from app.utils.cost_layers import costing_method, receive, remove_receipt
+from app.utils.export import export_params, filtered, stream_export
+from app.utils.idempotency import idempotent
 from datetime import datetime
 
 from sqlalchemy.orm import joinedload
@@ -102,6 +107,30 @@ def delete_supplier(id):
     return jsonify({'message': 'Supplier deleted successfully', 'id': id})
 
 # ------------------ Purchase Orders ------------------ #
+# ------------------ Export Purchase Orders (streaming) ------------------ #
+@suppliers_bp.route('/orders/export', methods=['GET'])
+@token_required
+def export_purchase_orders():
+    """Purchase order headers as NDJSON/CSV; params in app.utils.export."""
+    try:
+        params = export_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    stmt = (
+        select(
+            PurchaseOrder.id, PurchaseOrder.invoice_number, PurchaseOrder.purchase_date,
+            PurchaseOrder.supplier_id, Supplier.name.label("supplier_name"),
+            PurchaseOrder.total_amount, PurchaseOrder.total_paid, PurchaseOrder.total_balance,
+            PurchaseOrder.memo, PurchaseOrder.status, PurchaseOrder.transaction_no
+        )
+        .join(Supplier, Supplier.id == PurchaseOrder.supplier_id)
+        .where(PurchaseOrder.status != 9)
+    )
+    return stream_export(
+        filtered(stmt, PurchaseOrder.id, PurchaseOrder.purchase_date, params), params, "purchase_orders"
+    )
+
 # ------------------ Get Purchase Orders ------------------ #
 @token_required
 @suppliers_bp.route('/orders', methods=['GET'])
@@ -118,12 +147,13 @@ def get_purchase_orders():
     # orders = PurchaseOrder.query.filter(PurchaseOrder.status.in_([1, 2, 3, 4, 5])).all()
         # Search filter
     if search:
-        search_pattern = f"%{search.lower()}%"
+        # plain ILIKE (not lower(col) LIKE) so the pg_trgm indexes apply
+        search_pattern = f"%{search}%"
         query = query.filter(
             db.or_(
-                db.func.lower(Supplier.name).like(search_pattern),
-                db.func.lower(PurchaseOrder.invoice_number).like(search_pattern),
-                db.func.lower(PurchaseOrder.memo).like(search_pattern)
+                Supplier.name.ilike(search_pattern),
+                PurchaseOrder.invoice_number.ilike(search_pattern),
+                PurchaseOrder.memo.ilike(search_pattern)
             )
         )
         # Date filter
@@ -359,6 +389,7 @@ def get_purchase_order(id):
 #     return jsonify({'message': 'Purchase Order created successfully', 'po_id': po.id}), 200
 @token_required
 @suppliers_bp.route('/orders', methods=['POST'])
+@idempotent('add_purchase_order')
 def add_purchase_order():
     data = request.get_json()
 
@@ -377,6 +408,8 @@ def add_purchase_order():
     db.session.flush()  # Get po.id
 
     total_amount = 0.0
+    stock_in = {}
+    receipts = []
     txn_id, txn_str = generate_transaction_number('CREDIT-PAY', transaction_date=po.purchase_date)
     po.transaction_no = txn_id
 
@@ -390,10 +423,12 @@ def add_purchase_order():
         product = Product.query.get_or_404(product_id)
 
         if not unit_id:
+            db.session.rollback()
             return jsonify({'error': f'unit_id required for {product.name}'}), 400
 
         unit = ProductUnit.query.filter_by(id=unit_id, product_id=product_id, status=1).first()
         if not unit:
+            db.session.rollback()
             return jsonify({'error': f'Invalid unit for {product.name}'}), 400
 
         # Convert to base units for stock addition
@@ -411,10 +446,10 @@ def add_purchase_order():
         )
         db.session.add(item)
         total_amount += item.total_price
+        receipts.append((item, base_quantity, unit_price / (unit.conversion_quantity or 1)))
 
-        # Update product stock in base units
-        product.quantity = (product.quantity or 0) + base_quantity
-        db.session.add(product)
+        # Stock in base units, applied for all lines at once below
+        stock_in[product.id] = stock_in.get(product.id, 0.0) + base_quantity
 
         # Inventory Transaction (inflow in base units)
         inv_txn = InventoryTransaction(
@@ -430,6 +465,15 @@ def add_purchase_order():
         )
         db.session.add(inv_txn)
 
+    adjust_stock(stock_in)
+
+    # Cost layers (FIFO / moving average) reference the line ids
+    if costing_method() != 'latest':
+        db.session.flush()
+        for item, base_quantity, base_cost in receipts:
+            receive(item.product_id, base_quantity, base_cost,
+                    purchase_order_item_id=item.id, received_at=po.purchase_date)
+
     # Update PO totals
     po.total_amount = total_amount
     po.total_balance = total_amount
@@ -440,25 +484,54 @@ def add_purchase_order():
         {"account_id": 2100, "transaction_type": "Credit", "amount": total_amount}  # Accounts Payable
     ]
 
-    post_to_ledger(
-        entries,
-        transaction_no_id=txn_id,
-        description=f"Credit for PO #{po.id}",
-        transaction_date=po.purchase_date
-    )
+    try:
+        post_to_ledger(
+            entries,
+            transaction_no_id=txn_id,
+            description=f"Credit for PO #{po.id}",
+            transaction_date=po.purchase_date,
+            source_type='purchase_order',
+            source_id=po.id
+        )
+        refresh_product_costs(stock_in)
 
-    db.session.commit()
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
 
     return jsonify({
         'message': 'Purchase Order created successfully',
         'po_id': po.id,
         'total_amount': total_amount
     }), 201
+def _line_layers(changes, item, old_base, new_base, old_cost, new_cost):
+    """Record a PO line's base-quantity change for _apply_layer_changes()."""
+    if new_base > old_base:
+        changes.append(('receive', item, new_base - old_base, new_cost))
+    elif new_base < old_base:
+        changes.append(('remove', item, old_base - new_base, old_cost))
+
+
+def _apply_layer_changes(changes):
+    """Keep cost layers (FIFO / moving average) in step with a PO edit's stock deltas."""
+    if costing_method() == 'latest' or not changes:
+        return
+    db.session.flush()  # receipts reference the line ids
+    for action, item, base_qty, base_cost in changes:
+        if action == 'remove':
+            remove_receipt(item.product_id, base_qty, base_cost, item.id)
+        else:
+            receive(item.product_id, base_qty, base_cost, purchase_order_item_id=item.id)
+
+
 # Update purchase order details
 @token_required
 @suppliers_bp.route('/orders/<int:id>', methods=['PUT'])
 def update_purchase_order(id):
     po = PurchaseOrder.query.get_or_404(id)
+    if po.status == 9:
+        return jsonify({'error': 'Purchase Order is deleted'}), 400
     data = request.get_json()
 
     po.supplier_id = data.get('supplier_id', po.supplier_id)
@@ -466,29 +539,67 @@ def update_purchase_order(id):
     po.memo = data.get('memo', po.memo)
     po.purchase_date = data.get('purchase_date', po.purchase_date)
 
-    # Update items if provided
-    if 'items' in data:
-        for item_data in data['items']:
-            if 'id' in item_data:
-                # Update existing item
-                item = PurchaseOrderItem.query.get(item_data['id'])
-                if item and item.purchase_order_id == po.id:
-                    item.quantity = item_data.get('quantity', item.quantity)
-                    item.unit_price = item_data.get('unit_price', item.unit_price)
-                    item.calculate_total()
-            else:
-                # Add new item
-                new_item = PurchaseOrderItem(
-                    purchase_order_id=po.id,
-                    product_id=item_data['product_id'],
-                    quantity=item_data['quantity'],
-                    unit_price=item_data['unit_price'],
-                    status=1
-                )
-                new_item.calculate_total()
-                db.session.add(new_item)
-
+    # Update items if provided, keeping product stock in step (base units)
+    stock_delta = {}
+    layer_changes = []
+    touched = {i.product_id for i in po.items if i.status != 9}
+    for item_data in data.get('items', []):
+        if 'id' in item_data:
+            # Update existing item; deleted lines no longer hold stock
+            item = PurchaseOrderItem.query.get(item_data['id'])
+            if not item or item.purchase_order_id != po.id or item.status == 9:
+                continue
+            try:
+                new_quantity = float(item_data.get('quantity', item.quantity))
+                unit_price = float(item_data.get('unit_price', item.unit_price))
+            except (TypeError, ValueError):
+                db.session.rollback()
+                return jsonify({'error': f"Item {item.id}: quantity and unit_price must be numbers"}), 400
+            conversion = item.unit.conversion_quantity if item.unit else 1.0
+            stock_delta[item.product_id] = (
+                stock_delta.get(item.product_id, 0.0) + (new_quantity - item.quantity) * conversion
+            )
+            _line_layers(
+                layer_changes, item, item.quantity * conversion, new_quantity * conversion,
+                (item.unit_price or 0) / (conversion or 1), unit_price / (conversion or 1),
+            )
+            item.quantity = new_quantity
+            item.unit_price = unit_price
+            item.calculate_total()
+        else:
+            # Add new item (same rules as add_purchase_order)
+            try:
+                product_id = int(item_data['product_id'])
+                quantity = float(item_data['quantity'])
+                unit_price = float(item_data['unit_price'])
+            except (KeyError, TypeError, ValueError):
+                db.session.rollback()
+                return jsonify({'error': 'New items need a numeric product_id, quantity and unit_price'}), 400
+            unit = ProductUnit.query.filter_by(id=item_data.get('unit_id'), product_id=product_id, status=1).first()
+            if not unit:
+                db.session.rollback()
+                return jsonify({'error': f'A valid unit_id is required for product {product_id}'}), 400
+
+            new_item = PurchaseOrderItem(
+                purchase_order_id=po.id,
+                product_id=product_id,
+                unit_id=unit.id,
+                quantity=quantity,
+                unit_price=unit_price,
+                status=1
+            )
+            new_item.calculate_total()
+            po.items.append(new_item)  # so update_totals() below counts it
+            stock_delta[product_id] = stock_delta.get(product_id, 0.0) + quantity * unit.conversion_quantity
+            _line_layers(
+                layer_changes, new_item, 0.0, quantity * unit.conversion_quantity,
+                0.0, unit_price / (unit.conversion_quantity or 1),
+            )
+            touched.add(product_id)
 
+    adjust_stock(stock_delta)
+    _apply_layer_changes(layer_changes)
+    refresh_product_costs(touched)
 
     # Recalculate totals
     po.update_totals()
@@ -580,15 +691,21 @@ def pay_purchase_order(id):
         }
     ]
 
-    post_to_ledger(
-        entries,
-        transaction_no_id=txn_id,
-        description=f"Payment for PO #{po.id}",
-        transaction_date=transaction_date
-    )
+    try:
+        post_to_ledger(
+            entries,
+            transaction_no_id=txn_id,
+            description=f"Payment for PO #{po.id}",
+            transaction_date=transaction_date,
+            source_type='supplier_payment',
+            source_id=payment.id
+        )
 
-    # Final commit
-    db.session.commit()
+        # Final commit
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
 
     return jsonify({
         "message": f"Payment of {amount} recorded for PO #{po.id}",
@@ -673,35 +790,34 @@ def delete_purchase_order(id):
     if po.status == 9:
         return jsonify({'error': 'Already deleted'}), 400
 
-    # Reverse GL
-    gl_entries = GeneralLedger.query.filter(
-        or_(
-            GeneralLedger.description.ilike(f"%PO #{po.id}%"),
-            GeneralLedger.description.ilike(f"%Payment for PO #{po.id}%")
-        )
-    ).all()
-
-    for entry in gl_entries:
-        reversed_entry = GeneralLedger(
-            account_id=entry.account_id,
-            transaction_type="Credit" if entry.transaction_type == "Debit" else "Debit",
-            amount=entry.amount,
-            description=f"Reversal of deleted PO #{po.id}",
-            transaction_date=datetime.utcnow(),
-            transaction_no=entry.transaction_no,
-            status=1
+    # Reverse the PO's and its payments' GL lines (one INSERT ... SELECT)
+    payment_ids = [p.id for p in SupplierPayment.query.filter(
+        SupplierPayment.purchase_order_id == po.id, SupplierPayment.status != 9
+    ).all()]
+    try:
+        reversed_lines = reverse_ledger(
+            or_(document_lines('purchase_order', [po.id]), document_lines('supplier_payment', payment_ids)),
+            description=f"Reversal of deleted PO #{po.id}"
         )
-        db.session.add(reversed_entry)
+        if po.transaction_no and not reversed_lines:
+            raise ValueError(
+                f"No GL lines are linked to PO #{po.id}; run the general_ledger source backfill in migrations.sql"
+            )
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
 
     # Rollback stock
+    stock_out = {}
     for item in po.items:
         if item.status == 9:
             continue
         unit = ProductUnit.query.get(item.unit_id)
-        if unit and item.product:
+        if unit:
             base_qty = item.quantity * unit.conversion_quantity
-            item.product.quantity = max((item.product.quantity or 0) - base_qty, 0)
-            db.session.add(item.product)
+            stock_out[item.product_id] = stock_out.get(item.product_id, 0.0) - base_qty
+            remove_receipt(item.product_id, base_qty, (item.unit_price or 0) / (unit.conversion_quantity or 1), item.id)
+    adjust_stock(stock_out)
 
     # Soft delete
     po.status = 9
@@ -709,6 +825,7 @@ def delete_purchase_order(id):
         item.status = 9
     SupplierPayment.query.filter_by(purchase_order_id=po.id).update({'status': 9})
     InventoryTransaction.query.filter_by(purchase_order_id=po.id).update({'status': 9})
+    refresh_product_costs({item.product_id for item in po.items})
 
     db.session.commit()
 
@@ -1038,17 +1155,23 @@ def edit_purchase_order(id):
     txn_id, txn_str = generate_transaction_number('PO-EDIT', transaction_date=po.purchase_date)
 
     if 'items' in data:
-        # Track old items for stock rollback
+        # Track old items for stock rollback; stock moves by one delta per product
         old_items = {item.id: item for item in po.items if item.status != 9}
+        stock_delta = {}
+        layer_changes = []
 
         # Delete removed items (soft delete + stock rollback)
         incoming_ids = {i.get('id') for i in data['items'] if i.get('id')}
         for old_item in list(old_items.values()):
             if old_item.id not in incoming_ids:
                 unit = ProductUnit.query.get(old_item.unit_id)
-                if unit and old_item.product:
+                if unit:
                     base_qty = old_item.quantity * unit.conversion_quantity
-                    old_item.product.quantity = max((old_item.product.quantity or 0) - base_qty, 0)
+                    stock_delta[old_item.product_id] = stock_delta.get(old_item.product_id, 0.0) - base_qty
+                    _line_layers(
+                        layer_changes, old_item, base_qty, 0.0,
+                        (old_item.unit_price or 0) / (unit.conversion_quantity or 1), 0.0,
+                    )
                 old_item.status = 9
 
         # Process incoming items
@@ -1069,9 +1192,9 @@ def edit_purchase_order(id):
 
                 # Rollback old stock
                 old_unit = ProductUnit.query.get(item.unit_id)
-                if old_unit:
-                    old_base = item.quantity * old_unit.conversion_quantity
-                    product.quantity = (product.quantity or 0) - old_base
+                old_base = item.quantity * old_unit.conversion_quantity if old_unit else 0.0
+                old_cost = (item.unit_price or 0) / ((old_unit.conversion_quantity if old_unit else 1) or 1)
+                stock_delta[item.product_id] = stock_delta.get(item.product_id, 0.0) - old_base
 
                 # Update fields — INCLUDING UNIT_ID!
                 item.unit_id = unit_id
@@ -1080,7 +1203,10 @@ def edit_purchase_order(id):
                 item.total_price = quantity * unit_price
 
                 # Add new stock
-                product.quantity = (product.quantity or 0) + base_qty
+                stock_delta[product.id] = stock_delta.get(product.id, 0.0) + base_qty
+                _line_layers(
+                    layer_changes, item, old_base, base_qty, old_cost, unit_price / (unit.conversion_quantity or 1)
+                )
 
             else:
                 # === ADD NEW ITEM ===
@@ -1094,7 +1220,8 @@ def edit_purchase_order(id):
                     status=1
                 )
                 db.session.add(item)
-                product.quantity = (product.quantity or 0) + base_qty
+                stock_delta[product.id] = stock_delta.get(product.id, 0.0) + base_qty
+                _line_layers(layer_changes, item, 0.0, base_qty, 0.0, unit_price / (unit.conversion_quantity or 1))
 
             # Update or create inventory transaction
             inv_txn = InventoryTransaction.query.filter_by(
@@ -1122,19 +1249,30 @@ def edit_purchase_order(id):
                 )
                 db.session.add(new_inv)
 
+        adjust_stock(stock_delta)
+        _apply_layer_changes(layer_changes)
+
     # Recalculate totals
     po.update_totals()
     diff = po.total_amount - old_total
 
-    if diff != 0:
-        entries = [
-            {"account_id": 1200, "transaction_type": "Debit" if diff > 0 else "Credit", "amount": abs(diff)},
-            {"account_id": 2100, "transaction_type": "Credit" if diff > 0 else "Debit", "amount": abs(diff)}
-        ]
-        post_to_ledger(entries, transaction_no_id=txn_id,
-                       description=f"PO #{po.id} edit adjustment", transaction_date=po.purchase_date)
-
-    db.session.commit()
+    try:
+        if diff != 0:
+            entries = [
+                {"account_id": 1200, "transaction_type": "Debit" if diff > 0 else "Credit", "amount": abs(diff)},
+                {"account_id": 2100, "transaction_type": "Credit" if diff > 0 else "Debit", "amount": abs(diff)}
+            ]
+            post_to_ledger(entries, transaction_no_id=txn_id,
+                           description=f"PO #{po.id} edit adjustment", transaction_date=po.purchase_date,
+                           source_type='purchase_order', source_id=po.id)
+
+        refresh_product_costs(
+            {i.product_id for i in po.items} | {int(i['product_id']) for i in data.get('items', [])}
+        )
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
 
     return jsonify({'message': 'Purchase Order updated successfully', 'po_id': po.id}), 200
 
@@ -0,0 +1,160 @@
+"""
+Account hierarchy via the account_closure table.
+
+account_closure holds one row per (ancestor, descendant) pair, each
+account included with itself at depth 0. An after_flush hook keeps it in
+step with account.parent_id:
+
+* new account    -> its own row plus one row per ancestor of its parent
+* parent change  -> the subtree's links to its old ancestors are dropped
+                    and linked to the new parent's ancestors. A move under
+                    the account's own subtree raises ValueError.
+* hard delete    -> its rows go (ON DELETE CASCADE on PostgreSQL)
+
+Soft-deleted accounts (status 9) keep their rows; readers filter on status.
+subtree_sums() rolls any per-account figures up to every ancestor in one
+join. Reports hang each active account under its nearest active ancestor
+(nearest_active_parent), so a soft-deleted parent does not split a
+subtree between a roll-up and a root. rebuild_account_closure() recomputes
+the table from parent_id; run.py calls it on start.
+"""
+from sqlalchemy import delete, event, func, insert, inspect, literal, select, union_all
+from sqlalchemy.orm import Session, aliased
+
+from app import db
+from app.models import Account, AccountClosure
+
+MAX_DEPTH = 32  # bounds the rebuild's recursion if parent_id ever forms a cycle
+
+
+# ------------------ Maintenance ------------------
+def rebuild_account_closure():
+    """Recompute account_closure from account.parent_id. Returns the row count. Never commits."""
+    tree = select(
+        Account.id.label("ancestor_id"), Account.id.label("descendant_id"), literal(0).label("depth")
+    ).cte("tree", recursive=True)
+    child = aliased(Account)
+    tree = tree.union_all(
+        select(tree.c.ancestor_id, child.id, tree.c.depth + 1)
+        .join(child, child.parent_id == tree.c.descendant_id)
+        .where(tree.c.depth < MAX_DEPTH)
+    )
+    pairs = select(tree.c.ancestor_id, tree.c.descendant_id, func.min(tree.c.depth)).group_by(
+        tree.c.ancestor_id, tree.c.descendant_id
+    )
+    db.session.execute(delete(AccountClosure))
+    return db.session.execute(
+        insert(AccountClosure).from_select(["ancestor_id", "descendant_id", "depth"], pairs)
+    ).rowcount
+
+
+def _link(conn, account_id, parent_id):
+    rows = select(literal(account_id), literal(account_id), literal(0))
+    if parent_id is not None:
+        rows = union_all(rows, select(
+            AccountClosure.ancestor_id, literal(account_id), AccountClosure.depth + 1
+        ).where(AccountClosure.descendant_id == parent_id))
+    conn.execute(insert(AccountClosure).from_select(["ancestor_id", "descendant_id", "depth"], rows))
+
+
+def _move(conn, account_id, parent_id):
+    subtree = select(AccountClosure.descendant_id).where(AccountClosure.ancestor_id == account_id)
+    if parent_id is not None and conn.execute(
+        subtree.where(AccountClosure.descendant_id == parent_id)
+    ).first():
+        raise ValueError("An account cannot be moved under itself or one of its sub-accounts")
+
+    conn.execute(delete(AccountClosure).where(
+        AccountClosure.descendant_id.in_(subtree),
+        AccountClosure.ancestor_id.not_in(subtree),
+    ))
+    if parent_id is None:
+        return
+    above, below = aliased(AccountClosure), aliased(AccountClosure)
+    conn.execute(insert(AccountClosure).from_select(
+        ["ancestor_id", "descendant_id", "depth"],
+        select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+        .join(below, below.ancestor_id == account_id)
+        .where(above.descendant_id == parent_id),
+    ))
+
+
+@event.listens_for(Session, "after_flush")
+def _maintain_closure(session, flush_context):
+    new = {a.id: a for a in session.new if isinstance(a, Account)}
+    moved = [
+        a for a in session.dirty
+        if isinstance(a, Account) and inspect(a).attrs.parent_id.history.has_changes()
+    ]
+    deleted = [a.id for a in session.deleted if isinstance(a, Account)]
+    if not (new or moved or deleted):
+        return
+
+    conn = session.connection()
+    while new:  # parents before children added in the same flush
+        account = next(
+            (a for a in new.values() if a.parent_id not in new or a.parent_id == a.id), next(iter(new.values()))
+        )
+        del new[account.id]
+        _link(conn, account.id, account.parent_id if account.parent_id != account.id else None)
+    for account in moved:
+        _move(conn, account.id, account.parent_id)
+    if deleted:
+        conn.execute(delete(AccountClosure).where(
+            (AccountClosure.ancestor_id.in_(deleted)) | (AccountClosure.descendant_id.in_(deleted))
+        ))
+
+
+# ------------------ Readers ------------------
+def subtree_sums(values, *columns):
+    """
+    Subquery (account_id, <columns>): each account's figure plus those of its
+    active descendants. `values` is a subquery with account_id and the
+    given columns.
+    """
+    member = aliased(Account)
+    return (
+        select(
+            AccountClosure.ancestor_id.label("account_id"),
+            *[func.sum(values.c[c]).label(c) for c in columns],
+        )
+        .join(values, values.c.account_id == AccountClosure.descendant_id)
+        .join(member, member.id == AccountClosure.descendant_id)
+        .where(member.status != 9)
+        .group_by(AccountClosure.ancestor_id)
+        .subquery()
+    )
+
+
+def nearest_active_parent():
+    """Correlated scalar: the closest active ancestor of the Account row in the enclosing query."""
+    ancestor = aliased(Account)
+    return (
+        select(AccountClosure.ancestor_id)
+        .join(ancestor, ancestor.id == AccountClosure.ancestor_id)
+        .where(
+            AccountClosure.descendant_id == Account.id,
+            AccountClosure.depth > 0,
+            ancestor.status != 9,
+        )
+        .order_by(AccountClosure.depth)
+        .limit(1)
+        .correlate(Account)
+        .scalar_subquery()
+    )
+
+
+def attach_children(nodes, parent_key="parent_id"):
+    """
+    Nest node dicts (keyed by account id, each with a "children" list) under
+    their parent_key and return the roots. Uses no recursion, so the depth
+    of the chart does not matter.
+    """
+    roots = []
+    for node in nodes.values():
+        parent = nodes.get(node[parent_key])
+        if parent is not None and parent is not node:
+            parent["children"].append(node)
+        else:
+            roots.append(node)
+    return roots
@@ -0,0 +1,152 @@
+"""
+Debtors / creditors aging over open Sale and PurchaseOrder balances.
+
+A page of the report costs two queries. The first groups every open
+document (balance > 0, served by the ix_*_open_balance partial indexes)
+per party and bucket. Its window aggregates add the party count and the
+grand total of each bucket to every row of the page. The second fetches the
+open documents of the parties on that page.
+
+Age is whole days between the document date and the as-of date. Buckets
+are upper bounds in days: (30, 60, 90) gives 0-30, 31-60, 61-90 and >90.
+The defaults come from AGING_BUCKETS; a request may pass its own.
+"""
+from dataclasses import dataclass
+
+from flask import current_app
+from sqlalchemy import Date, Integer, case, cast, func, literal, select
+
+from app import db
+from app.models import Customer, PurchaseOrder, Sale, Supplier
+
+MAX_BUCKETS = 12
+
+
+@dataclass(frozen=True)
+class AgingSource:
+    document: type
+    party: type
+    party_id: object
+    doc_date: object
+    balance: object
+
+
+DEBTORS = AgingSource(Sale, Customer, Sale.customer_id, Sale.sale_date, Sale.balance)
+CREDITORS = AgingSource(
+    PurchaseOrder, Supplier, PurchaseOrder.supplier_id, PurchaseOrder.purchase_date, PurchaseOrder.total_balance
+)
+
+
+def parse_buckets(value=None):
+    """'30,60,90' -> (30, 60, 90); falls back to AGING_BUCKETS. Raises ValueError."""
+    value = value or current_app.config.get("AGING_BUCKETS", "30,60,90")
+    try:
+        bounds = tuple(int(v) for v in str(value).split(",") if v.strip())
+    except ValueError:
+        raise ValueError("buckets must be comma-separated whole days, e.g. 30,60,90")
+    if not bounds or len(bounds) > MAX_BUCKETS:
+        raise ValueError(f"buckets takes 1 to {MAX_BUCKETS} boundaries")
+    if bounds[0] <= 0 or any(a >= b for a, b in zip(bounds, bounds[1:])):
+        raise ValueError("bucket boundaries must be positive and increasing")
+    return bounds
+
+
+def bucket_labels(bounds):
+    labels, low = [], 0
+    for high in bounds:
+        labels.append(f"{low}-{high}")
+        low = high + 1
+    return labels + [f">{bounds[-1]}"]
+
+
+def _days_outstanding(doc_date, as_of):
+    as_of = as_of.date()
+    if db.session.connection().dialect.name == "postgresql":
+        return cast(cast(literal(as_of), Date) - cast(doc_date, Date), Integer)
+    return cast(func.julianday(as_of.isoformat()) - func.julianday(func.date(doc_date)), Integer)
+
+
+def _bucket(days, bounds, labels):
+    return case(*[(days <= high, label) for high, label in zip(bounds, labels)], else_=labels[-1])
+
+
+def _open_documents(source):
+    return [source.document.status != 9, source.balance > 0]  # matches the partial index predicate
+
+
+def aging_page(source, as_of, bounds, page, page_size, doc_columns):
+    """
+    Returns (party rows of the page, open documents of those parties keyed by
+    party id, party count, grand totals by bucket label). Party rows are
+    (party object, balance, b0 .. bN per bucket, window columns).
+    Document rows carry doc_columns plus days_outstanding and aging_bucket.
+    """
+    labels = bucket_labels(bounds)
+    days = _days_outstanding(source.doc_date, as_of)
+    docs = (
+        select(source.party_id.label("party_id"), source.balance.label("balance"), days.label("days"))
+        .where(*_open_documents(source))
+        .subquery()
+    )
+
+    bucket_sums, low = [], None
+    for i, high in enumerate(bounds + (None,)):
+        if low is None:
+            in_bucket = docs.c.days <= high
+        elif high is None:
+            in_bucket = docs.c.days > low
+        else:
+            in_bucket = (docs.c.days > low) & (docs.c.days <= high)
+        bucket_sums.append(func.sum(case((in_bucket, docs.c.balance), else_=0)).label(f"b{i}"))
+        low = high
+
+    per_party = (
+        select(docs.c.party_id, func.sum(docs.c.balance).label("balance"), *bucket_sums)
+        .group_by(docs.c.party_id)
+        .subquery()
+    )
+    bucket_columns = [per_party.c[f"b{i}"] for i in range(len(labels))]
+    party = source.party
+    rows = db.session.execute(
+        select(
+            party, per_party.c.balance, *bucket_columns,
+            func.count().over().label("party_count"),
+            func.sum(per_party.c.balance).over().label("grand_total"),
+            *[func.sum(c).over().label(f"grand_{c.name}") for c in bucket_columns],
+        )
+        .join(per_party, per_party.c.party_id == party.id)
+        .where(party.status != 9)
+        .order_by(party.name, party.id)
+        .offset((page - 1) * page_size)
+        .limit(page_size)
+    ).all()
+
+    if not rows and page > 1:
+        # past the last page: still report the count and grand totals
+        _, _, party_count, totals = aging_page(source, as_of, bounds, 1, 1, doc_columns)
+        return rows, {}, party_count, totals
+    if not rows:
+        return rows, {}, 0, {label: 0.0 for label in labels + ["total"]}
+
+    first = rows[0]._mapping
+    totals = {label: float(first[f"grand_b{i}"] or 0) for i, label in enumerate(labels)}
+    totals["total"] = float(first["grand_total"] or 0)
+
+    doc_rows = db.session.execute(
+        select(
+            *doc_columns, source.party_id.label("party_id"),
+            days.label("days_outstanding"), _bucket(days, bounds, labels).label("aging_bucket"),
+        )
+        .where(*_open_documents(source), source.party_id.in_([r[0].id for r in rows]))
+        .order_by(source.party_id, source.doc_date, source.document.id)
+    ).all()
+    documents = {}
+    for doc in doc_rows:
+        documents.setdefault(doc.party_id, []).append(doc)
+
+    return rows, documents, first["party_count"], totals
+
+
+def party_buckets(row, labels):
+    """Bucket totals of one party row of aging_page()."""
+    return {label: float(row._mapping[f"b{i}"] or 0) for i, label in enumerate(labels)}
@@ -0,0 +1,179 @@
+"""
+Worker-local product catalog for POS autocomplete (/products/search).
+
+Each worker keeps a compact, read-only snapshot of the active catalog:
+products with category, active units, unit purchase cost and stock. Searches
+are answered from memory through two indexes:
+
+* word prefixes (1-2 character queries: "ha" -> "Hammer", "Hacksaw"), and
+* trigrams (3+ characters: substring match on name or SKU, same results as
+  the old ILIKE '%q%').
+
+Freshness:
+* inventory.py bumps the 'catalog' cache version (app.utils.versions) in the
+  same transaction as any product, unit or category write, and drops the
+  local copy after commit. Other workers compare versions at most every
+  CATALOG_VERSION_CHECK_SECONDS (one primary-key read) and rebuild on change.
+* Stock and costs move with every sale/PO and do not bump the version; the
+  snapshot is rebuilt anyway once it is CATALOG_MAX_AGE_SECONDS old. The
+  quantity shown can lag by that much; checkout re-checks stock atomically.
+"""
+import bisect
+import heapq
+import threading
+import time
+from itertools import islice
+
+from flask import current_app
+
+from app import db
+from app.models import Category, Product, ProductUnit
+from app.utils.costing import latest_cost_prices
+from app.utils.versions import bump_version, current_version
+
+CATALOG_VERSION = "catalog"
+MAX_PREFIX = 12
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+class CatalogSnapshot:
+    def __init__(self, version, records):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.checked_at = self.built_at
+        self.records = records  # product_id -> serialized product dict
+        self.prefixes = {}      # word prefix -> {product_id}
+        self.trigrams = {}      # trigram -> {product_id}
+        self.haystack = {}      # product_id -> "name sku" lowercased
+        self.by_sku = {}        # sku lowercased -> product_id
+
+        for pid, rec in records.items():
+            text = f"{rec['name']} {rec['sku'] or ''}".lower()
+            self.haystack[pid] = text
+            self.by_sku.setdefault((rec['sku'] or '').lower(), pid)
+            for word in text.split():
+                for n in range(1, min(len(word), MAX_PREFIX) + 1):
+                    self.prefixes.setdefault(word[:n], set()).add(pid)
+            for gram in _trigrams(text):
+                self.trigrams.setdefault(gram, set()).add(pid)
+
+        # A-Z order, so ranking never has to sort the candidates
+        self.order = sorted(records, key=lambda pid: (records[pid]['name'].lower(), pid))
+        self.names = [records[pid]['name'].lower() for pid in self.order]
+        self.position = {pid: i for i, pid in enumerate(self.order)}
+
+    def search(self, query, limit=20):
+        q = query.lower().strip()
+        if not q:
+            return []
+        if len(q) < 3:
+            candidates = self.prefixes.get(q, set())
+        else:
+            grams = sorted((self.trigrams.get(g, set()) for g in _trigrams(q)), key=len)
+            candidates = set.intersection(*grams) if grams else set()
+            candidates = {pid for pid in candidates if q in self.haystack[pid]}
+
+        # Ranking: exact SKU, then names starting with the query, then the rest A-Z.
+        hits = []
+        exact = self.by_sku.get(q)
+        if exact in candidates:
+            hits.append(exact)
+
+        i = bisect.bisect_left(self.names, q)
+        while i < len(self.names) and len(hits) < limit and self.names[i].startswith(q):
+            if self.order[i] != exact:
+                hits.append(self.order[i])
+            i += 1
+
+        if len(hits) < limit:
+            rest = candidates.difference(hits)
+            wanted = limit - len(hits)
+            if len(rest) * 8 > len(self.order):
+                # broad query: walking the A-Z list stops after a few dozen steps
+                hits += islice((pid for pid in self.order if pid in rest), wanted)
+            else:
+                hits += heapq.nsmallest(wanted, rest, key=self.position.__getitem__)
+
+        return [self.records[pid] for pid in hits]
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _build(version):
+    rows = (
+        db.session.query(Product, Category.name)
+        .outerjoin(Category, Category.id == Product.category_id)
+        .filter(Product.status == 1)
+        .all()
+    )
+    units_by_product = {}
+    for u in ProductUnit.query.filter(ProductUnit.status == 1).order_by(ProductUnit.id).all():
+        units_by_product.setdefault(u.product_id, []).append(u)
+    costs = latest_cost_prices(None)
+
+    records = {}
+    for p, category_name in rows:
+        base_cost = costs.get(p.id, 0.0)
+        records[p.id] = {
+            "id": p.id,
+            "name": p.name,
+            "sku": p.sku,
+            "category_id": p.category_id,
+            "category_name": category_name,
+            "quantity": round(float(p.quantity or 0), 4),
+            "units": [{
+                "id": u.id,
+                "unit_name": u.unit_name,
+                "conversion_quantity": float(u.conversion_quantity),
+                "retail_price": float(u.retail_price or 0),
+                "wholesale_price": float(u.wholesale_price or 0),
+                "is_returnable": bool(u.is_returnable),
+                "unit_code": u.unit_code,
+                "purchase_price": base_cost * float(u.conversion_quantity or 1)
+            } for u in units_by_product.get(p.id, [])]
+        }
+    return CatalogSnapshot(version, records)
+
+
+def get_catalog():
+    """The current snapshot, rebuilt when stale (see module docstring)."""
+    global _snapshot
+    config = current_app.config
+    snapshot = _snapshot
+    now = time.monotonic()
+
+    if snapshot is not None:
+        if now - snapshot.built_at > config.get("CATALOG_MAX_AGE_SECONDS", 30):
+            snapshot = None
+        elif now - snapshot.checked_at > config.get("CATALOG_VERSION_CHECK_SECONDS", 2):
+            if current_version(CATALOG_VERSION) != snapshot.version:
+                snapshot = None
+            else:
+                snapshot.checked_at = now
+    if snapshot is not None:
+        return snapshot
+
+    with _lock:
+        if _snapshot is not None and _snapshot is not snapshot and _snapshot.built_at > now:
+            return _snapshot  # another thread rebuilt while we waited
+        _snapshot = _build(current_version(CATALOG_VERSION))
+        return _snapshot
+
+
+def search_catalog(query, limit=20):
+    return get_catalog().search(query, limit)
+
+
+def catalog_changed():
+    """Call before committing a product / unit / category write."""
+    bump_version(CATALOG_VERSION)
+
+
+def invalidate_catalog():
+    """Call after that commit: this worker rebuilds on its next search."""
+    global _snapshot
+    _snapshot = None
@@ -0,0 +1,127 @@
+from sqlalchemy import insert
+
+from app import db
+from app.models import Product, ProductUnit, SaleItem, InventoryTransaction
+from app.utils.cost_layers import consume
+from app.utils.costing import latest_cost_prices
+from app.utils.stock import reserve_stock
+
+
+class CheckoutError(ValueError):
+    """A basket line cannot be sold (unknown product, bad unit, no stock)."""
+
+
+# ------------------ Basket Prefetch ------------------
+def load_basket(items):
+    """
+    Resolve every basket line against the database in a constant number of
+    queries (products, units, latest costs), whatever the basket size.
+    Stock is not checked here; see deduct_stock().
+    Returns one dict per line, in request order.
+    """
+    if not items:
+        raise CheckoutError("At least one item is required")
+
+    product_ids = sorted({int(i['product_id']) for i in items})
+    unit_ids = {int(i['unit_id']) for i in items if i.get('unit_id')}
+
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids)).all()}
+    units = {
+        u.id: u for u in ProductUnit.query.filter(ProductUnit.id.in_(unit_ids), ProductUnit.status == 1).all()
+    } if unit_ids else {}
+    costs = latest_cost_prices(product_ids)
+
+    lines = []
+    for item_data in items:
+        product = products.get(int(item_data['product_id']))
+        if not product:
+            raise CheckoutError(f"Product {item_data['product_id']} not found")
+
+        unit_id = item_data.get('unit_id')
+        if not unit_id:
+            raise CheckoutError(f"unit_id required for product {product.name}")
+
+        unit = units.get(int(unit_id))
+        if not unit or unit.product_id != product.id:
+            raise CheckoutError(f"Invalid or inactive unit for product {product.name}")
+
+        quantity = float(item_data['quantity'])  # quantity in selected unit
+        unit_price = float(item_data.get('unit_price') or 0)
+        lines.append({
+            "product": product,
+            "unit": unit,
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "total_price": unit_price * quantity,
+            "base_qty": quantity * unit.conversion_quantity,
+            "cost_price": costs.get(product.id, 0.0),
+        })
+    return lines
+
+
+# ------------------ Stock & Bulk Writes ------------------
+def deduct_stock(lines):
+    """
+    Take the basket's stock (base units) with one conditional atomic UPDATE
+    per product, in ascending id order. Raises InsufficientStockError naming
+    the first short line.
+
+    Under FIFO / moving-average costing the stock is also taken out of the
+    product's cost layers, and each line's cost_price becomes the cost of
+    the layers it drew from.
+    """
+    required = {}
+    labels = {}
+    for line in lines:
+        product = line["product"]
+        required[product.id] = required.get(product.id, 0.0) + line["base_qty"]
+        labels.setdefault(product.id, f"{product.name} ({line['unit'].unit_name})")
+
+    remaining = reserve_stock(required, labels)
+    layer_costs = consume(required)
+    for line in lines:
+        if line["product"].id in layer_costs:
+            line["cost_price"] = layer_costs[line["product"].id]
+    return remaining
+
+
+def write_sale_lines(sale, txn_id, lines):
+    """
+    Insert all SaleItem and InventoryTransaction rows for a sale with two
+    multi-row INSERTs. Returns the COGS total for the GL posting.
+    """
+    sale_rows = []
+    inv_rows = []
+    cogs_total = 0.0
+    for line in lines:
+        product, unit = line["product"], line["unit"]
+        cogs = line["cost_price"] * line["base_qty"]
+        cogs_total += cogs
+
+        sale_rows.append({
+            "sale_id": sale.id,
+            "product_id": product.id,
+            "unit_id": unit.id,
+            "product_name": product.name,
+            "quantity": line["quantity"],  # in selected unit
+            "unit_price": line["unit_price"],
+            "total_price": line["total_price"],
+            "unit_cost": line["cost_price"] * unit.conversion_quantity,
+            "cost_total": cogs,
+            "status": 1,
+        })
+        inv_rows.append({
+            "transaction_no": txn_id,
+            "sale_id": sale.id,
+            "product_id": product.id,
+            "unit_id": unit.id,
+            "quantity": line["base_qty"],  # stored in base units
+            "unit_price": line["cost_price"],  # for COGS
+            "total_price": cogs,
+            "transaction_type": 'Sale',
+            "status": 1,
+        })
+
+    db.session.execute(insert(SaleItem), sale_rows)
+    db.session.execute(insert(InventoryTransaction), inv_rows)
+    return cogs_total
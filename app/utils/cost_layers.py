@@ -0,0 +1,346 @@
+"""
+Cost layer engine: FIFO or moving-average cost of goods sold.
+
+COSTING_METHOD selects the method for the deployment:
+
+* latest  – COGS at the most recent purchase price (app.utils.costing); no
+            layers are kept. This is the historical behaviour and the default.
+* fifo    – every receipt opens a layer (base units, cost per base unit);
+            issues consume the oldest open layers first.
+* average – one layer per product whose cost is re-averaged on each receipt
+            and which issues draw down at that cost.
+
+Receipts come from purchase orders (receive), issues from checkout and stock
+decreases (consume); deleted sales put their stock back at the cost it was
+sold at. Open FIFO layers are found through a partial index on
+(product_id, id) WHERE remaining > 0, so taking the next layer is one index
+probe however long the product's history is. Consumption runs after checkout
+has locked the product row, so two tills never consume the same layer.
+
+Back-dated edits (changing quantities or prices of old purchase orders,
+editing sales) are not replayed into the layers live; rebuild_cost_layers()
+replays the whole history per product, in parallel, and is also how a
+deployment switches method (scripts/rebuild_cost_layers.py).
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, select
+
+from app import db
+from app.models import (
+    CostLayer, Product, ProductUnit, PurchaseOrder, PurchaseOrderItem, Sale, SaleItem, StockAdjustment
+)
+from app.utils.costing import latest_cost_prices
+
+METHODS = ("latest", "fifo", "average")
+LAYER_BATCH = 20  # open layers fetched per probe while consuming
+EPSILON = 1e-9
+
+
+def costing_method():
+    method = (current_app.config.get("COSTING_METHOD") or "latest").lower()
+    if method not in METHODS:
+        raise ValueError(f"COSTING_METHOD must be one of {', '.join(METHODS)}")
+    return method
+
+
+def _average_layer(product_id):
+    return (
+        CostLayer.query
+        .filter(CostLayer.product_id == product_id, CostLayer.source == "average")
+        .with_for_update()
+        .first()
+    )
+
+
+# ------------------ Receipts ------------------
+def receive(product_id, base_qty, unit_cost, source="purchase", purchase_order_item_id=None, received_at=None):
+    """Add base_qty at unit_cost (per base unit) to the product's layers. Flushes nothing."""
+    method = costing_method()
+    if method == "latest" or base_qty <= 0:
+        return
+
+    if method == "fifo":
+        db.session.add(CostLayer(
+            product_id=product_id,
+            source=source,
+            purchase_order_item_id=purchase_order_item_id,
+            received_at=received_at or datetime.utcnow(),
+            unit_cost=unit_cost,
+            quantity=base_qty,
+            remaining=base_qty,
+        ))
+        return
+
+    layer = _average_layer(product_id)
+    if layer is None:
+        db.session.add(CostLayer(
+            product_id=product_id, source="average", received_at=received_at or datetime.utcnow(),
+            unit_cost=unit_cost, quantity=base_qty, remaining=base_qty,
+        ))
+        return
+    on_hand = max(layer.remaining, 0.0)
+    layer.unit_cost = (on_hand * layer.unit_cost + base_qty * unit_cost) / (on_hand + base_qty)
+    layer.remaining = on_hand + base_qty
+    layer.quantity += base_qty
+
+
+def remove_receipt(product_id, base_qty, unit_cost, purchase_order_item_id=None):
+    """Take a deleted purchase line's stock back out of the layers."""
+    method = costing_method()
+    if method == "latest" or base_qty <= 0:
+        return
+
+    if method == "average":
+        layer = _average_layer(product_id)
+        if layer is None:
+            return
+        left = max(layer.remaining - base_qty, 0.0)
+        if left > EPSILON:
+            layer.unit_cost = max((layer.remaining * layer.unit_cost - base_qty * unit_cost) / left, 0.0)
+        layer.remaining = left
+        return
+
+    shortfall = base_qty
+    if purchase_order_item_id is not None:
+        for layer in (
+            CostLayer.query
+            .filter(CostLayer.purchase_order_item_id == purchase_order_item_id, CostLayer.remaining > 0)
+            .with_for_update()
+            .all()
+        ):
+            take = min(layer.remaining, shortfall)
+            layer.remaining -= take
+            shortfall -= take
+    if shortfall > EPSILON:
+        # Part of that receipt was already sold: the stock leaving now is the oldest left.
+        consume({product_id: shortfall})
+
+
+def current_unit_cost(product_id):
+    """Cost per base unit that new stock of unknown cost (adjustments) is valued at."""
+    layer = (
+        CostLayer.query
+        .filter(CostLayer.product_id == product_id)
+        .order_by(CostLayer.id.desc())
+        .first()
+    )
+    if layer is not None:
+        return layer.unit_cost
+    return latest_cost_prices([product_id]).get(product_id, 0.0)
+
+
+# ------------------ Issues ------------------
+def consume(requirements):
+    """
+    Take {product_id: base_qty} out of the layers. Returns {product_id: cost
+    per base unit of what was taken}, or {} under the latest-price method.
+
+    Quantities beyond the open layers (stock that predates the layers, or
+    negative stock) are costed at the last layer's cost, else at the latest
+    purchase price.
+    """
+    method = costing_method()
+    requirements = {pid: qty for pid, qty in requirements.items() if qty > 0}
+    if method == "latest" or not requirements:
+        return {}
+
+    fallback = None
+    costs = {}
+    for product_id in sorted(requirements):
+        qty = requirements[product_id]
+        left, total, last_cost = qty, 0.0, None
+
+        if method == "average":
+            layer = _average_layer(product_id)
+            if layer is not None:
+                take = min(max(layer.remaining, 0.0), left)
+                layer.remaining -= take
+                total += take * layer.unit_cost
+                left -= take
+                last_cost = layer.unit_cost
+        else:
+            while left > EPSILON:
+                layers = (
+                    CostLayer.query
+                    .filter(CostLayer.product_id == product_id, CostLayer.remaining > 0)
+                    .order_by(CostLayer.id)
+                    .limit(LAYER_BATCH)
+                    .with_for_update()
+                    .all()
+                )
+                if not layers:
+                    break
+                for layer in layers:
+                    take = min(layer.remaining, left)
+                    layer.remaining -= take
+                    total += take * layer.unit_cost
+                    left -= take
+                    last_cost = layer.unit_cost
+                    if left <= EPSILON:
+                        break
+                db.session.flush()
+
+        if left > EPSILON:
+            if last_cost is None:
+                if fallback is None:
+                    fallback = latest_cost_prices(list(requirements))
+                last_cost = fallback.get(product_id, 0.0)
+            total += left * last_cost
+        costs[product_id] = total / qty
+    return costs
+
+
+def return_stock(product_id, base_qty, unit_cost):
+    """Stock coming back from a deleted sale re-enters at the cost it left at."""
+    receive(product_id, base_qty, unit_cost, source="return")
+
+
+# ------------------ Rebuild ------------------
+PURCHASE, ADJUSTMENT, SALE = 0, 1, 2  # same-day order: stock in before stock out
+
+
+def _history(product_ids):
+    """[(product_id, when, kind, ref_id, base_qty, base_cost)] for the products."""
+    conversion = func.coalesce(func.nullif(ProductUnit.conversion_quantity, 0), 1.0)
+    purchases = db.session.execute(
+        select(
+            PurchaseOrderItem.product_id, PurchaseOrder.purchase_date, PurchaseOrderItem.id,
+            PurchaseOrderItem.quantity * conversion, PurchaseOrderItem.unit_price / conversion,
+        )
+        .join(PurchaseOrder, PurchaseOrder.id == PurchaseOrderItem.purchase_order_id)
+        .outerjoin(ProductUnit, ProductUnit.id == PurchaseOrderItem.unit_id)
+        .where(
+            PurchaseOrderItem.product_id.in_(product_ids),
+            PurchaseOrderItem.status != 9,
+            PurchaseOrder.status != 9,
+        )
+    ).all()
+    sales = db.session.execute(
+        select(SaleItem.product_id, Sale.sale_date, SaleItem.id, SaleItem.quantity * conversion)
+        .join(Sale, Sale.id == SaleItem.sale_id)
+        .outerjoin(ProductUnit, ProductUnit.id == SaleItem.unit_id)
+        .where(SaleItem.product_id.in_(product_ids), SaleItem.status != 9, Sale.status != 9)
+    ).all()
+    # Restores logged by delete_sale are already covered by un-counting the
+    # deleted sale lines (same rule as app.utils.reconcile).
+    adjustments = db.session.execute(
+        select(
+            StockAdjustment.product_id, StockAdjustment.adjusted_at, StockAdjustment.id,
+            StockAdjustment.adjustment_type, StockAdjustment.quantity * conversion,
+        )
+        .outerjoin(ProductUnit, ProductUnit.id == StockAdjustment.unit_id)
+        .where(
+            StockAdjustment.product_id.in_(product_ids),
+            StockAdjustment.status != 9,
+            func.coalesce(StockAdjustment.reason, "").notlike("Sale #% deleted%"),
+        )
+    ).all()
+
+    events = [(pid, when, PURCHASE, ref, float(qty or 0), float(cost or 0)) for pid, when, ref, qty, cost in purchases]
+    events += [(pid, when, SALE, ref, float(qty or 0), None) for pid, when, ref, qty in sales]
+    events += [
+        (pid, when, ADJUSTMENT, ref, float(qty or 0) * (1 if (kind or "").upper() == "INCREASE" else -1), None)
+        for pid, when, ref, kind, qty in adjustments
+    ]
+    events.sort(key=lambda e: (e[0], e[1] or datetime.min, e[2], e[3]))
+    return events
+
+
+def replay(method, product_id, events, fallback_cost=0.0):
+    """Layers left open after replaying one product's (sorted) history."""
+    layers = deque()  # [remaining, unit_cost, source, purchase_order_item_id, received_at, quantity]
+    last_cost = fallback_cost
+
+    def stock_in(qty, cost, source, item_id, when):
+        if method == "average" and layers:
+            layer = layers[0]
+            on_hand = max(layer[0], 0.0)
+            layer[1] = (on_hand * layer[1] + qty * cost) / (on_hand + qty)
+            layer[0] = on_hand + qty
+            layer[5] += qty
+        else:
+            layers.append([qty, cost, "average" if method == "average" else source, item_id, when, qty])
+
+    def stock_out(qty):
+        while qty > EPSILON and layers:
+            layer = layers[0]
+            take = min(layer[0], qty)
+            layer[0] -= take
+            qty -= take
+            if method == "fifo" and layer[0] <= EPSILON:
+                layers.popleft()
+            elif method == "average":
+                break
+
+    for _, when, kind, ref, qty, cost in events:
+        if kind == PURCHASE:
+            if qty > 0:
+                stock_in(qty, cost, "purchase", ref, when)
+                last_cost = cost
+        elif kind == SALE or qty < 0:
+            stock_out(abs(qty))
+        elif qty > 0:
+            stock_in(qty, layers[-1][1] if layers else last_cost, "adjustment", None, when)
+
+    return [{
+        "product_id": product_id,
+        "source": source,
+        "purchase_order_item_id": item_id,
+        "received_at": when,
+        "unit_cost": cost,
+        "quantity": quantity,
+        "remaining": max(remaining, 0.0),
+    } for remaining, cost, source, item_id, when, quantity in layers
+        if method == "average" or remaining > EPSILON]
+
+
+def _rebuild_chunk(app, method, product_ids):
+    with app.app_context():
+        events = _history(product_ids)
+        fallback = latest_cost_prices(product_ids)
+        by_product = {}
+        for event in events:
+            by_product.setdefault(event[0], []).append(event)
+
+        rows = []
+        for product_id in product_ids:
+            rows += replay(method, product_id, by_product.get(product_id, []), fallback.get(product_id, 0.0))
+
+        db.session.execute(delete(CostLayer).where(CostLayer.product_id.in_(product_ids)))
+        if rows:
+            db.session.execute(insert(CostLayer), rows)
+        db.session.commit()
+        return len(rows)
+
+
+def rebuild_cost_layers(product_ids=None, method=None, workers=4, chunk_size=500):
+    """
+    Replace the layers of all (or the given) products by replaying their
+    purchase, sale and adjustment history under the method. Products are
+    independent, so chunks of them are replayed and written by `workers`
+    threads, each with its own session and transaction.
+    Returns {"method", "products", "layers"}.
+    """
+    method = (method or costing_method()).lower()
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {', '.join(METHODS)}")
+    if product_ids is None:
+        product_ids = db.session.execute(
+            select(Product.id).where(Product.status != 9).order_by(Product.id)
+        ).scalars().all()
+    product_ids = sorted(set(product_ids))
+
+    if method == "latest":
+        db.session.execute(delete(CostLayer))
+        db.session.commit()
+        return {"method": method, "products": len(product_ids), "layers": 0}
+
+    app = current_app._get_current_object()
+    chunks = [product_ids[i:i + chunk_size] for i in range(0, len(product_ids), chunk_size)]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        counts = list(pool.map(lambda ids: _rebuild_chunk(app, method, ids), chunks))
+    return {"method": method, "products": len(product_ids), "layers": sum(counts)}
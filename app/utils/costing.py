@@ -0,0 +1,110 @@
+"""
+Latest purchase cost lookups backed by the product_cost table.
+
+product_cost holds, per (product, unit), the most recent active purchase
+order line with a positive price: what was paid per purchased unit and the
+resulting cost of one base unit. The purchase order routes refresh the rows
+of the products they touch in the same transaction, so readers (checkout
+COGS, the product table) do an indexed lookup instead of scanning purchase
+history.
+"""
+from datetime import datetime
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select, text
+
+from app import db
+from app.models import ProductCost, ProductUnit, PurchaseOrder, PurchaseOrderItem
+
+
+def refresh_product_costs(product_ids=None):
+    """
+    Rebuild the product_cost rows of the given products (all products when
+    None) from their purchase lines. Flushes only; the caller commits.
+    """
+    if product_ids is not None:
+        product_ids = sorted({int(pid) for pid in product_ids})
+        if not product_ids:
+            return
+
+    latest_lines = (
+        select(func.max(PurchaseOrderItem.id))
+        .join(PurchaseOrder, PurchaseOrder.id == PurchaseOrderItem.purchase_order_id)
+        .where(
+            PurchaseOrderItem.status != 9,
+            PurchaseOrder.status != 9,
+            PurchaseOrderItem.unit_price > 0,
+        )
+        .group_by(PurchaseOrderItem.product_id, PurchaseOrderItem.unit_id)
+    )
+    clear = delete(ProductCost)
+    if product_ids is not None:
+        latest_lines = latest_lines.where(PurchaseOrderItem.product_id.in_(product_ids))
+        clear = clear.where(ProductCost.product_id.in_(product_ids))
+
+    conversion = func.coalesce(func.nullif(ProductUnit.conversion_quantity, 0), 1.0)
+    rows = (
+        select(
+            PurchaseOrderItem.product_id,
+            PurchaseOrderItem.unit_id,
+            PurchaseOrderItem.unit_price,
+            PurchaseOrderItem.unit_price / conversion,
+            PurchaseOrderItem.id,
+            literal(datetime.utcnow(), DateTime),
+        )
+        .outerjoin(ProductUnit, ProductUnit.id == PurchaseOrderItem.unit_id)
+        .where(PurchaseOrderItem.id.in_(latest_lines))
+    )
+
+    db.session.execute(clear, execution_options={"synchronize_session": False})
+    db.session.execute(insert(ProductCost).from_select(
+        ["product_id", "unit_id", "unit_price", "base_cost", "purchase_order_item_id", "updated_at"], rows
+    ))
+
+
+def latest_cost_prices(product_ids):
+    """
+    Cost of one base unit from each product's most recent purchase, in one
+    indexed query: {product_id: cost}. Products never purchased are absent.
+    product_ids=None loads every product (catalog cache).
+    """
+    stmt = select(ProductCost.product_id, ProductCost.base_cost, ProductCost.purchase_order_item_id)
+    if product_ids is not None:
+        if not product_ids:
+            return {}
+        stmt = stmt.where(ProductCost.product_id.in_(list(product_ids)))
+    rows = db.session.execute(stmt).all()
+
+    latest = {}
+    for product_id, base_cost, line_id in rows:
+        if product_id not in latest or line_id > latest[product_id][1]:
+            latest[product_id] = (float(base_cost or 0), line_id)
+    return {product_id: cost for product_id, (cost, _) in latest.items()}
+
+
+# ------------------ Sale line COGS ------------------
+# Sale lines carry the cost they were posted at (sale_item.unit_cost per sold
+# unit, cost_total for the line). Lines written before those columns existed
+# take it from their sale's inventory transaction, which has always stored
+# the base-unit cost used for the GL entry, else from the current cost.
+SALE_ITEM_COST_BACKFILL_SQL = """
+    UPDATE sale_item
+    SET unit_cost = COALESCE(
+            (SELECT it.unit_price FROM inventory_transaction it
+             WHERE it.sale_id = sale_item.sale_id AND it.product_id = sale_item.product_id
+               AND it.unit_id = sale_item.unit_id AND it.transaction_type = 'Sale'
+             ORDER BY it.id DESC LIMIT 1),
+            (SELECT pc.base_cost FROM product_cost pc
+             WHERE pc.product_id = sale_item.product_id
+             ORDER BY pc.purchase_order_item_id DESC LIMIT 1),
+            0
+        ) * COALESCE((SELECT pu.conversion_quantity FROM product_unit pu WHERE pu.id = sale_item.unit_id), 1)
+    WHERE unit_cost IS NULL
+"""
+
+
+def backfill_sale_item_costs():
+    """Fill unit_cost / cost_total of sale lines posted before they existed."""
+    db.session.execute(text(SALE_ITEM_COST_BACKFILL_SQL))
+    db.session.execute(text(
+        "UPDATE sale_item SET cost_total = unit_cost * quantity WHERE cost_total IS NULL"
+    ))
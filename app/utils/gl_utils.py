@@ -1,50 +1,354 @@
+import re
+import threading
+
 from app import db
-from app.models import GeneralLedger, TransactionNumber, Account
-from datetime import datetime
-from sqlalchemy import cast, Integer
+from app.models import AccountDailyBalance, GeneralLedger, TransactionNumber, Account
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import DateTime, and_, case, delete, event, func, insert, inspect, literal, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, aliased
+
+from app.utils import numbering
+from app.utils.periods import check_not_archived, check_period_open, closed_through
+from app.utils.report_cache import ledger_changed
+from app.utils.versions import bump_version, current_version
+
+
+# ------------------ Account Code Cache ------------------
+# code -> account.id for the whole chart, loaded once per worker with one
+# query and tagged with the 'account_codes' cache version
+# (app.utils.versions). accounts.py calls account_codes_changed() before
+# committing any account write, and invalidate_account_cache() after it.
+# Every resolve compares the committed version, one primary-key read,
+# so a code moved or reassigned through another gunicorn worker can never
+# keep posting to the old account. A code this worker has never seen also
+# triggers one reload before failing.
+ACCOUNT_CODES_VERSION = "account_codes"
+
+_account_ids_by_code = None
+_account_codes_version = None
+_account_cache_lock = threading.Lock()
+
+
+def _code_key(code):
+    """Normalize 4000 / "4000" / " 04000" to the same key."""
+    code = str(code).strip()
+    return str(int(code)) if code.isdigit() else code
+
+
+def _load_account_codes(version):
+    global _account_ids_by_code, _account_codes_version
+    with _account_cache_lock:
+        rows = db.session.query(Account.code, Account.id).all()
+        _account_ids_by_code = {_code_key(code): account_id for code, account_id in rows}
+        _account_codes_version = version  # read before the chart, so a racing bump only costs a reload
+    return _account_ids_by_code
+
+
+def account_codes_changed():
+    """Call before committing an account write; other workers reload their code map."""
+    bump_version(ACCOUNT_CODES_VERSION)
+
+
+def invalidate_account_cache():
+    """Call after that commit: this worker reloads on its next posting."""
+    global _account_ids_by_code
+    _account_ids_by_code = None
+
+
+def resolve_account_ids(codes):
+    """Map account codes to ids from the in-process cache: {code_key: id}."""
+    version = current_version(ACCOUNT_CODES_VERSION)
+    lookup = _account_ids_by_code
+    if lookup is None or _account_codes_version != version:
+        lookup = _load_account_codes(version)
+    keys = {_code_key(c) for c in codes}
+    if not keys.issubset(lookup):
+        lookup = _load_account_codes(version)
 
+    missing = keys - lookup.keys()
+    if missing:
+        raise ValueError(f"Account with code {', '.join(sorted(missing))} not found.")
+    return {k: lookup[k] for k in keys}
 
-def post_to_ledger(entries, transaction_no_id, description=None, transaction_date=None):
+
+# ------------------ Posting ------------------
+def post_to_ledger(entries, transaction_no_id, description=None, transaction_date=None,
+                   source_type=None, source_id=None):
+    """
+    Post one journal: resolve account codes from the cache, check that
+    debits equal credits, then write every line with a single multi-row
+    INSERT. Returns the new GeneralLedger ids.
+
+    source_type / source_id name the document the journal belongs to
+    ('sale', 12); reverse_ledger() finds the lines to undo through them.
+
+    Never commits: the route that owns the business event (sale, PO,
+    payment, expense) commits once, so the document, its stock movements
+    and its GL lines land in a single transaction or not at all.
+    """
+    if not entries:
+        return []
     if transaction_date is None:
         transaction_date = datetime.utcnow()
 
-    # Convert all account codes to strings
-    account_codes = {str(e['account_id']) for e in entries}
+    debits = sum(float(e['amount']) for e in entries if e['transaction_type'] == 'Debit')
+    credits = sum(float(e['amount']) for e in entries if e['transaction_type'] == 'Credit')
+    if round(debits - credits, 2) != 0:
+        raise ValueError(f"Unbalanced journal: debits {debits:.2f} != credits {credits:.2f}")
+
+    account_lookup = resolve_account_ids(e['account_id'] for e in entries)
+
+    now = datetime.utcnow()
+    rows = [{
+        "account_id": account_lookup[_code_key(e['account_id'])],
+        "transaction_type": e['transaction_type'],
+        "amount": e['amount'],
+        "description": description,
+        "transaction_date": transaction_date,
+        "transaction_no": transaction_no_id,
+        "source_type": source_type,
+        "source_id": source_id,
+        "status": 1,  # Active
+        "created_at": now,
+        "updated_at": now,
+    } for e in entries]
+
+    ids = db.session.execute(
+        insert(GeneralLedger).values(rows).returning(GeneralLedger.id)
+    ).scalars().all()
+    _upsert_daily_balances(_daily_deltas(
+        (r["account_id"], r["transaction_type"], r["amount"], r["transaction_date"]) for r in rows
+    ))
+    return ids
+
+
+def document_lines(source_type, source_ids):
+    """Criterion for the GL lines of some documents of one type."""
+    return and_(GeneralLedger.source_type == source_type, GeneralLedger.source_id.in_(list(source_ids)))
 
-    # Fetch accounts once
-    accounts = (
-        db.session.query(Account.code, Account.id)
-        .filter(cast(Account.code, Integer).in_(account_codes))
-        .all()
+
+def reverse_ledger(*criteria, description=None, transaction_date=None):
+    """
+    Post the negation of every active GL line matching the criteria (e.g.
+    document_lines('sale', [12])) that is neither a reversal itself nor
+    already reversed, with one INSERT ... SELECT. Each reversal line keeps
+    the original's account, amount, transaction_no and source, and points
+    back to it through reversal_of_id, so reversing twice is a no-op.
+    description defaults to "Reversal of <original description>".
+    Raises ValueError if matching lines are archived (app.utils.periods).
+    Returns the number of lines reversed. Never commits.
+    """
+    check_not_archived(*criteria)
+    reversal = aliased(GeneralLedger)
+    now = datetime.utcnow()
+    if description is None:
+        description = literal("Reversal of ") + func.coalesce(GeneralLedger.description, "")
+    else:
+        description = literal(description)
+
+    lines = select(
+        GeneralLedger.account_id,
+        case((GeneralLedger.transaction_type == "Debit", "Credit"), else_="Debit"),
+        GeneralLedger.amount,
+        description,
+        literal(transaction_date or now, DateTime),
+        GeneralLedger.transaction_no,
+        GeneralLedger.source_type,
+        GeneralLedger.source_id,
+        GeneralLedger.id,
+        literal(1),
+        literal(now, DateTime),
+        literal(now, DateTime),
+    ).where(
+        *criteria,
+        GeneralLedger.status != 9,
+        GeneralLedger.reversal_of_id.is_(None),
+        ~select(reversal.id).where(reversal.reversal_of_id == GeneralLedger.id).exists(),
     )
-    account_lookup = {str(code): id for code, id in accounts}
+    posted = db.session.execute(insert(GeneralLedger).from_select([
+        "account_id", "transaction_type", "amount", "description", "transaction_date", "transaction_no",
+        "source_type", "source_id", "reversal_of_id", "status", "created_at", "updated_at",
+    ], lines).returning(
+        GeneralLedger.account_id, GeneralLedger.transaction_type, GeneralLedger.amount, GeneralLedger.transaction_date
+    )).all()
+    _upsert_daily_balances(_daily_deltas(posted))
+    return len(posted)
+
+
+# Documents whose transaction_no identifies their GL lines, in backfill order:
+# create_sale's own Payment row shares the sale's number, so sales go first.
+SOURCE_TABLES = (
+    ("sale", "sale"),
+    ("payment", "payment"),
+    ("purchase_order", "purchase_order"),
+    ("supplier_payment", "supplier_payment"),
+    ("expense", "expense"),
+)
+
+
+def backfill_ledger_sources():
+    """
+    Tag GL lines posted before source_type/source_id existed, through the
+    documents' transaction_no (PO edit adjustments, which have their own
+    number, through their description). Legacy reversal lines are left
+    untagged so reverse_ledger() can never pick them up. Never commits.
+    """
+    for source_type, table in SOURCE_TABLES:
+        db.session.execute(text(f"""
+            UPDATE general_ledger
+            SET source_type = :source_type,
+                source_id = (SELECT MIN(d.id) FROM {table} d WHERE d.transaction_no = general_ledger.transaction_no)
+            WHERE source_type IS NULL
+              AND COALESCE(description, '') NOT LIKE 'Reversal of%'
+              AND transaction_no IN (SELECT transaction_no FROM {table} WHERE transaction_no IS NOT NULL)
+        """), {"source_type": source_type})
+
+    edits = db.session.execute(text(
+        "SELECT id, description FROM general_ledger "
+        "WHERE source_type IS NULL AND description LIKE 'PO #% edit adjustment'"
+    )).all()
+    rows = [
+        {"id": line_id, "source_id": int(m.group(1))}
+        for line_id, description in edits
+        if (m := re.match(r"PO #(\d+) edit adjustment", description))
+    ]
+    if rows:
+        db.session.execute(text(
+            "UPDATE general_ledger SET source_type = 'purchase_order', source_id = :source_id WHERE id = :id"
+        ), rows)
 
-    gl_entries = []
-    for e in entries:
-        code = str(e['account_id'])
-        if code not in account_lookup:
-            raise ValueError(f"Account with code {code} not found.")
-        print(f"Posting to GL: Account Code={code}, Type={e['transaction_type']}, Amount={e['amount']}")
 
-        # Create GL entry and populate StatusMixin fields
-        gl_entry = GeneralLedger(
-            account_id=account_lookup[code],
-            transaction_type=e['transaction_type'],
-            amount=e['amount'],
-            description=description,
-            transaction_date=transaction_date,
-            transaction_no=transaction_no_id,
-            status=1,  # Active
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow()
-        )
 
-        db.session.add(gl_entry)
-        gl_entries.append(gl_entry)
+# ------------------ Daily Balances ------------------
+# account_daily_balance holds the Debit and Credit totals of the active GL
+# lines per account and day; the financial reports sum it instead of
+# general_ledger. post_to_ledger() and reverse_ledger() add their lines with
+# one upsert. GL rows written through the ORM (manual journal entries, line
+# edits and status changes) are picked up by the after_flush hook below.
+# Either way the rollup lands in the same transaction as the lines.
+#
+# Rows are upserted in (account_id, day) order, so concurrent postings lock
+# them in the same order and cannot deadlock. A posting holds those row
+# locks only from its upsert to its commit. This is also where closed
+# periods are enforced for every kind of GL write.
+_ROLLUP_FIELDS = ("account_id", "transaction_type", "amount", "transaction_date", "status")
 
-    db.session.commit()
-    return gl_entries
 
+def _day(value):
+    if isinstance(value, str):  # ledger.py passes request JSON through as-is
+        return date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def _daily_deltas(lines, sign=1, deltas=None):
+    """Fold (account_id, transaction_type, amount, transaction_date) into {(account_id, day): [debit, credit]}."""
+    deltas = {} if deltas is None else deltas
+    for account_id, transaction_type, amount, transaction_date in lines:
+        day = _day(transaction_date)
+        if day is None or not amount:
+            continue
+        totals = deltas.setdefault((account_id, day), [0.0, 0.0])
+        totals[0 if transaction_type == "Debit" else 1] += sign * float(amount)
+    return deltas
+
+
+def _upsert_daily_balances(deltas, session=None):
+    if not deltas:
+        return
+    session = session if session is not None else db.session
+    conn = session.connection()
+    dialect = postgresql if conn.dialect.name == "postgresql" else sqlite
+    table = AccountDailyBalance.__table__
+    stmt = dialect.insert(table).values([
+        {"account_id": account_id, "day": day, "debit": debit, "credit": credit}
+        for (account_id, day), (debit, credit) in sorted(deltas.items())
+    ])
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.account_id, table.c.day],
+        set_={"debit": table.c.debit + stmt.excluded.debit, "credit": table.c.credit + stmt.excluded.credit},
+    ))
+    # after the upsert: a period close waits for our row locks, or we see it
+    check_period_open([day for _, day in deltas], conn)
+    ledger_changed(session)
+
+
+def _line_values(line, committed=False):
+    """The line's rollup fields after this flush, or as they were before it (committed=True)."""
+    state = inspect(line)
+    values = []
+    for name in _ROLLUP_FIELDS:
+        history = state.attrs[name].history
+        if committed and history.deleted:
+            values.append(history.deleted[0])
+        elif committed and history.added:
+            values.append(None)  # was unset before
+        else:
+            values.append(getattr(line, name))
+    return values
+
+
+def _fold_line(deltas, values, sign):
+    *line, status = values
+    if status != 9:
+        _daily_deltas([line], sign, deltas)
+
+
+@event.listens_for(Session, "after_flush")
+def _roll_up_orm_lines(session, flush_context):
+    deltas = {}
+    for line in session.new:
+        if isinstance(line, GeneralLedger):
+            _fold_line(deltas, _line_values(line), 1)
+    for line in session.dirty:
+        if isinstance(line, GeneralLedger) and session.is_modified(line):
+            _fold_line(deltas, _line_values(line, committed=True), -1)
+            _fold_line(deltas, _line_values(line), 1)
+    for line in session.deleted:
+        if isinstance(line, GeneralLedger):
+            _fold_line(deltas, _line_values(line, committed=True), -1)
+    _upsert_daily_balances(deltas, session)
+
+
+def rebuild_account_daily_balances(since=None):
+    """
+    Recompute account_daily_balance from general_ledger: every day, or only
+    days from `since` (a date) on. Use it after the first deploy, and after
+    GL rows were changed with raw SQL. Days of closed periods are frozen
+    (their lines may be archived) and never rebuilt. Returns the number of
+    rows written. Never commits.
+    """
+    table = AccountDailyBalance.__table__
+    locked = closed_through()
+    if locked is not None and (since is None or since <= locked):
+        since = locked + timedelta(days=1)
+    if db.session.connection().dialect.name == "postgresql":
+        # postings wait (instead of racing the DELETE / INSERT) until we commit
+        db.session.execute(text("LOCK TABLE account_daily_balance IN EXCLUSIVE MODE"))
+
+    day = func.date(GeneralLedger.transaction_date)
+    lines = select(
+        GeneralLedger.account_id,
+        day,
+        func.sum(case((GeneralLedger.transaction_type == "Debit", GeneralLedger.amount), else_=0)),
+        func.sum(case((GeneralLedger.transaction_type != "Debit", GeneralLedger.amount), else_=0)),
+    ).where(
+        GeneralLedger.status != 9,
+        GeneralLedger.transaction_date.is_not(None),
+    ).group_by(GeneralLedger.account_id, day)
+
+    clear = delete(table)
+    if since is not None:
+        clear = clear.where(table.c.day >= since)
+        lines = lines.where(GeneralLedger.transaction_date >= datetime.combine(since, time.min))
+
+    db.session.execute(clear)
+    ledger_changed(db.session)
+    return db.session.execute(
+        table.insert().from_select(["account_id", "day", "debit", "credit"], lines)
+    ).rowcount
 
 
 # def generate_transaction_number(prefix, transaction_date=None, status=1):
@@ -72,50 +376,36 @@ def post_to_ledger(entries, transaction_no_id, description=None, transaction_dat
 
 
 def generate_transaction_number(prefix, transaction_date=None, status=1):
-    if transaction_date is None:
-        transaction_date = datetime.utcnow()
-
-    # tn = TransactionNumber.query.filter_by(prefix=prefix).first()
-
-    # if not tn:
-    tn = TransactionNumber(
-        prefix=prefix,
-        last_number=1,
-        status=status,
-        transaction_date=transaction_date
-    )
-    db.session.add(tn)
-    db.session.flush()  # <-- Ensure ID is available before commit
-    # else:
-    #     tn.last_number += 1
-    #     db.session.flush()
-
-    txn_str = f"{prefix}-{str(tn.id).zfill(5)}"
-
-    db.session.commit()  # <-- Final commit
-    return tn.id, txn_str
+    """
+    Allocate a transaction number inside the caller's transaction.
+    Like post_to_ledger, it only flushes; the caller commits once.
+    """
+    return generate_transaction_number_partone(prefix, transaction_date=transaction_date, status=status)
 
 
 def generate_transaction_number_partone(prefix, transaction_date=None, status=1):
+    """
+    Create the TransactionNumber row that a document's transaction_no
+    foreign keys point at and return (id, "PREFIX-00042").
+    Id and number come from per-worker sequence blocks (see
+    app/utils/numbering.py); the row is flushed, never committed.
+    """
     if transaction_date is None:
         transaction_date = datetime.utcnow()
 
-    # tn = TransactionNumber.query.filter_by(prefix=prefix).first()
-
-    # if not tn:
+    tn_id, number = numbering.allocate(prefix) or (None, None)
     tn = TransactionNumber(
+        id=tn_id,
         prefix=prefix,
-        last_number=1,
+        last_number=number or 1,
         status=status,
         transaction_date=transaction_date
     )
     db.session.add(tn)
-    db.session.flush()  # <-- ensure ID is available
-    # else:
-    #     tn.last_number += 1
-    #     db.session.flush()
+    db.session.flush()  # <-- row must exist before anything references transaction_no
+    if number is None:
+        number = tn.id  # no sequences (SQLite): the id doubles as the number
 
-    txn_str = f"{prefix}-{str(tn.id).zfill(5)}"
+    txn_str = f"{prefix}-{str(number).zfill(5)}"
 
     return tn.id, txn_str
-
@@ -0,0 +1,143 @@
+"""
+Idempotency-Key support for POS write endpoints (create_sale, add_payment,
+add_purchase_order).
+
+A till that loses its connection mid-request retries with the same
+Idempotency-Key header. The first request with a key claims it: an
+idempotency_key row is flushed into the route's own transaction before the
+route runs, so it commits or rolls back together with the document. A
+concurrent retry blocks on the (endpoint, key) unique index until the first
+request finishes. Once the route has answered 2xx, the response is stored
+on the row and every later request with that key gets it back unchanged,
+with an Idempotent-Replayed: true header, without re-running the route.
+
+* Non-2xx answers are not stored. The claim is released, because the route
+  rolled back, and a retry runs again.
+* Reusing a key with a different request body is rejected with 422.
+* A committed claim with no stored response means the document was created
+  but the response was lost. The retry gets 409 rather than a duplicate.
+* Keys are kept IDEMPOTENCY_TTL_HOURS. Each worker deletes expired ones at
+  most every IDEMPOTENCY_PRUNE_INTERVAL_SECONDS (indexed on created_at).
+
+Requests without the header behave exactly as before.
+"""
+import hashlib
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import Response, current_app, jsonify, request
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+_last_pruned = 0.0
+
+
+def _ttl():
+    return timedelta(hours=current_app.config.get("IDEMPOTENCY_TTL_HOURS", 24))
+
+
+def _replay(record, request_hash):
+    if record.request_hash != request_hash:
+        return jsonify({"error": f"{HEADER} was already used for a different request"}), 422
+    if record.status_code is None:
+        return jsonify({
+            "error": f"A request with this {HEADER} was already processed or is still in progress"
+        }), 409
+    response = Response(record.response_body, status=record.status_code, mimetype=record.content_type)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _release(endpoint, key):
+    """Drop a claim whose request did not succeed, so a retry runs again."""
+    db.session.rollback()
+    db.session.execute(delete(IdempotencyKey).where(
+        IdempotencyKey.endpoint == endpoint, IdempotencyKey.key == key, IdempotencyKey.status_code.is_(None)
+    ))
+    db.session.commit()
+
+
+def prune_expired_keys():
+    """Delete keys older than the TTL. Returns the number removed."""
+    cutoff = datetime.utcnow() - _ttl()
+    result = db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff))
+    db.session.commit()
+    return result.rowcount
+
+
+def _maybe_prune():
+    global _last_pruned
+    now = time.monotonic()
+    if now - _last_pruned < current_app.config.get("IDEMPOTENCY_PRUNE_INTERVAL_SECONDS", 300):
+        return
+    _last_pruned = now
+    try:
+        prune_expired_keys()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning(f"idempotency key pruning failed: {e}")
+
+
+def idempotent(endpoint):
+    """Route decorator; place it below @bp.route so the registered view is wrapped."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view(*args, **kwargs)
+            key = key.strip()
+            if not key or len(key) > MAX_KEY_LENGTH:
+                return jsonify({"error": f"{HEADER} must be 1-{MAX_KEY_LENGTH} characters"}), 400
+
+            request_hash = hashlib.sha256(request.get_data()).hexdigest()
+            existing = IdempotencyKey.query.filter_by(endpoint=endpoint, key=key).first()
+            if existing is not None:
+                if existing.created_at >= datetime.utcnow() - _ttl():
+                    return _replay(existing, request_hash)
+                db.session.delete(existing)  # expired: the key may be used afresh
+                db.session.commit()
+
+            try:
+                db.session.add(IdempotencyKey(endpoint=endpoint, key=key, request_hash=request_hash))
+                db.session.flush()
+            except IntegrityError:
+                # Lost the race to a concurrent retry, which has finished by now.
+                db.session.rollback()
+                existing = IdempotencyKey.query.filter_by(endpoint=endpoint, key=key).first()
+                if existing is None:
+                    return jsonify({"error": "Concurrent request failed, please retry"}), 409
+                return _replay(existing, request_hash)
+
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            except Exception:
+                _release(endpoint, key)
+                raise
+
+            if not 200 <= response.status_code < 300:
+                _release(endpoint, key)
+                return response
+
+            db.session.rollback()  # the route has committed; drop anything it left pending
+            db.session.execute(
+                IdempotencyKey.__table__.update()
+                .where(IdempotencyKey.endpoint == endpoint, IdempotencyKey.key == key)
+                .values(
+                    status_code=response.status_code,
+                    response_body=response.get_data(as_text=True),
+                    content_type=response.mimetype,
+                )
+            )
+            db.session.commit()
+            _maybe_prune()
+            return response
+        return wrapper
+    return decorator
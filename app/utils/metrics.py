@@ -0,0 +1,41 @@
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import current_app
+from sqlalchemy import event
+
+from app import db
+
+_local = threading.local()
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = getattr(_local, "counter", None)
+    if counter is not None:
+        counter["queries"] += 1
+
+
+@contextmanager
+def track_queries(label, **tags):
+    """
+    Count SQL round trips and wall time for one unit of work (e.g. one sale)
+    and log them as a single line: "<label> queries=.. elapsed_ms=.. k=v".
+    Extra keys set on the yielded dict are logged as tags too.
+    """
+    engine = db.engine
+    if not event.contains(engine, "before_cursor_execute", _count_query):
+        event.listen(engine, "before_cursor_execute", _count_query)
+
+    counter = dict(tags, queries=0, elapsed_ms=0.0)
+    _local.counter = counter
+    start = perf_counter()
+    try:
+        yield counter
+    finally:
+        _local.counter = None
+        counter["elapsed_ms"] = (perf_counter() - start) * 1000
+        extra = " ".join(f"{k}={v}" for k, v in counter.items() if k not in ("queries", "elapsed_ms"))
+        current_app.logger.info(
+            f"{label} queries={counter['queries']} elapsed_ms={counter['elapsed_ms']:.1f} {extra}".rstrip()
+        )
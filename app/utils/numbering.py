@@ -0,0 +1,109 @@
+"""
+Per-prefix document numbers (INV-00042, PAY-00007, EXP-..., CREDIT-PAY-...)
+backed by PostgreSQL sequences, handed out from blocks reserved per worker.
+
+Every document still gets its own TransactionNumber row: it is the target of
+the transaction_no foreign keys on sales, GL lines, inventory movements,
+payments and expenses. What changes is where the numbers come from:
+
+* the row id is taken from the table's own serial sequence, and
+* the printed number comes from a sequence per prefix (txn_no_<prefix>_seq),
+  so INV numbers no longer jump by however many PAY/EXP documents were
+  posted in between. It is stored in TransactionNumber.last_number.
+
+Each worker reserves TXN_NUMBER_BLOCK_SIZE values at a time with one
+"SELECT nextval(..) FROM generate_series(1, n)" on its own autocommit
+connection, then serves them from memory.
+
+Guarantees:
+* Unique: a value comes from a sequence exactly once, across all workers.
+* Not gapless: numbers of a rolled-back document are not reused, and the
+  unused rest of a block is lost when a worker restarts.
+* Ordered per worker only: one worker's numbers increase, but two workers
+  interleave, so INV-00120 can be issued before INV-00101. Sort documents
+  by date/id, not by number.
+
+On other dialects (SQLite in dev/tests) the legacy behaviour is kept: the
+row id is flushed and doubles as the number.
+"""
+import os
+import re
+import threading
+
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from app import db
+
+_blocks = {}  # sequence name -> list of reserved values, next value last
+_lock = threading.Lock()
+_owner_pid = os.getpid()
+_ensured = set()
+
+
+def sequence_name(prefix):
+    return "txn_no_" + re.sub(r"[^a-z0-9]+", "_", prefix.lower()).strip("_") + "_seq"
+
+
+def _ensure_sequence(conn, prefix):
+    """Create the prefix sequence, starting after any number already issued."""
+    name = sequence_name(prefix)
+    if name in _ensured:
+        return
+    # Legacy rows used their id as the number, newer ones store it in last_number.
+    start = conn.execute(text(
+        "SELECT GREATEST(COALESCE(MAX(id), 0), COALESCE(MAX(last_number), 0)) + 1 "
+        "FROM transaction_number WHERE prefix = :prefix"
+    ), {"prefix": prefix}).scalar()
+    try:
+        conn.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {name} START WITH {int(start)}"))
+    except DBAPIError:
+        # Another worker created it at the same moment; it exists either way.
+        pass
+    _ensured.add(name)
+
+
+def _reserve_block(sequence, size, prefix=None):
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if prefix is not None:
+            _ensure_sequence(conn, prefix)
+        values = conn.execute(
+            text(f"SELECT nextval('{sequence}') FROM generate_series(1, :n)"), {"n": size}
+        ).scalars().all()
+    return sorted(values, reverse=True)
+
+
+def _next_value(sequence, prefix=None):
+    global _owner_pid
+    with _lock:
+        if _owner_pid != os.getpid():
+            # Forked after reserving (gunicorn --preload): the parent's blocks are not ours.
+            _blocks.clear()
+            _owner_pid = os.getpid()
+
+        block = _blocks.get(sequence)
+        if not block:
+            size = int(current_app.config.get("TXN_NUMBER_BLOCK_SIZE", 20))
+            block = _blocks[sequence] = _reserve_block(sequence, max(size, 1), prefix)
+        return block.pop()
+
+
+def allocate(prefix):
+    """
+    Reserve (row_id, number) for a new document of this prefix, or None when
+    the database has no sequences and the caller should fall back.
+    """
+    if db.engine.dialect.name != "postgresql":
+        return None
+    id_sequence = "transaction_number_id_seq"
+    return _next_value(id_sequence), _next_value(sequence_name(prefix), prefix)
+
+
+def ensure_sequences(prefixes=("INV", "PAY", "EXP", "CREDIT-PAY", "SUPP-PAY", "PO-EDIT")):
+    """Create the per-prefix sequences up front (run once at deploy time)."""
+    if db.engine.dialect.name != "postgresql":
+        return
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for prefix in prefixes:
+            _ensure_sequence(conn, prefix)
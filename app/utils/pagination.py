@@ -0,0 +1,21 @@
+"""
+Opaque keyset cursors for paginated list endpoints.
+
+A cursor is the sort key of the last row of a page, e.g. [name, id] or
+[sale_date, id], as url-safe base64 JSON. The next page filters on
+(sort_col, id) > / < that tuple, so every page costs the same whatever its
+depth, unlike OFFSET.
+"""
+import base64
+import json
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
@@ -0,0 +1,272 @@
+"""
+Period close: lock a month, freeze its closing balances, optionally archive
+its GL lines.
+
+* Closing a month (close_period) locks every day up to its last day. Every
+  GL write goes through gl_utils' daily-balance upsert, which calls
+  check_period_open(). So a posting, reversal or line edit dated on or
+  before the latest closed period_end fails with ValueError. Months are
+  closed in order; closing one also locks any earlier month that was
+  never closed.
+* The close stores each account's cumulative Debit/Credit totals in
+  period_closing_balance. balances_through(day) starts from the latest
+  snapshot at or before `day` and adds only the daily rows after it, so
+  opening and as-of balances never scan closed history.
+* archive_period() moves a closed month's general_ledger rows into
+  general_ledger_archive (same ids) and restore_period() moves them back.
+  Reports are unaffected, because account_daily_balance for closed days is
+  frozen. Drill-down reads the archive (/api/periods/<YYYY-MM>/ledger).
+  Documents whose lines are archived cannot be reversed until the month is
+  restored (check_not_archived).
+
+Only the latest closed month can be reopened, and only while not archived.
+"""
+import calendar
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import Column, and_, delete, exists, func, insert, literal, select, text, union_all, update
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql.visitors import replacement_traverse
+
+from app import db
+from app.models import (
+    AccountDailyBalance, AccountingPeriod, GeneralLedger, GeneralLedgerArchive, PeriodClosingBalance
+)
+from app.utils.report_cache import ledger_changed
+
+ARCHIVE_COLUMNS = (
+    "id", "account_id", "transaction_type", "amount", "description", "transaction_date", "transaction_no",
+    "source_type", "source_id", "reversal_of_id", "status", "created_at", "updated_at",
+)
+
+
+def parse_period(value):
+    """'2025-03' -> (date(2025, 3, 1), date(2025, 3, 31)); raises ValueError."""
+    try:
+        start = datetime.strptime(value or "", "%Y-%m").date()
+    except ValueError:
+        raise ValueError("period must be YYYY-MM")
+    return start, start.replace(day=calendar.monthrange(start.year, start.month)[1])
+
+
+def serialize_period(period):
+    return {
+        "id": period.id,
+        "period": period.period_start.strftime("%Y-%m"),
+        "period_start": period.period_start.isoformat(),
+        "period_end": period.period_end.isoformat(),
+        "closed_at": period.closed_at.isoformat() if period.closed_at else None,
+        "closed_by": period.closed_by,
+        "archived": period.archived_at is not None,
+        "archived_at": period.archived_at.isoformat() if period.archived_at else None,
+    }
+
+
+# ------------------ Lock ------------------
+def closed_through(connection=None):
+    """Last day of the latest closed period, or None."""
+    conn = connection if connection is not None else db.session.connection()
+    return _as_date(conn.execute(select(func.max(AccountingPeriod.period_end))).scalar())
+
+
+def check_period_open(days, connection=None):
+    """Raise ValueError if any of the days falls in a closed period."""
+    days = [d for d in days if d is not None]
+    if not days:
+        return
+    locked = closed_through(connection)
+    if locked is not None and min(days) <= locked:
+        raise ValueError(f"Accounting period {min(days):%Y-%m} is closed (closed through {locked.isoformat()})")
+
+
+def _as_date(value):
+    if isinstance(value, str):  # SQLite aggregates come back as text
+        return date.fromisoformat(value[:10])
+    return value
+
+
+# ------------------ Snapshots ------------------
+def latest_period(on_or_before=None):
+    query = AccountingPeriod.query
+    if on_or_before is not None:
+        query = query.filter(AccountingPeriod.period_end <= on_or_before)
+    return query.order_by(AccountingPeriod.period_end.desc()).first()
+
+
+def balances_through(day=None):
+    """
+    Subquery (account_id, debit, credit): cumulative totals of every day up
+    to `day` (all days if None). It reads the latest closed snapshot at or
+    before `day` plus the account_daily_balance rows after it.
+    """
+    snapshot = latest_period(day)
+    days = select(AccountDailyBalance.account_id, AccountDailyBalance.debit, AccountDailyBalance.credit)
+    if day is not None:
+        days = days.where(AccountDailyBalance.day <= day)
+    if snapshot is None:
+        rows = days.subquery()
+    else:
+        rows = union_all(
+            select(PeriodClosingBalance.account_id, PeriodClosingBalance.debit, PeriodClosingBalance.credit)
+            .where(PeriodClosingBalance.period_id == snapshot.id),
+            days.where(AccountDailyBalance.day > snapshot.period_end),
+        ).subquery()
+    return (
+        select(rows.c.account_id, func.sum(rows.c.debit).label("debit"), func.sum(rows.c.credit).label("credit"))
+        .group_by(rows.c.account_id)
+        .subquery()
+    )
+
+
+def close_period(value, user_id=None):
+    """
+    Close the month 'YYYY-MM' and store its closing balances. It must be
+    later than the latest closed month and already over. Never commits.
+    """
+    start, end = parse_period(value)
+    if end >= datetime.utcnow().date():
+        raise ValueError(f"Period {value} has not ended yet")
+    latest = latest_period()
+    if latest is not None and start <= latest.period_end:
+        raise ValueError(f"Periods are already closed through {latest.period_end.isoformat()}")
+
+    if db.session.connection().dialect.name == "postgresql":
+        # in-flight postings finish first; new ones wait and then see the lock
+        db.session.execute(text("LOCK TABLE account_daily_balance IN EXCLUSIVE MODE"))
+
+    balances = balances_through(end)
+    period = AccountingPeriod(period_start=start, period_end=end, closed_by=user_id)
+    db.session.add(period)
+    db.session.flush()
+    db.session.execute(insert(PeriodClosingBalance).from_select(
+        ["period_id", "account_id", "debit", "credit"],
+        select(literal(period.id), balances.c.account_id, balances.c.debit, balances.c.credit),
+    ))
+    return period
+
+
+def get_period(value):
+    start, _ = parse_period(value)
+    period = AccountingPeriod.query.filter_by(period_start=start).first()
+    if period is None:
+        raise LookupError(f"Period {value} is not closed")
+    return period
+
+
+def reopen_period(period):
+    """Drop the latest closed period and its snapshot. Never commits."""
+    if period.archived_at is not None:
+        raise ValueError("Restore the archived period before reopening it")
+    if latest_period().id != period.id:
+        raise ValueError("Only the latest closed period can be reopened")
+    db.session.execute(delete(PeriodClosingBalance).where(PeriodClosingBalance.period_id == period.id))
+    db.session.delete(period)
+    db.session.flush()
+
+
+# ------------------ Archive ------------------
+ARCHIVE_CHUNK_SIZE = 5000
+
+
+def period_lines(model, period):
+    """Criterion for the lines of `model` (GeneralLedger or GeneralLedgerArchive) dated in the period."""
+    return and_(
+        model.transaction_date >= datetime.combine(period.period_start, time.min),
+        model.transaction_date < datetime.combine(period.period_end + timedelta(days=1), time.min),
+    )
+
+
+def _chunks(ids):
+    for i in range(0, len(ids), ARCHIVE_CHUNK_SIZE):
+        yield ids[i:i + ARCHIVE_CHUNK_SIZE]
+
+
+def archive_period(period):
+    """
+    Move a closed month's general_ledger rows to general_ledger_archive.
+    Lines reversed by a line outside the month stay, since that line's
+    reversal_of_id still points at them. Returns the number of rows moved.
+    Never commits.
+    """
+    if period.archived_at is not None:
+        raise ValueError("Period is already archived")
+    reversal = aliased(GeneralLedger)
+    ids = db.session.execute(select(GeneralLedger.id).where(
+        period_lines(GeneralLedger, period),
+        ~exists().where(reversal.reversal_of_id == GeneralLedger.id, ~period_lines(reversal, period)),
+    )).scalars().all()
+
+    columns = [getattr(GeneralLedger, c) for c in ARCHIVE_COLUMNS]
+    for chunk in _chunks(ids):
+        db.session.execute(insert(GeneralLedgerArchive).from_select(
+            list(ARCHIVE_COLUMNS), select(*columns).where(GeneralLedger.id.in_(chunk))
+        ))
+    # the archive keeps reversal_of_id; unlink before deleting so the
+    # self-referencing foreign key never sees a dangling row
+    for chunk in _chunks(ids):
+        db.session.execute(update(GeneralLedger).where(GeneralLedger.id.in_(chunk)).values(reversal_of_id=None))
+    for chunk in _chunks(ids):
+        db.session.execute(delete(GeneralLedger).where(GeneralLedger.id.in_(chunk)))
+
+    period.archived_at = datetime.utcnow()
+    ledger_changed(db.session)  # the GL listing report loses these lines
+    db.session.flush()
+    return len(ids)
+
+
+def restore_period(period):
+    """
+    Move an archived month's rows back into general_ledger. The earliest
+    archived month goes first, since later reversals point at earlier
+    lines. Returns the number of rows moved. Never commits.
+    """
+    if period.archived_at is None:
+        raise ValueError("Period is not archived")
+    earlier = AccountingPeriod.query.filter(
+        AccountingPeriod.archived_at.is_not(None), AccountingPeriod.period_end < period.period_start
+    ).order_by(AccountingPeriod.period_start).first()
+    if earlier is not None:
+        raise ValueError(f"Restore {earlier.period_start:%Y-%m} first")
+
+    in_period = period_lines(GeneralLedgerArchive, period)
+    plain = [c for c in ARCHIVE_COLUMNS if c != "reversal_of_id"]
+    db.session.execute(insert(GeneralLedger).from_select(
+        plain, select(*(getattr(GeneralLedgerArchive, c) for c in plain)).where(in_period)
+    ))
+    # relink once every row of the month is back
+    links = select(GeneralLedgerArchive.id, GeneralLedgerArchive.reversal_of_id).where(
+        in_period, GeneralLedgerArchive.reversal_of_id.is_not(None)
+    ).subquery()
+    db.session.execute(
+        update(GeneralLedger).where(GeneralLedger.id == links.c.id).values(reversal_of_id=links.c.reversal_of_id)
+    )
+    moved = db.session.execute(delete(GeneralLedgerArchive).where(in_period)).rowcount
+
+    period.archived_at = None
+    ledger_changed(db.session)
+    db.session.flush()
+    return moved
+
+
+def check_not_archived(*criteria):
+    """
+    Raise ValueError if archived GL lines match criteria written against
+    general_ledger columns (e.g. document_lines('sale', [12])).
+    """
+    archive = GeneralLedgerArchive.__table__
+    gl = GeneralLedger.__table__
+
+    def to_archive(element):
+        if isinstance(element, Column) and element.table is gl:
+            return archive.c[element.name]
+        return None
+
+    adapted = [replacement_traverse(c, {}, to_archive) for c in criteria]
+    line = db.session.execute(
+        select(GeneralLedgerArchive.id, GeneralLedgerArchive.transaction_date).where(*adapted).limit(1)
+    ).first()
+    if line is not None:
+        raise ValueError(
+            f"GL lines of this document are archived with period {line.transaction_date:%Y-%m}; "
+            "restore the period first"
+        )
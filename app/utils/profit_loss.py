@@ -0,0 +1,266 @@
+"""
+Profit & Loss engine behind the /api/reports/profit-loss* endpoints.
+
+load_profit_loss() reads per-account monthly totals once: one aggregate
+over account_daily_balance, outer-joined to the revenue/expense chart. It
+then rolls every amount up the account tree in a single pass, using a
+parent map computed once, so each account ends up with a vector of
+monthly amounts that includes its descendants. Quarterly, yearly,
+year-to-date and prior-year columns are sums over those vectors. The
+Python work is linear in accounts x months, whatever the number of years.
+
+Amounts carry the account's natural sign: revenue is credit - debit and
+expense is debit - credit, so reversals net out. COGS is an expense account
+with subtype 'Cost of Goods Sold' or the code sales post COGS to (5000),
+together with its sub-accounts. It gets its own section instead of the old
+hard-coded account id 30.
+"""
+from dataclasses import dataclass, field
+from datetime import date
+
+from sqlalchemy import and_, case, extract, func, literal, or_, select, true
+
+from app import db
+from app.models import Account, AccountDailyBalance, AccountTypeEnum, ExpenseSubtypeEnum
+
+COGS_ACCOUNT_CODE = "5000"  # sales.py posts COGS here
+COGS_SUBTYPES = (ExpenseSubtypeEnum.COGS.value, ExpenseSubtypeEnum.COGS.name)
+SECTIONS = ("revenue", "cogs", "expense")
+PERIODS = ("month", "quarter", "year")
+
+
+@dataclass
+class ProfitLoss:
+    months: list                       # (year, month) columns, ascending
+    accounts: dict                     # id -> account row
+    section: dict                      # id -> 'revenue' | 'cogs' | 'expense'
+    children: dict                     # id -> child ids in the same section
+    roots: dict                        # section -> root ids
+    amounts: dict                      # id -> rolled-up amount per month
+    prior: dict = field(default_factory=dict)  # id -> same month a year earlier
+
+
+def _shift_year(day, years=-1):
+    try:
+        return day.replace(year=day.year + years)
+    except ValueError:  # 29 February
+        return day.replace(year=day.year + years, day=28)
+
+
+def load_profit_loss(start=None, end=None, prior_year=False):
+    """
+    Monthly P&L vectors for days start..end (dates, both optional and
+    inclusive). With prior_year, also the same days one year earlier,
+    aligned to the same columns.
+    """
+    adb = AccountDailyBalance
+    in_range = and_(*[c for c in (
+        adb.day >= start if start else None,
+        adb.day <= end if end else None,
+    ) if c is not None]) if (start or end) else true()
+    if prior_year and (start or end):
+        in_prior = and_(*[c for c in (
+            adb.day >= _shift_year(start) if start else None,
+            adb.day <= _shift_year(end) if end else None,
+        ) if c is not None])
+    else:
+        in_prior = in_range
+
+    # flag each day as in the current and/or the prior-year range, then sum per month
+    lines = select(
+        adb.account_id,
+        extract("year", adb.day).label("year"),
+        extract("month", adb.day).label("month"),
+        case((in_range, 1), else_=0).label("current"),
+        (case((in_prior, 1), else_=0) if prior_year else literal(0)).label("prior"),
+        adb.debit,
+        adb.credit,
+    ).where(or_(in_range, in_prior)).subquery()
+    keys = [lines.c.account_id, lines.c.year, lines.c.month, lines.c.current, lines.c.prior]
+    monthly = select(
+        *keys, func.sum(lines.c.debit).label("debit"), func.sum(lines.c.credit).label("credit")
+    ).group_by(*keys).subquery()
+
+    rows = db.session.execute(
+        select(
+            Account.id, Account.name, Account.code, Account.account_type, Account.account_subtype,
+            Account.parent_id, monthly.c.year, monthly.c.month, monthly.c.current, monthly.c.prior,
+            monthly.c.debit, monthly.c.credit,
+        )
+        .outerjoin(monthly, monthly.c.account_id == Account.id)
+        .where(Account.status != 9, Account.account_type.in_([AccountTypeEnum.REVENUE, AccountTypeEnum.EXPENSE]))
+        .order_by(Account.code)
+    ).all()
+
+    accounts, current_amounts, prior_amounts = {}, {}, {}
+    for r in rows:
+        accounts.setdefault(r.id, r)
+        if r.year is None:
+            continue
+        sign = 1 if r.account_type == AccountTypeEnum.EXPENSE else -1
+        amount = sign * (float(r.debit or 0) - float(r.credit or 0))
+        key = (int(r.year), int(r.month))
+        if r.current:
+            bucket = current_amounts.setdefault(r.id, {})
+            bucket[key] = bucket.get(key, 0.0) + amount
+        if r.prior:
+            key = (key[0] + 1, key[1])  # the column it is compared with
+            bucket = prior_amounts.setdefault(r.id, {})
+            bucket[key] = bucket.get(key, 0.0) + amount
+
+    months = sorted({m for by_month in current_amounts.values() for m in by_month})
+    pl = _tree(accounts, months)
+    pl.amounts = _roll_up(pl, current_amounts)
+    if prior_year:
+        pl.prior = _roll_up(pl, prior_amounts)
+    return pl
+
+
+def _is_cogs(account):
+    return account.account_subtype in COGS_SUBTYPES or account.code == COGS_ACCOUNT_CODE
+
+
+def _tree(accounts, months):
+    section = {}
+
+    def section_of(account_id, seen=()):
+        if account_id not in section:
+            a = accounts[account_id]
+            if a.account_type == AccountTypeEnum.REVENUE:
+                section[account_id] = "revenue"
+            elif _is_cogs(a):
+                section[account_id] = "cogs"
+            elif a.parent_id in accounts and a.parent_id not in seen:
+                parent = section_of(a.parent_id, seen + (account_id,))
+                section[account_id] = "cogs" if parent == "cogs" else "expense"
+            else:
+                section[account_id] = "expense"
+        return section[account_id]
+
+    def in_cycle(account_id):
+        seen, current = set(), account_id
+        while current in accounts and current not in seen:
+            seen.add(current)
+            current = accounts[current].parent_id
+            if current == account_id:
+                return True
+        return False
+
+    children = {account_id: [] for account_id in accounts}
+    roots = {s: [] for s in SECTIONS}
+    for account_id, a in accounts.items():  # ordered by code
+        s = section_of(account_id)
+        parent = a.parent_id
+        if parent in accounts and section_of(parent) == s and not in_cycle(account_id):
+            children[parent].append(account_id)
+        else:
+            roots[s].append(account_id)
+    return ProfitLoss(months=months, accounts=accounts, section=section, children=children, roots=roots, amounts={})
+
+
+def _roll_up(pl, by_account):
+    index = {m: i for i, m in enumerate(pl.months)}
+    amounts = {}
+
+    def visit(account_id):
+        vector = [0.0] * len(pl.months)
+        for key, amount in by_account.get(account_id, {}).items():
+            if key in index:
+                vector[index[key]] += amount
+        for child in pl.children[account_id]:
+            for i, amount in enumerate(visit(child)):
+                vector[i] += amount
+        amounts[account_id] = vector
+        return vector
+
+    for ids in pl.roots.values():
+        for account_id in ids:
+            visit(account_id)
+    return amounts
+
+
+# ------------------ Columns ------------------
+def period_columns(pl, period="month"):
+    """[(label, month indexes)] for month ('2025-03'), quarter ('2025-Q1') or year ('2025') columns."""
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of: {', '.join(PERIODS)}")
+    columns = {}
+    for i, (year, month) in enumerate(pl.months):
+        if period == "month":
+            label = f"{year}-{month:02d}"
+        elif period == "quarter":
+            label = f"{year}-Q{(month - 1) // 3 + 1}"
+        else:
+            label = str(year)
+        columns.setdefault(label, []).append(i)
+    return list(columns.items())
+
+
+def totals(pl, indexes, vectors=None):
+    vectors = pl.amounts if vectors is None else vectors
+    section_totals = {
+        s: sum(vectors[a][i] for a in pl.roots[s] for i in indexes) for s in SECTIONS
+    }
+    return {
+        "total_revenue": section_totals["revenue"],
+        "total_cogs": section_totals["cogs"],
+        "total_expenses": section_totals["expense"],
+        "net_profit": section_totals["revenue"] - section_totals["cogs"] - section_totals["expense"],
+    }
+
+
+def statement(pl, indexes, digits=None):
+    """Nested accounts (revenue, then COGS, then other expenses) and totals for the given months."""
+    def node(account_id):
+        a = pl.accounts[account_id]
+        balance = sum(pl.amounts[account_id][i] for i in indexes)
+        kids = [n for n in (node(c) for c in pl.children[account_id]) if n is not None]
+        if not kids and balance == 0:
+            return None
+        return {
+            "id": a.id,
+            "name": a.name,
+            "type": a.account_type.value,
+            "subtype": str(a.account_subtype),
+            "balance": round(balance, digits) if digits is not None else balance,
+            "children": kids,
+            "parent_id": a.parent_id,
+        }
+
+    accounts = [n for s in SECTIONS for n in (node(a) for a in pl.roots[s]) if n is not None]
+    result = totals(pl, indexes)
+    if digits is not None:
+        result = {k: round(v, digits) for k, v in result.items()}
+    return {"accounts": accounts, "totals": result}
+
+
+def year_to_date(pl, columns):
+    """Running net profit per column, restarting every January."""
+    running, year, out = 0.0, None, []
+    for label, indexes in columns:
+        column_year = pl.months[indexes[0]][0]
+        if column_year != year:
+            running, year = 0.0, column_year
+        running += totals(pl, indexes)["net_profit"]
+        out.append(running)
+    return out
+
+
+def comparison(pl, indexes, digits=2):
+    """Prior-year totals for the columns' months and the change against them."""
+    now, before = totals(pl, indexes), totals(pl, indexes, pl.prior)
+    return {
+        "prior_year": {k: round(v, digits) for k, v in before.items()},
+        "change": {k: round(now[k] - before[k], digits) for k in now},
+    }
+
+
+def parse_range(start_str, end_str):
+    """start_date / end_date query strings (YYYY-MM-DD) -> dates or None; raises ValueError."""
+    out = []
+    for value, name in ((start_str, "start_date"), (end_str, "end_date")):
+        try:
+            out.append(date.fromisoformat(value) if value else None)
+        except ValueError:
+            raise ValueError(f"{name} must be YYYY-MM-DD")
+    return tuple(out)
@@ -0,0 +1,159 @@
+"""
+Result cache for the GL-derived reports (trial balance, P&L, balance sheet,
+cash flow, general ledger listing).
+
+A cached response is keyed by endpoint + normalized query string + the
+'ledger' cache version (app.utils.versions). Repeated views of a report
+therefore cost one primary-key read of cache_version instead of an
+aggregation.
+
+* Every GL write marks its session (gl_utils' daily-balance upsert, the
+  daily-balance rebuild and account edits call ledger_changed()). Once that
+  transaction commits, the version is bumped in a short transaction of its
+  own. Bumping inside the posting transaction would make every checkout
+  queue on the cache_version row. A report reads the version before it
+  aggregates, so a result can only ever be stored under a version older
+  than the data it saw, never a newer one.
+* Entries live in a per-worker LRU of REPORT_CACHE_MAX_ENTRIES. If
+  REPORT_CACHE_DIR is set they are also written there, one file per
+  endpoint + params, so workers on the same host share them and survive
+  restarts.
+* REPORT_CACHE_MAX_AGE_SECONDS bounds any entry's life, as a safety net
+  for a bump lost between commit and bump (worker crash).
+
+Reports built from other tables (stock, sales profit, aging) do not move
+the ledger version and are not cached.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.utils.versions import bump_version_committed, current_version
+
+LEDGER_VERSION = "ledger"
+_FLAG = "ledger_changed"
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # key -> (version, stored_at, body)
+
+
+# ------------------ Invalidation ------------------
+def ledger_changed(session):
+    """Mark a session whose commit must invalidate cached reports."""
+    session.info[_FLAG] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_after_commit(session):
+    if session.info.pop(_FLAG, False):
+        try:
+            bump_version_committed(LEDGER_VERSION)
+        except Exception as e:  # the data is committed; the max age bounds staleness
+            current_app.logger.warning(f"ledger cache version bump failed: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_flag(session):
+    session.info.pop(_FLAG, None)
+
+
+def clear_report_cache():
+    with _lock:
+        _entries.clear()
+
+
+# ------------------ Storage ------------------
+def _cache_key():
+    args = sorted((k, v) for k, values in request.args.lists() for v in values)
+    raw = json.dumps([request.endpoint, args], separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _get(key, version, max_age):
+    now = time.time()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            if entry[0] == version and now - entry[1] <= max_age:
+                _entries.move_to_end(key)
+                return entry[2]
+            del _entries[key]
+
+    path = _disk_path(key)
+    if path is None:
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if stored.get("version") != version or now - stored.get("stored_at", 0) > max_age:
+        return None
+    _put_memory(key, version, stored["stored_at"], stored["body"])
+    return stored["body"]
+
+
+def _put(key, version, body):
+    stored_at = time.time()
+    _put_memory(key, version, stored_at, body)
+    path = _disk_path(key)
+    if path is None:
+        return
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "stored_at": stored_at, "body": body}, f)
+        os.replace(tmp, path)  # readers never see a half-written file
+    except OSError as e:
+        current_app.logger.warning(f"report cache write failed: {e}")
+
+
+def _put_memory(key, version, stored_at, body):
+    limit = current_app.config.get("REPORT_CACHE_MAX_ENTRIES", 256)
+    with _lock:
+        _entries[key] = (version, stored_at, body)
+        _entries.move_to_end(key)
+        while len(_entries) > limit:
+            _entries.popitem(last=False)
+
+
+def _disk_path(key):
+    directory = current_app.config.get("REPORT_CACHE_DIR")
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{key}.json")
+
+
+# ------------------ Decorator ------------------
+def cached_report(view):
+    """Route decorator; place it below @bp.route so the registered view is wrapped."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        config = current_app.config
+        if config.get("REPORT_CACHE_MAX_ENTRIES", 256) <= 0:
+            return view(*args, **kwargs)
+
+        key = _cache_key()
+        version = current_version(LEDGER_VERSION)  # before aggregating, see module docstring
+        body = _get(key, version, config.get("REPORT_CACHE_MAX_AGE_SECONDS", 3600))
+        if body is not None:
+            response = Response(body, mimetype="application/json")
+            response.headers["X-Report-Cache"] = "hit"
+            return response
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code == 200 and response.mimetype == "application/json":
+            _put(key, version, response.get_data(as_text=True))
+            response.headers["X-Report-Cache"] = "miss"
+        return response
+    return wrapper
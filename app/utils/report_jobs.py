@@ -0,0 +1,246 @@
+"""
+Background report jobs: POST /api/reports/jobs runs any GET report of the
+reports blueprint off the request thread, so a year-long sales-profit,
+purchased-product or customer-payments report cannot hit the gunicorn
+timeout or hold a sync worker.
+
+* A job runs the report's own view on a thread pool of REPORT_JOB_WORKERS
+  per worker process. It goes through the normal request path, with the
+  submitter's Authorization header and the job's params as the query
+  string, so auth, validation and @cached_report behave exactly as for a
+  direct GET. The header is kept in memory only, never written out.
+* State lives on disk under REPORT_JOB_DIR: <id>.json (status, progress,
+  timestamps, ETag) and <id>.result.json (the report body). Both are written
+  atomically, so any worker process on the host can answer status and
+  result requests. The ETag is the SHA-256 of the result body.
+* A long report may call report_progress() between its stages. Outside a
+  job it does nothing.
+* If the process that owns a queued or running job has exited (restart,
+  max_requests recycle), the job is reported as failed instead of staying
+  "running" forever.
+* Job files older than REPORT_JOB_TTL_HOURS are removed when a new job is
+  submitted.
+"""
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app, g
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+_PUBLIC = (
+    "job_id", "report", "params", "status", "progress", "message",
+    "created_at", "started_at", "finished_at", "http_status", "error",
+)
+PROGRESS_WRITE_SECONDS = 1.0
+
+_lock = threading.Lock()
+_executor = None
+_last_progress_write = {}  # job id -> time of the last progress write
+
+
+# ------------------ Storage ------------------
+def _directory():
+    directory = current_app.config.get("REPORT_JOB_DIR") or os.path.join(
+        tempfile.gettempdir(), "sjhardware-report-jobs"
+    )
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _path(job_id, suffix=".json"):
+    return os.path.join(_directory(), f"{job_id}{suffix}")
+
+
+def _write(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)  # readers never see a half-written file
+
+
+def _save(job):
+    _write(_path(job["job_id"]), json.dumps(job).encode("utf-8"))
+
+
+def _load(job_id):
+    try:
+        uuid.UUID(hex=job_id)
+    except ValueError:
+        return None
+    try:
+        with open(_path(job_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _update(job_id, **changes):
+    job = _load(job_id)
+    if job is not None:
+        job.update(changes)
+        _save(job)
+    return job
+
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+
+def _prune():
+    cutoff = time.time() - current_app.config.get("REPORT_JOB_TTL_HOURS", 24) * 3600
+    with os.scandir(_directory()) as entries:
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass  # another worker got there first
+
+
+# ------------------ Reports ------------------
+def report_paths():
+    """Report name (last path segment) -> URL of every GET report a job can run."""
+    paths = {}
+    for rule in current_app.url_map.iter_rules():
+        if (rule.endpoint.startswith("reports.") and not rule.arguments
+                and "GET" in rule.methods and not rule.endpoint.startswith("reports.report_job")):
+            paths[rule.rule.rstrip("/").rsplit("/", 1)[-1]] = rule.rule
+    return paths
+
+
+def _clean_params(params):
+    if params is None:
+        return {}
+    if not isinstance(params, dict):
+        raise ValueError("params must be an object of query parameters")
+    clean = {}
+    for key, value in params.items():
+        values = value if isinstance(value, list) else [value]
+        if any(isinstance(v, (dict, list)) for v in values):
+            raise ValueError(f"params.{key} must be a value or a list of values")
+        clean[str(key)] = [("" if v is None else str(v)) for v in values]
+    return clean
+
+
+# ------------------ Jobs ------------------
+def submit_job(report, params, user_id, authorization):
+    """Queue a report; returns the job record. Raises ValueError for an unknown report or bad params."""
+    global _executor
+    path = report_paths().get(report or "")
+    if path is None:
+        raise ValueError(f"Unknown report '{report}'")
+    params = _clean_params(params)
+
+    _prune()
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "report": report,
+        "params": params,
+        "user_id": user_id,
+        "status": QUEUED,
+        "progress": 0,
+        "message": None,
+        "created_at": _now(),
+        "started_at": None,
+        "finished_at": None,
+        "http_status": None,
+        "error": None,
+        "etag": None,
+        "pid": os.getpid(),
+        "host": socket.gethostname(),
+    }
+    _save(job)
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(current_app.config.get("REPORT_JOB_WORKERS", 2), 1),
+                thread_name_prefix="report-job",
+            )
+        _executor.submit(_run, current_app._get_current_object(), job["job_id"], path, params, authorization)
+    return job
+
+
+def _run(app, job_id, path, params, authorization):
+    with app.test_request_context(path, query_string=params, headers={"Authorization": authorization or ""}):
+        _update(job_id, status=RUNNING, started_at=_now())
+        g.report_job = job_id
+        try:
+            response = app.full_dispatch_request()
+            body = response.get_data()
+        except Exception as e:
+            app.logger.exception(f"report job {job_id} failed")
+            _update(job_id, status=FAILED, finished_at=_now(), http_status=500, error=str(e))
+            return
+        finally:
+            _last_progress_write.pop(job_id, None)
+
+        if response.status_code != 200:
+            try:
+                error = json.loads(body).get("error")
+            except (ValueError, AttributeError):
+                error = None
+            _update(
+                job_id, status=FAILED, finished_at=_now(), http_status=response.status_code,
+                error=error or f"Report returned HTTP {response.status_code}",
+            )
+            return
+        _write(_path(job_id, ".result.json"), body)
+        _update(
+            job_id, status=DONE, progress=100, message=None, finished_at=_now(), http_status=200,
+            etag=hashlib.sha256(body).hexdigest(),
+        )
+
+
+def report_progress(percent, message=None):
+    """Record progress (0-100) of the report job running on this thread; no-op for a normal request."""
+    job_id = g.get("report_job")
+    if job_id is None:
+        return
+    now, last = time.monotonic(), _last_progress_write.get(job_id)
+    if last is not None and now - last < PROGRESS_WRITE_SECONDS:
+        return
+    _last_progress_write[job_id] = now
+    _update(job_id, progress=max(0, min(int(percent), 99)), message=message)
+
+
+def get_job(job_id, user_id):
+    """The job record if it exists and belongs to user_id, else None."""
+    job = _load(job_id)
+    if job is None or job.get("user_id") != user_id:
+        return None
+    if job["status"] in (QUEUED, RUNNING) and _owner_gone(job):
+        job = _update(
+            job_id, status=FAILED, finished_at=_now(),
+            error="The worker running this job exited; submit it again",
+        ) or job
+    return job
+
+
+def _owner_gone(job):
+    if job.get("host") != socket.gethostname():
+        return False  # cannot tell from here
+    try:
+        os.kill(job["pid"], 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return False  # exists, owned by another user
+    return False
+
+
+def public_view(job):
+    return {k: job.get(k) for k in _PUBLIC}
+
+
+def result_body(job):
+    with open(_path(job["job_id"], ".result.json"), "rb") as f:
+        return f.read()
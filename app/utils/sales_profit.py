@@ -0,0 +1,186 @@
+"""
+Sales profit report: sale lines with their COGS, or the same lines grouped
+by product, category, customer or day.
+
+Both the page and the grand totals read the same filtered set of lines.
+The totals are one aggregate query over every matching line, not just the
+current page. Dates are plain range predicates on sale.sale_date
+(ix_sale_sale_date_id); end_date includes the whole day. Soft-deleted
+sales and sale lines are left out.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, distinct, func, or_, select
+
+from app import db
+from app.models import Category, Customer, Product, ProductUnit, Sale, SaleItem
+
+GROUP_BY = ("product", "category", "customer", "day")
+
+line_sales = SaleItem.unit_price * SaleItem.quantity
+line_cost = func.coalesce(SaleItem.cost_total, 0)
+
+
+def _parse_day(value, name):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"{name} must be YYYY-MM-DD")
+
+
+def line_filters(start_date=None, end_date=None, search=None):
+    """Criteria on the joined lines (see _lines); raises ValueError."""
+    criteria = [Sale.status != 9, SaleItem.status != 9]
+    if start_date:
+        criteria.append(Sale.sale_date >= _parse_day(start_date, "start_date"))
+    if end_date:
+        criteria.append(Sale.sale_date < _parse_day(end_date, "end_date") + timedelta(days=1))
+    if search:
+        pattern = f"%{search}%"
+        criteria.append(or_(
+            Product.name.ilike(pattern),
+            Sale.sale_number.ilike(pattern),
+            Customer.name.ilike(pattern),
+            Category.name.ilike(pattern),
+        ))
+    return criteria
+
+
+def _lines(*columns):
+    return (
+        select(*columns)
+        .select_from(SaleItem)
+        .join(Sale, Sale.id == SaleItem.sale_id)
+        .join(Product, SaleItem.product_id == Product.id)
+        .join(Customer, Sale.customer_id == Customer.id)
+        .outerjoin(Category, Product.category_id == Category.id)
+    )
+
+
+def sales_profit_totals(criteria):
+    """
+    Grand totals of the matching lines. Sale-level amounts (sale total, paid,
+    outstanding) count each matching sale once.
+    """
+    per_sale = (
+        _lines(
+            SaleItem.sale_id,
+            func.count().label("lines"),
+            func.sum(line_cost).label("cost"),
+            func.sum(line_sales - line_cost).label("profit"),
+        )
+        .where(*criteria)
+        .group_by(SaleItem.sale_id)
+        .subquery()
+    )
+    row = db.session.execute(
+        select(
+            func.coalesce(func.sum(per_sale.c.lines), 0).label("lines"),
+            func.coalesce(func.sum(Sale.total_amount), 0).label("sales"),
+            func.coalesce(func.sum(per_sale.c.cost), 0).label("cost"),
+            func.coalesce(func.sum(per_sale.c.profit), 0).label("profit"),
+            func.coalesce(func.sum(Sale.total_paid), 0).label("paid"),
+            func.coalesce(func.sum(case((Sale.balance > 0, Sale.balance), else_=0)), 0).label("credit"),
+        ).join(Sale, Sale.id == per_sale.c.sale_id)
+    ).one()
+    return row.lines, {
+        "total_sales": float(row.sales),
+        "total_cost": float(row.cost),
+        "total_profit": float(row.profit),
+        "total_cash_received": float(row.paid),
+        "total_credit_outstanding": float(row.credit),
+    }
+
+
+def sales_profit_lines(criteria, page, per_page):
+    rows = db.session.execute(
+        _lines(
+            Sale.id.label("sale_id"),
+            Sale.sale_number,
+            Sale.sale_date,
+            Customer.name.label("customer_name"),
+            Product.name.label("product_name"),
+            Category.name.label("category_name"),
+            ProductUnit.unit_name,
+            SaleItem.quantity,
+            SaleItem.unit_price.label("selling_price"),
+            SaleItem.unit_cost.label("purchase_price"),  # COGS fixed when the sale was posted
+            line_sales.label("line_sales"),
+            line_cost.label("line_cost"),
+        )
+        .outerjoin(ProductUnit, ProductUnit.id == SaleItem.unit_id)
+        .where(*criteria)
+        .order_by(Sale.sale_date.desc(), SaleItem.id)
+        .offset((page - 1) * per_page)
+        .limit(per_page)
+    ).all()
+    return [{
+        "sale_id": r.sale_id,
+        "invoice_number": r.sale_number,
+        "sale_date": r.sale_date,
+        "customer": r.customer_name,
+        "product": r.product_name,
+        "category": r.category_name,
+        "unit": r.unit_name or "",
+        "qty": r.quantity,
+        "selling_price": r.selling_price,
+        "purchase_price": r.purchase_price or 0,
+        "line_sales": r.line_sales,
+        "line_cost": r.line_cost,
+        "profit": r.line_sales - r.line_cost,
+    } for r in rows]
+
+
+def sales_profit_groups(criteria, group_by, page, per_page):
+    """One page of groups and the number of groups; raises ValueError."""
+    if group_by == "product":
+        key, label = Product.id, Product.name
+    elif group_by == "category":
+        key, label = Category.id, Category.name
+    elif group_by == "customer":
+        key, label = Customer.id, Customer.name
+    elif group_by == "day":
+        key = label = func.date(Sale.sale_date)
+    else:
+        raise ValueError(f"group_by must be one of: {', '.join(GROUP_BY)}")
+
+    sales = func.sum(line_sales)
+    grouped = (
+        _lines(
+            key.label("key"),
+            label.label("label"),
+            func.count(distinct(Sale.id)).label("sales_count"),
+            func.sum(SaleItem.quantity).label("qty"),
+            sales.label("line_sales"),
+            func.sum(line_cost).label("line_cost"),
+        )
+        .where(*criteria)
+        .group_by(key, label)
+    )
+    rows = db.session.execute(
+        grouped.add_columns(func.count().over().label("groups"))
+        .order_by(key.desc() if group_by == "day" else sales.desc(), key)
+        .offset((page - 1) * per_page)
+        .limit(per_page)
+    ).all()
+    if rows:
+        groups = rows[0].groups
+    elif page > 1:  # past the last page
+        groups = db.session.execute(select(func.count()).select_from(grouped.subquery())).scalar()
+    else:
+        groups = 0
+
+    data = []
+    for r in rows:
+        item = {group_by: str(r.label) if group_by == "day" else r.label}
+        if group_by != "day":
+            item[f"{group_by}_id"] = r.key
+        item.update({
+            "sales_count": r.sales_count,
+            "qty": float(r.qty or 0),
+            "line_sales": float(r.line_sales or 0),
+            "line_cost": float(r.line_cost or 0),
+            "profit": float((r.line_sales or 0) - (r.line_cost or 0)),
+        })
+        data.append(item)
+    return data, groups
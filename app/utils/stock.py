@@ -0,0 +1,103 @@
+from flask import current_app
+from sqlalchemy import case, func, select, text, update
+
+from app import db
+from app.models import Product
+
+
+class InsufficientStockError(ValueError):
+    """A basket line asks for more base units than the product has on hand."""
+
+    def __init__(self, message, product_id=None, available=None, required=None):
+        super().__init__(message)
+        self.product_id = product_id
+        self.available = available
+        self.required = required
+
+
+def _set_lock_timeout():
+    """On PostgreSQL, give up on a contended row instead of queueing forever."""
+    timeout_ms = current_app.config.get("STOCK_LOCK_TIMEOUT_MS")
+    if timeout_ms and db.engine.dialect.name == "postgresql":
+        db.session.execute(text(f"SET LOCAL lock_timeout = {int(timeout_ms)}"))
+
+
+def reserve_stock(requirements, labels=None):
+    """
+    Atomically take stock for several products in the current transaction.
+
+    requirements: {product_id: base_qty}. The product rows are first locked
+    FOR UPDATE in ascending id order, so concurrent baskets queue on the same
+    first row instead of deadlocking, and the first short line fails fast
+    with InsufficientStockError. All products are then decremented with one
+    conditional UPDATE ... WHERE quantity >= qty RETURNING, so two tills can
+    never both sell the last unit. On error the caller rolls back and
+    nothing is taken.
+
+    labels: optional {product_id: "Name (Unit)"} used in the error message.
+    Returns {product_id: new_quantity}.
+    """
+    if not requirements:
+        return {}
+
+    labels = labels or {}
+    product_ids = sorted(requirements)
+    _set_lock_timeout()
+
+    on_hand = dict(db.session.execute(
+        select(Product.id, Product.quantity)
+        .where(Product.id.in_(product_ids))
+        .order_by(Product.id)
+        .with_for_update()
+    ).all())
+
+    def short(product_id):
+        qty = requirements[product_id]
+        return InsufficientStockError(
+            f"Insufficient stock for {labels.get(product_id, f'product {product_id}')}. "
+            f"Available: {on_hand.get(product_id) or 0}, Required: {qty}",
+            product_id=product_id,
+            available=on_hand.get(product_id),
+            required=qty,
+        )
+
+    for product_id in product_ids:
+        if (on_hand.get(product_id) or 0) < requirements[product_id]:
+            raise short(product_id)
+
+    delta = case(requirements, value=Product.id)
+    remaining = dict(db.session.execute(
+        update(Product)
+        .where(Product.id.in_(product_ids), Product.quantity >= delta)
+        .values(quantity=Product.quantity - delta)
+        .returning(Product.id, Product.quantity),
+        execution_options={"synchronize_session": "fetch"},
+    ).all())
+
+    for product_id in product_ids:
+        if product_id not in remaining:
+            raise short(product_id)
+    return remaining
+
+
+def adjust_stock(deltas):
+    """
+    Add signed base-unit deltas to several products with one UPDATE
+    (quantity = quantity + delta), for stock coming in or being given back:
+    purchases, PO edits, reversals. No availability check; use
+    reserve_stock() to take stock out.
+
+    deltas: {product_id: base_qty}. Returns {product_id: new_quantity}.
+    """
+    deltas = {pid: qty for pid, qty in deltas.items() if qty}
+    if not deltas:
+        return {}
+
+    delta = case(deltas, value=Product.id)
+    return dict(db.session.execute(
+        update(Product)
+        .where(Product.id.in_(sorted(deltas)))
+        .values(quantity=func.coalesce(Product.quantity, 0) + delta)
+        .returning(Product.id, Product.quantity),
+        execution_options={"synchronize_session": "fetch"},
+    ).all())
@@ -0,0 +1,49 @@
+from sqlalchemy import insert, select, update
+
+from app import db
+from app.models import CacheVersion
+
+
+def bump_version(name):
+    """
+    Increment a cache version inside the caller's transaction, so other
+    workers see the new number exactly when the write they guard commits.
+    """
+    bumped = db.session.execute(
+        update(CacheVersion)
+        .where(CacheVersion.name == name)
+        .values(version=CacheVersion.version + 1)
+        .returning(CacheVersion.version),
+        execution_options={"synchronize_session": False},
+    ).scalar()
+    if bumped is None:
+        db.session.add(CacheVersion(name=name, version=1))
+        db.session.flush()
+        bumped = 1
+    return bumped
+
+
+def current_version(name):
+    """Committed version of a cache, 0 if it was never bumped."""
+    return db.session.execute(
+        select(CacheVersion.version).where(CacheVersion.name == name)
+    ).scalar() or 0
+
+
+def bump_version_committed(name):
+    """
+    Increment a cache version in a short transaction of its own, for writes
+    too frequent to hold the cache_version row lock until they commit. Call
+    it after the guarded write has committed.
+    """
+    with db.engine.begin() as conn:
+        bumped = conn.execute(
+            update(CacheVersion)
+            .where(CacheVersion.name == name)
+            .values(version=CacheVersion.version + 1)
+            .returning(CacheVersion.version)
+        ).scalar()
+        if bumped is None:
+            conn.execute(insert(CacheVersion).values(name=name, version=1))
+            bumped = 1
+    return bumped
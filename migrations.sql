@@ -11,3 +11,264 @@ USING UPPER(account_type::text)::accounttypeenum;
 
 -- 4️⃣ Drop the old enum type
 DROP TYPE accounttypeenum_old;
+
+-- ------------------ Incremental stock reconciliation ------------------
+CREATE INDEX IF NOT EXISTS ix_purchase_order_item_product_id ON purchase_order_item (product_id);
+CREATE INDEX IF NOT EXISTS ix_sale_item_product_id ON sale_item (product_id);
+CREATE INDEX IF NOT EXISTS ix_stock_adjustment_product_id ON stock_adjustment (product_id);
+CREATE INDEX IF NOT EXISTS ix_purchase_order_item_updated_at ON purchase_order_item (updated_at);
+CREATE INDEX IF NOT EXISTS ix_sale_item_updated_at ON sale_item (updated_at);
+CREATE INDEX IF NOT EXISTS ix_stock_adjustment_updated_at ON stock_adjustment (updated_at);
+
+CREATE TABLE IF NOT EXISTS stock_reconcile_watermark (
+    source VARCHAR(30) PRIMARY KEY,
+    last_updated_at TIMESTAMP,
+    last_id INTEGER NOT NULL DEFAULT 0,
+    run_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS stock_checkpoint (
+    product_id INTEGER PRIMARY KEY REFERENCES product (id),
+    expected_quantity DOUBLE PRECISION NOT NULL DEFAULT 0,
+    stored_quantity DOUBLE PRECISION NOT NULL DEFAULT 0,
+    drift DOUBLE PRECISION NOT NULL DEFAULT 0,
+    checked_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_stock_checkpoint_drift ON stock_checkpoint (drift);
+
+-- ------------------ Latest purchase cost per product/unit ------------------
+CREATE TABLE IF NOT EXISTS product_cost (
+    id SERIAL PRIMARY KEY,
+    product_id INTEGER NOT NULL REFERENCES product (id),
+    unit_id INTEGER REFERENCES product_unit (id),
+    unit_price DOUBLE PRECISION NOT NULL DEFAULT 0,
+    base_cost DOUBLE PRECISION NOT NULL DEFAULT 0,
+    purchase_order_item_id INTEGER NOT NULL REFERENCES purchase_order_item (id),
+    updated_at TIMESTAMP,
+    CONSTRAINT uq_product_cost_product_unit UNIQUE (product_id, unit_id)
+);
+CREATE INDEX IF NOT EXISTS ix_product_cost_product_id ON product_cost (product_id);
+
+-- Backfill (same rule as app.utils.costing.refresh_product_costs)
+INSERT INTO product_cost (product_id, unit_id, unit_price, base_cost, purchase_order_item_id, updated_at)
+SELECT poi.product_id, poi.unit_id, poi.unit_price,
+       poi.unit_price / COALESCE(NULLIF(pu.conversion_quantity, 0), 1.0), poi.id, NOW()
+FROM purchase_order_item poi
+LEFT JOIN product_unit pu ON pu.id = poi.unit_id
+WHERE poi.id IN (
+    SELECT MAX(i.id)
+    FROM purchase_order_item i
+    JOIN purchase_order po ON po.id = i.purchase_order_id
+    WHERE i.status != 9 AND po.status != 9 AND i.unit_price > 0
+    GROUP BY i.product_id, i.unit_id
+)
+ON CONFLICT (product_id, unit_id) DO NOTHING;
+
+-- ------------------ Cache versions (worker-local caches) ------------------
+CREATE TABLE IF NOT EXISTS cache_version (
+    name VARCHAR(50) PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP
+);
+INSERT INTO cache_version (name, version) VALUES ('catalog', 0) ON CONFLICT (name) DO NOTHING;
+INSERT INTO cache_version (name, version) VALUES ('account_codes', 0) ON CONFLICT (name) DO NOTHING;
+
+-- ------------------ Search indexes (pg_trgm) + barcode lookup ------------------
+-- CONCURRENTLY: build without blocking writes; run outside a transaction block.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_product_name_trgm ON product USING gin (name gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_product_sku_trgm ON product USING gin (sku gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_customer_name_trgm ON customer USING gin (name gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_supplier_name_trgm ON supplier USING gin (name gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_purchase_order_invoice_number_trgm ON purchase_order USING gin (invoice_number gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_purchase_order_memo_trgm ON purchase_order USING gin (memo gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_sale_sale_number_trgm ON sale USING gin (sale_number gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_sale_memo_trgm ON sale USING gin (memo gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_general_ledger_description_trgm ON general_ledger USING gin (description gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_product_unit_unit_code ON product_unit (unit_code);
+
+-- ------------------ Sales list keyset pagination ------------------
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_sale_sale_date_id ON sale (sale_date, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_sale_item_sale_id ON sale_item (sale_id);
+
+-- ------------------ COGS per sale line (fixed at posting) ------------------
+ALTER TABLE sale_item ADD COLUMN IF NOT EXISTS unit_cost DOUBLE PRECISION;
+ALTER TABLE sale_item ADD COLUMN IF NOT EXISTS cost_total DOUBLE PRECISION;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_inventory_transaction_sale_id ON inventory_transaction (sale_id);
+
+-- Backfill (same rule as app.utils.costing.backfill_sale_item_costs)
+UPDATE sale_item
+SET unit_cost = COALESCE(
+        (SELECT it.unit_price FROM inventory_transaction it
+         WHERE it.sale_id = sale_item.sale_id AND it.product_id = sale_item.product_id
+           AND it.unit_id = sale_item.unit_id AND it.transaction_type = 'Sale'
+         ORDER BY it.id DESC LIMIT 1),
+        (SELECT pc.base_cost FROM product_cost pc
+         WHERE pc.product_id = sale_item.product_id
+         ORDER BY pc.purchase_order_item_id DESC LIMIT 1),
+        0
+    ) * COALESCE((SELECT pu.conversion_quantity FROM product_unit pu WHERE pu.id = sale_item.unit_id), 1)
+WHERE unit_cost IS NULL;
+UPDATE sale_item SET cost_total = unit_cost * quantity WHERE cost_total IS NULL;
+
+-- ------------------ Cost layers (COSTING_METHOD=fifo|average) ------------------
+-- Populate with scripts/rebuild_cost_layers.py after switching the method.
+CREATE TABLE IF NOT EXISTS cost_layer (
+    id SERIAL PRIMARY KEY,
+    product_id INTEGER NOT NULL REFERENCES product(id),
+    source VARCHAR(20) NOT NULL,
+    purchase_order_item_id INTEGER REFERENCES purchase_order_item(id),
+    received_at TIMESTAMP,
+    unit_cost DOUBLE PRECISION NOT NULL DEFAULT 0,
+    quantity DOUBLE PRECISION NOT NULL DEFAULT 0,
+    remaining DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS ix_cost_layer_product_id ON cost_layer (product_id);
+CREATE INDEX IF NOT EXISTS ix_cost_layer_purchase_order_item_id ON cost_layer (purchase_order_item_id);
+CREATE INDEX IF NOT EXISTS ix_cost_layer_open ON cost_layer (product_id, id) WHERE remaining > 0;
+
+-- ------------------ Idempotency keys (POS write endpoints) ------------------
+CREATE TABLE IF NOT EXISTS idempotency_key (
+    id SERIAL PRIMARY KEY,
+    endpoint VARCHAR(100) NOT NULL,
+    key VARCHAR(255) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    status_code INTEGER,
+    response_body TEXT,
+    content_type VARCHAR(100),
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    CONSTRAINT uq_idempotency_key_endpoint_key UNIQUE (endpoint, key)
+);
+CREATE INDEX IF NOT EXISTS ix_idempotency_key_created_at ON idempotency_key (created_at);
+
+-- ------------------ GL lines linked to their source document ------------------
+ALTER TABLE general_ledger ADD COLUMN IF NOT EXISTS source_type VARCHAR(30);
+ALTER TABLE general_ledger ADD COLUMN IF NOT EXISTS source_id INTEGER;
+ALTER TABLE general_ledger ADD COLUMN IF NOT EXISTS reversal_of_id INTEGER REFERENCES general_ledger(id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_general_ledger_source ON general_ledger (source_type, source_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_general_ledger_transaction_no ON general_ledger (transaction_no);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_general_ledger_reversal_of_id ON general_ledger (reversal_of_id);
+-- Backfill existing lines (same rule as app.utils.gl_utils.backfill_ledger_sources);
+-- legacy reversal lines stay untagged so reverse_ledger() never picks them up
+UPDATE general_ledger
+SET source_type = 'sale',
+    source_id = (SELECT MIN(d.id) FROM sale d WHERE d.transaction_no = general_ledger.transaction_no)
+WHERE source_type IS NULL
+  AND COALESCE(description, '') NOT LIKE 'Reversal of%'
+  AND transaction_no IN (SELECT transaction_no FROM sale WHERE transaction_no IS NOT NULL);
+UPDATE general_ledger
+SET source_type = 'payment',
+    source_id = (SELECT MIN(d.id) FROM payment d WHERE d.transaction_no = general_ledger.transaction_no)
+WHERE source_type IS NULL
+  AND COALESCE(description, '') NOT LIKE 'Reversal of%'
+  AND transaction_no IN (SELECT transaction_no FROM payment WHERE transaction_no IS NOT NULL);
+UPDATE general_ledger
+SET source_type = 'purchase_order',
+    source_id = (SELECT MIN(d.id) FROM purchase_order d WHERE d.transaction_no = general_ledger.transaction_no)
+WHERE source_type IS NULL
+  AND COALESCE(description, '') NOT LIKE 'Reversal of%'
+  AND transaction_no IN (SELECT transaction_no FROM purchase_order WHERE transaction_no IS NOT NULL);
+UPDATE general_ledger
+SET source_type = 'supplier_payment',
+    source_id = (SELECT MIN(d.id) FROM supplier_payment d WHERE d.transaction_no = general_ledger.transaction_no)
+WHERE source_type IS NULL
+  AND COALESCE(description, '') NOT LIKE 'Reversal of%'
+  AND transaction_no IN (SELECT transaction_no FROM supplier_payment WHERE transaction_no IS NOT NULL);
+UPDATE general_ledger
+SET source_type = 'expense',
+    source_id = (SELECT MIN(d.id) FROM expense d WHERE d.transaction_no = general_ledger.transaction_no)
+WHERE source_type IS NULL
+  AND COALESCE(description, '') NOT LIKE 'Reversal of%'
+  AND transaction_no IN (SELECT transaction_no FROM expense WHERE transaction_no IS NOT NULL);
+UPDATE general_ledger
+SET source_type = 'purchase_order',
+    source_id = CAST(substring(description FROM '^PO #([0-9]+) edit adjustment') AS INTEGER)
+WHERE source_type IS NULL AND description ~ '^PO #[0-9]+ edit adjustment';
+
+-- ------------------ Account daily balances (report rollup) ------------------
+CREATE TABLE IF NOT EXISTS account_daily_balance (
+    account_id INTEGER NOT NULL REFERENCES account(id),
+    day DATE NOT NULL,
+    debit DOUBLE PRECISION NOT NULL DEFAULT 0,
+    credit DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (account_id, day)
+);
+CREATE INDEX IF NOT EXISTS ix_account_daily_balance_day ON account_daily_balance (day);
+-- Backfill (same rule as app.utils.gl_utils.rebuild_account_daily_balances); only
+-- while the table is empty, later repairs use scripts/rebuild_account_balances.py
+INSERT INTO account_daily_balance (account_id, day, debit, credit)
+SELECT account_id, CAST(transaction_date AS DATE),
+       SUM(CASE WHEN transaction_type = 'Debit' THEN amount ELSE 0 END),
+       SUM(CASE WHEN transaction_type <> 'Debit' THEN amount ELSE 0 END)
+FROM general_ledger
+WHERE status <> 9 AND transaction_date IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM account_daily_balance)
+GROUP BY account_id, CAST(transaction_date AS DATE);
+
+-- ------------------ Period close (app/utils/periods.py) ------------------
+CREATE TABLE IF NOT EXISTS accounting_period (
+    id SERIAL PRIMARY KEY,
+    period_start DATE NOT NULL UNIQUE,
+    period_end DATE NOT NULL,
+    closed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    closed_by INTEGER REFERENCES "user"(id),
+    archived_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS ix_accounting_period_period_end ON accounting_period (period_end);
+
+CREATE TABLE IF NOT EXISTS period_closing_balance (
+    period_id INTEGER NOT NULL REFERENCES accounting_period(id) ON DELETE CASCADE,
+    account_id INTEGER NOT NULL REFERENCES account(id),
+    debit DOUBLE PRECISION NOT NULL DEFAULT 0,
+    credit DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (period_id, account_id)
+);
+
+CREATE TABLE IF NOT EXISTS general_ledger_archive (
+    id INTEGER PRIMARY KEY,
+    account_id INTEGER NOT NULL,
+    transaction_type VARCHAR(10) NOT NULL,
+    amount DOUBLE PRECISION NOT NULL,
+    description VARCHAR(200),
+    transaction_date TIMESTAMP,
+    transaction_no INTEGER,
+    source_type VARCHAR(30),
+    source_id INTEGER,
+    reversal_of_id INTEGER,
+    status INTEGER NOT NULL,
+    created_at TIMESTAMP,
+    updated_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS ix_general_ledger_archive_date ON general_ledger_archive (transaction_date);
+CREATE INDEX IF NOT EXISTS ix_general_ledger_archive_account ON general_ledger_archive (account_id, transaction_date);
+CREATE INDEX IF NOT EXISTS ix_general_ledger_archive_source ON general_ledger_archive (source_type, source_id);
+CREATE INDEX IF NOT EXISTS ix_general_ledger_archive_transaction_no ON general_ledger_archive (transaction_no);
+
+-- ------------------ Aging (open receivables / payables) ------------------
+CREATE INDEX IF NOT EXISTS ix_sale_open_balance ON sale (customer_id, sale_date)
+    WHERE balance > 0 AND status <> 9;
+CREATE INDEX IF NOT EXISTS ix_purchase_order_open_balance ON purchase_order (supplier_id, purchase_date)
+    WHERE total_balance > 0 AND status <> 9;
+
+-- ------------------ Account hierarchy closure (app/utils/account_tree.py) ------------------
+CREATE TABLE IF NOT EXISTS account_closure (
+    ancestor_id INTEGER NOT NULL REFERENCES account(id) ON DELETE CASCADE,
+    descendant_id INTEGER NOT NULL REFERENCES account(id) ON DELETE CASCADE,
+    depth INTEGER NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id)
+);
+CREATE INDEX IF NOT EXISTS ix_account_closure_descendant ON account_closure (descendant_id, depth);
+
+-- Seed from account.parent_id (same rule as rebuild_account_closure; depth bounded
+-- in case parent_id forms a cycle). The after_flush hook keeps it current afterwards.
+INSERT INTO account_closure (ancestor_id, descendant_id, depth)
+WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+    SELECT id, id, 0 FROM account
+    UNION ALL
+    SELECT tree.ancestor_id, child.id, tree.depth + 1
+    FROM tree JOIN account child ON child.parent_id = tree.descendant_id
+    WHERE tree.depth < 32
+)
+SELECT ancestor_id, descendant_id, MIN(depth) FROM tree GROUP BY ancestor_id, descendant_id
+ON CONFLICT (ancestor_id, descendant_id) DO NOTHING;
@@ -12,14 +12,20 @@ from datetime import datetime
 
 # ==================== IMPORT ALL MODELS & ENUMS ====================
 from app.models import (
-    User, Permission, Account, PurchaseOrder, PurchaseOrderItem,
+    User, Permission, Account, AccountDailyBalance, PurchaseOrder, PurchaseOrderItem,
     Sale, SaleItem, Product, InventoryTransaction,
     AssetSubtypeEnum, LiabilitySubtypeEnum, EquitySubtypeEnum,
     RevenueSubtypeEnum, ExpenseSubtypeEnum
 )
 
 from app.routes.accounts import generate_account_code
-from app.utils.gl_utils import generate_transaction_number_partone
+from app.utils.gl_utils import (
+    backfill_ledger_sources, generate_transaction_number_partone, rebuild_account_daily_balances
+)
+from app.utils.numbering import ensure_sequences
+from app.utils.account_tree import rebuild_account_closure
+from app.utils.reconcile import reconcile_stock
+from app.utils.costing import backfill_sale_item_costs, refresh_product_costs
 
 app = create_app()
 
@@ -92,6 +98,7 @@ permissions = [
     ("edit_journal_entry", "Edit existing entries"),
     ("delete_journal_entry", "Remove journal entries"),
     ("approve_journal_entry", "Approve accounting entries"),
+    ("close_period", "Close, reopen and archive accounting periods"),
 
     # --- Financial Reports ---
     ("view_balance_sheet", "View balance sheet report"),
@@ -250,6 +257,13 @@ def normalize_account_type_enum_uppercase():
             db.session.rollback()
             print(f"Enum already fixed or error: {e}")
 
+def ensure_pg_trgm():
+    """The search indexes declared in models.py (trgm_index) need pg_trgm."""
+    with app.app_context():
+        if db.engine.dialect.name == "postgresql":
+            db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            db.session.commit()
+
 def create_default_admin():
     with app.app_context():
         if User.query.filter_by(username="admin").first():
@@ -260,24 +274,48 @@ def create_default_admin():
         db.session.commit()
         print("Default admin created → username: admin | password: 123456")
 
-def rebuild_product_quantities():
+def backfill_product_costs():
+    """Fill product_cost from the whole purchase history (first deploy / repair)."""
+    with app.app_context():
+        refresh_product_costs()
+        db.session.commit()
+        print("Product costs rebuilt")
+
+def backfill_gl_sources():
+    """Link GL lines posted before source_type/source_id existed to their documents."""
+    with app.app_context():
+        backfill_ledger_sources()
+        db.session.commit()
+        print("GL source documents backfilled")
+
+def backfill_daily_balances():
+    """Build account_daily_balance on first deploy (it is maintained by posting afterwards)."""
+    with app.app_context():
+        if db.session.execute(select(AccountDailyBalance.account_id).limit(1)).first():
+            return
+        rows = rebuild_account_daily_balances()
+        db.session.commit()
+        print(f"Account daily balances built: {rows} row(s)")
+
+def backfill_account_closure():
+    """Rebuild account_closure from account.parent_id (cheap; also repairs hand edits to the chart)."""
+    with app.app_context():
+        rows = rebuild_account_closure()
+        db.session.commit()
+        print(f"Account hierarchy rebuilt: {rows} closure row(s)")
+
+def backfill_sale_costs():
+    """Give sale lines posted before unit_cost existed their posting cost."""
     with app.app_context():
-        sql = text("""
-            WITH pur AS (SELECT product_id, SUM(quantity) AS qty FROM purchase_order_item WHERE status != 9 GROUP BY product_id),
-                 sal AS (SELECT product_id, SUM(quantity) AS qty FROM sale_item WHERE status != 9 GROUP BY product_id)
-            UPDATE product p SET quantity = COALESCE(pur.qty,0) - COALESCE(sal.qty,0)
-            FROM pur FULL JOIN sal USING (product_id)
-            WHERE p.id = COALESCE(pur.product_id, sal.product_id);
-        """)
-        db.session.execute(sql)
+        backfill_sale_item_costs()
         db.session.commit()
-        print("Product quantities rebuilt")
+        print("Sale line costs backfilled")
 
 def repair_inventory():
+    """Report products whose stored quantity has drifted from their history."""
     with app.app_context():
-        print("Repairing inventory...")
-        rebuild_product_quantities()
-        print("Inventory repaired")
+        drift = reconcile_stock()
+        print(f"Inventory checked: {len(drift)} product(s) drifted (see scripts/reconcile_stock.py --fix)")
 
 
 
@@ -362,8 +400,15 @@ if __name__ == "__main__":
         from app.utils.gl_utils import generate_transaction_number, post_to_ledger
         create_default_piece_unit_for_products()
         repair_inventory()
+        backfill_product_costs()
+        backfill_sale_costs()
+        backfill_gl_sources()
+        backfill_daily_balances()
+        backfill_account_closure()
         # update_all_accounts()
         normalize_account_type_enum_uppercase()
+        ensure_sequences()
+        ensure_pg_trgm()
         seed_permissions()
         create_default_admin()
     app.run(host="0.0.0.0", port=5005, debug=True)
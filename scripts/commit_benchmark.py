@@ -0,0 +1,146 @@
+"""
+Commits-per-document and throughput benchmark for the posting routes.
+
+Drives create_sale, add_purchase_order, add_payment and create_expense
+through the Flask test client and counts COMMITs on the engine.
+
+    python scripts/commit_benchmark.py --docs 200
+    python scripts/commit_benchmark.py --docs 200 --legacy   # old behaviour
+
+--legacy re-adds the commit that post_to_ledger() and
+generate_transaction_number() used to issue internally, so both numbers can
+be compared on the same database. Creates real documents: point it at a
+scratch database (--database-url, plus --create-all for an empty one).
+"""
+import argparse
+import os
+import sys
+import time
+from functools import wraps
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+FIXTURE_ACCOUNTS = [
+    ("1000", "Cash on Hand", "ASSET", "Cash"),
+    ("1100", "Accounts Receivable", "ASSET", "Accounts Receivable"),
+    ("1200", "Inventory", "ASSET", "Inventory"),
+    ("2100", "Accounts Payable", "LIABILITY", "Accounts Payable"),
+    ("4000", "Sales Revenue", "REVENUE", "Sales Revenue"),
+    ("5000", "Cost of Goods Sold", "EXPENSE", "Cost of Goods Sold"),
+    ("5990", "Benchmark Expense", "EXPENSE", "Other Expenses"),
+]
+
+
+def ensure_fixtures(db, models):
+    Account, Customer, Supplier, Product, ProductUnit = models
+    accounts = {}
+    for code, name, account_type, subtype in FIXTURE_ACCOUNTS:
+        account = Account.query.filter_by(code=code).first()
+        if not account:
+            account = Account(code=code, name=name, account_type=account_type, account_subtype=subtype, status=1)
+            db.session.add(account)
+        accounts[code] = account
+
+    customer = db.session.get(Customer, 1) or Customer(id=1, name="Walk-in", status=1)
+    supplier = Supplier(name="BENCH supplier", status=1)
+    product = Product(name="BENCH product", sku="BENCH", quantity=0, status=1)
+    db.session.add_all([customer, supplier, product])
+    db.session.flush()
+    unit = ProductUnit(product_id=product.id, unit_name="Piece", conversion_quantity=1, retail_price=10, status=1)
+    db.session.add(unit)
+    db.session.commit()
+    return accounts, supplier.id, product.id, unit.id
+
+
+def patch_legacy_commits(db):
+    """Restore the pre unit-of-work behaviour: helpers commit internally."""
+    from app.routes import sales, suppliers, payments, expenses
+
+    def committing(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            result = fn(*args, **kwargs)
+            db.session.commit()
+            return result
+        return wrapper
+
+    for module in (sales, suppliers, payments, expenses):
+        for name in ("post_to_ledger", "generate_transaction_number", "generate_transaction_number_partone"):
+            if hasattr(module, name):
+                setattr(module, name, committing(getattr(module, name)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=100, help="documents per type")
+    parser.add_argument("--legacy", action="store_true", help="commit inside GL helpers like before")
+    parser.add_argument("--database-url", help="override SQLALCHEMY_DATABASE_URI")
+    parser.add_argument("--create-all", action="store_true", help="db.create_all() first (empty scratch DB)")
+    args = parser.parse_args()
+
+    if args.database_url:
+        from app.config import Config
+        Config.SQLALCHEMY_DATABASE_URI = args.database_url
+
+    from sqlalchemy import event
+    from app import create_app, db
+    from app.models import Account, Customer, Supplier, Product, ProductUnit
+
+    app = create_app()
+    client = app.test_client()
+
+    with app.app_context():
+        if args.create_all:
+            db.create_all()
+        accounts, supplier_id, product_id, unit_id = ensure_fixtures(
+            db, (Account, Customer, Supplier, Product, ProductUnit)
+        )
+        cash_id, expense_account_id = accounts["1000"].id, accounts["5990"].id
+        if args.legacy:
+            patch_legacy_commits(db)
+
+        commits = {"n": 0}
+        event.listen(db.engine, "commit", lambda conn: commits.__setitem__("n", commits["n"] + 1))
+
+    sale_ids = []
+
+    def purchase(i):
+        return client.post("/api/suppliers/orders", json={
+            "supplier_id": supplier_id, "invoice_number": f"BENCH-{i}",
+            "items": [{"product_id": product_id, "unit_id": unit_id, "quantity": 10, "unit_price": 4}],
+        })
+
+    def sale(i):
+        r = client.post("/api/sales/", json={
+            "items": [{"product_id": product_id, "unit_id": unit_id, "quantity": 1, "unit_price": 10}],
+            "amount_paid": 5, "payment_account_id": cash_id,
+        })
+        sale_ids.append(r.get_json().get("sale_id"))
+        return r
+
+    def payment(i):
+        return client.post("/api/payments/", json={
+            "sale_id": sale_ids[i % len(sale_ids)], "amount": 1, "payment_account_id": cash_id,
+        })
+
+    def expense(i):
+        return client.post("/api/expenses/", json={
+            "description": f"BENCH expense {i}", "payment_account_id": cash_id,
+            "items": [{"account_id": expense_account_id, "item_name": "bench", "amount": 3}],
+        })
+
+    print(f"mode={'legacy' if args.legacy else 'unit-of-work'} docs/type={args.docs}")
+    print(f"{'document':<12}{'commits/doc':>12}{'docs/s':>10}")
+    for label, post in (("purchase", purchase), ("sale", sale), ("payment", payment), ("expense", expense)):
+        commits["n"] = 0
+        started = time.perf_counter()
+        for i in range(args.docs):
+            r = post(i)
+            if r.status_code >= 400:
+                sys.exit(f"{label} #{i} failed: {r.status_code} {r.get_data(as_text=True)}")
+        elapsed = time.perf_counter() - started
+        print(f"{label:<12}{commits['n'] / args.docs:>12.2f}{args.docs / elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
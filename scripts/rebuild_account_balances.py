@@ -0,0 +1,46 @@
+"""
+Rebuild account_daily_balance (the per-account, per-day GL totals the
+financial reports read) from general_ledger.
+
+Posting keeps the table current, so this is only needed on first deploy
+(run.py does it when the table is empty) and after GL rows were changed
+with raw SQL. Runs in one transaction; postings wait for it on PostgreSQL.
+
+    python scripts/rebuild_account_balances.py                      # every day
+    python scripts/rebuild_account_balances.py --since 2025-01-01   # only days from then on
+
+Runs against the database configured in app/config.py (or --database-url).
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--since", type=lambda s: datetime.strptime(s, "%Y-%m-%d").date(),
+                        help="YYYY-MM-DD; rebuild only this day and later")
+    parser.add_argument("--database-url", help="override SQLALCHEMY_DATABASE_URI")
+    args = parser.parse_args()
+
+    if args.database_url:
+        from app.config import Config
+        Config.SQLALCHEMY_DATABASE_URI = args.database_url
+
+    from app import create_app, db
+    from app.utils.gl_utils import rebuild_account_daily_balances
+
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        rows = rebuild_account_daily_balances(since=args.since)
+        db.session.commit()
+    print(f"rows={rows} since={args.since or 'start'} elapsed={time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
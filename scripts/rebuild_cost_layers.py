@@ -0,0 +1,53 @@
+"""
+Rebuild FIFO / moving-average cost layers from purchase, sale and
+stock-adjustment history (see app/utils/cost_layers.py).
+
+Run it once after setting COSTING_METHOD=fifo or average on a deployment,
+and again after back-dated edits to old purchase orders or sales.
+Products are replayed independently, in parallel chunks, each chunk in its
+own transaction.
+
+    python scripts/rebuild_cost_layers.py                      # configured method
+    python scripts/rebuild_cost_layers.py --method fifo --workers 8
+    python scripts/rebuild_cost_layers.py --product 12 --product 40
+
+Runs against the database configured in app/config.py (or --database-url).
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--method", choices=("fifo", "average", "latest"), help="default: COSTING_METHOD")
+    parser.add_argument("--workers", type=int, default=4, help="parallel chunks (each uses a DB connection)")
+    parser.add_argument("--chunk-size", type=int, default=500, help="products per chunk")
+    parser.add_argument("--product", type=int, action="append", help="only rebuild this product id (repeatable)")
+    parser.add_argument("--database-url", help="override SQLALCHEMY_DATABASE_URI")
+    args = parser.parse_args()
+
+    if args.database_url:
+        from app.config import Config
+        Config.SQLALCHEMY_DATABASE_URI = args.database_url
+
+    from app import create_app
+    from app.utils.cost_layers import rebuild_cost_layers
+
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        result = rebuild_cost_layers(
+            product_ids=args.product, method=args.method, workers=args.workers, chunk_size=args.chunk_size
+        )
+    print(
+        f"method={result['method']} products={result['products']} layers={result['layers']} "
+        f"elapsed={time.perf_counter() - started:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
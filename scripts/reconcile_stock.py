@@ -0,0 +1,57 @@
+"""
+Nightly stock reconciliation.
+
+Compares products' stored quantity with the quantity implied by their
+purchase, sale and stock-adjustment history and prints one line per drifted
+product. Exits 1 when drift is found so cron / Render can alert on it.
+
+By default only products touched since the previous run are recomputed
+(watermarks + per-product checkpoints, see app/utils/reconcile.py).
+
+    python scripts/reconcile_stock.py                # incremental, report only
+    python scripts/reconcile_stock.py --fix          # report, then correct
+    python scripts/reconcile_stock.py --full         # recheck every product
+    python scripts/reconcile_stock.py --product 12 --product 40
+
+Runs against the database configured in app/config.py (or --database-url).
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fix", action="store_true", help="correct drifted quantities after reporting them")
+    parser.add_argument("--full", action="store_true", help="recheck every product, not just touched ones")
+    parser.add_argument("--product", type=int, action="append", help="only check this product id (repeatable)")
+    parser.add_argument("--database-url", help="override SQLALCHEMY_DATABASE_URI")
+    args = parser.parse_args()
+
+    if args.database_url:
+        from app.config import Config
+        Config.SQLALCHEMY_DATABASE_URI = args.database_url
+
+    from app import create_app
+    from app.utils.reconcile import reconcile_stock, reconcile_stock_incremental
+
+    app = create_app()
+    with app.app_context():
+        if args.product:
+            drift = reconcile_stock(product_ids=args.product, fix=args.fix)
+        else:
+            result = reconcile_stock_incremental(fix=args.fix, full=args.full)
+            drift = result["drift"]
+            print(f"checked {result['checked']} product(s)")
+
+    print(f"{'product':>8}  {'stored':>12}  {'expected':>12}  {'drift':>10}  name")
+    for d in drift:
+        print(f"{d['product_id']:>8}  {d['stored']:>12.4f}  {d['expected']:>12.4f}  {d['drift']:>10.4f}  {d['name']}")
+    print(f"{len(drift)} product(s) drifted" + (" (corrected)" if args.fix and drift else ""))
+    sys.exit(1 if drift and not args.fix else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Latency of the app's search queries without and with the pg_trgm / barcode
+indexes declared in app/models.py, on a seeded dataset.
+
+    python scripts/search_index_benchmark.py --database-url postgresql://.../bench --create-all
+    python scripts/search_index_benchmark.py --database-url ... --skip-seed --repeat 50
+
+Seeds --rows rows (default 1,000,000) into product, product_unit, sale,
+purchase_order and general_ledger (customers and suppliers get rows/10 and
+rows/100) with INSERT ... SELECT generate_series, then for every query runs
+it --repeat times with the indexes dropped and again with them built, and
+prints median / p95 in ms. PostgreSQL only, and it drops and recreates the
+search indexes: point it at a scratch database, never production.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+SEED_SQL = [
+    """INSERT INTO account (name, code, account_type, status)
+       SELECT 'BENCH Sales', '49999', 'REVENUE', 1
+       WHERE NOT EXISTS (SELECT 1 FROM account WHERE code = '49999')""",
+    """INSERT INTO customer (name, status)
+       SELECT 'Customer ' || substr(md5(g::text), 1, 10), 1 FROM generate_series(1, :rows / 10) g""",
+    """INSERT INTO supplier (name, status)
+       SELECT 'Supplier ' || substr(md5(g::text), 1, 10), 1 FROM generate_series(1, :rows / 100) g""",
+    """INSERT INTO product (name, sku, quantity, status)
+       SELECT (ARRAY['Hammer','Nail','Screw','Paint','Drill','Pipe','Wire','Bolt'])[1 + g % 8]
+              || ' ' || substr(md5(g::text), 1, 8), 'SKU' || g, 100, 1
+       FROM generate_series(1, :rows) g""",
+    """INSERT INTO product_unit (product_id, unit_name, conversion_quantity, unit_code, status)
+       SELECT id, 'Piece', 1, '600' || lpad(id::text, 10, '0'), 1 FROM product WHERE sku LIKE 'SKU%'""",
+    """INSERT INTO sale (sale_number, customer_id, memo, total_amount, status)
+       SELECT 'BS-' || lpad(g::text, 9, '0'),
+              (SELECT min(id) FROM customer) + g % (:rows / 10),
+              'memo ' || md5(g::text), 10, 1
+       FROM generate_series(1, :rows) g""",
+    """INSERT INTO purchase_order (supplier_id, invoice_number, memo, status)
+       SELECT (SELECT min(id) FROM supplier) + g % (:rows / 100),
+              'BINV-' || g, 'po ' || md5(g::text), 1
+       FROM generate_series(1, :rows) g""",
+    """INSERT INTO general_ledger (account_id, transaction_type, amount, description, status)
+       SELECT (SELECT id FROM account WHERE code = '49999'), 'Credit', 10,
+              'Sale #' || g || ' ' || substr(md5(g::text), 1, 12), 1
+       FROM generate_series(1, :rows) g""",
+]
+
+QUERIES = {
+    "product search": (
+        "SELECT id FROM product WHERE status = 1 AND (name ILIKE :p OR sku ILIKE :p) LIMIT 20",
+        {"p": "%c4ca%"},
+    ),
+    "sales search": (
+        """SELECT s.id FROM sale s JOIN customer c ON c.id = s.customer_id
+           WHERE s.status IN (1, 3, 4)
+             AND (s.sale_number ILIKE :p OR s.memo ILIKE :p OR c.name ILIKE :p)
+           ORDER BY s.id DESC LIMIT 50""",
+        {"p": "%a87ff%"},
+    ),
+    "purchase search": (
+        """SELECT po.id FROM purchase_order po JOIN supplier su ON su.id = po.supplier_id
+           WHERE po.status IN (1, 2, 3, 4, 5)
+             AND (su.name ILIKE :p OR po.invoice_number ILIKE :p OR po.memo ILIKE :p)
+           LIMIT 50""",
+        {"p": "%e4da3%"},
+    ),
+    "GL description": (
+        "SELECT id FROM general_ledger WHERE status != 9 AND description ILIKE :p LIMIT 20",
+        {"p": "%1679091%"},
+    ),
+    "barcode scan": (
+        """SELECT pu.id, p.id FROM product_unit pu JOIN product p ON p.id = pu.product_id
+           WHERE pu.unit_code = :code AND pu.status = 1 AND p.status = 1""",
+        {"code": "6000000123456"},
+    ),
+}
+
+
+def search_indexes(models):
+    return [
+        ix
+        for model in models
+        for ix in model.__table__.indexes
+        if ix.name.endswith("_trgm") or ix.name == "ix_product_unit_unit_code"
+    ]
+
+
+def time_queries(conn, text, repeat):
+    results = {}
+    for label, (sql, params) in QUERIES.items():
+        stmt = text(sql)
+        conn.execute(stmt, params).all()  # warm the cache
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(stmt, params).all()
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        results[label] = (statistics.median(samples), samples[int(len(samples) * 0.95) - 1])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True, help="scratch PostgreSQL database")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--create-all", action="store_true", help="db.create_all() first (empty scratch DB)")
+    parser.add_argument("--skip-seed", action="store_true", help="reuse rows from a previous run")
+    args = parser.parse_args()
+
+    from app.config import Config
+    Config.SQLALCHEMY_DATABASE_URI = args.database_url
+
+    from sqlalchemy import text
+    from sqlalchemy.schema import CreateIndex, DropIndex
+    from app import create_app, db
+    from app.models import Customer, GeneralLedger, Product, ProductUnit, PurchaseOrder, Sale, Supplier
+
+    app = create_app()
+    with app.app_context():
+        if db.engine.dialect.name != "postgresql":
+            sys.exit("PostgreSQL only (pg_trgm)")
+
+        with db.engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        if args.create_all:
+            db.create_all()
+
+        if not args.skip_seed:
+            started = time.perf_counter()
+            with db.engine.begin() as conn:
+                for sql in SEED_SQL:
+                    conn.execute(text(sql), {"rows": args.rows})
+            print(f"seeded {args.rows:,} rows/table in {time.perf_counter() - started:.1f}s")
+
+        indexes = search_indexes([Customer, GeneralLedger, Product, ProductUnit, PurchaseOrder, Sale, Supplier])
+        with db.engine.begin() as conn:
+            for ix in indexes:
+                conn.execute(DropIndex(ix, if_exists=True))
+            conn.execute(text("ANALYZE"))
+        with db.engine.connect() as conn:
+            before = time_queries(conn, text, args.repeat)
+
+        started = time.perf_counter()
+        with db.engine.begin() as conn:
+            for ix in indexes:
+                conn.execute(CreateIndex(ix, if_not_exists=True))
+            conn.execute(text("ANALYZE"))
+        print(f"built {len(indexes)} indexes in {time.perf_counter() - started:.1f}s")
+        with db.engine.connect() as conn:
+            after = time_queries(conn, text, args.repeat)
+
+    print(f"\n{'query':<18}{'before p50':>12}{'p95':>10}{'after p50':>12}{'p95':>10}{'speedup':>10}")
+    for label in QUERIES:
+        (b50, b95), (a50, a95) = before[label], after[label]
+        print(f"{label:<18}{b50:>12.2f}{b95:>10.2f}{a50:>12.2f}{a95:>10.2f}{b50 / max(a50, 1e-3):>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Concurrent till load test for reserve_stock().
+
+Creates throwaway products with a known quantity, then lets N worker threads
+(each with its own app context / DB session, like gunicorn workers) sell from
+them as fast as they can. Every basket touches all test products, listed in a
+random order, to prove fixed-order locking never deadlocks. At the end the
+stock on hand must equal the starting quantity minus the units sold exactly.
+
+    python scripts/stock_load_test.py --workers 16 --sales 200 --stock 1000
+
+Runs against the database configured in app/config.py (or --database-url).
+The test products are soft-deleted (status=9) afterwards.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--sales", type=int, default=200, help="sale attempts per worker")
+    parser.add_argument("--stock", type=float, default=1000, help="starting base units per product")
+    parser.add_argument("--products", type=int, default=1, help="products in every basket")
+    parser.add_argument("--database-url", help="override SQLALCHEMY_DATABASE_URI")
+    args = parser.parse_args()
+
+    if args.database_url:
+        from app.config import Config
+        Config.SQLALCHEMY_DATABASE_URI = args.database_url
+
+    from app import create_app, db
+    from app.models import Product
+    from app.utils.stock import reserve_stock, InsufficientStockError
+
+    app = create_app()
+
+    with app.app_context():
+        products = [
+            Product(name=f"LOADTEST {i}", sku=f"LOADTEST-{int(time.time())}-{i}", quantity=args.stock, status=1)
+            for i in range(args.products)
+        ]
+        db.session.add_all(products)
+        db.session.commit()
+        product_ids = [p.id for p in products]
+
+    sold = {pid: 0.0 for pid in product_ids}
+    counts = {"ok": 0, "short": 0, "timeout": 0}
+    lock = threading.Lock()
+
+    def worker():
+        with app.app_context():
+            for _ in range(args.sales):
+                basket_ids = product_ids[:]
+                random.shuffle(basket_ids)
+                basket = {pid: float(random.randint(1, 3)) for pid in basket_ids}
+                try:
+                    reserve_stock(basket)
+                    db.session.commit()
+                    outcome = "ok"
+                except InsufficientStockError:
+                    db.session.rollback()
+                    outcome = "short"
+                except OperationalError:
+                    # lock_timeout / "database is locked": the sale failed fast, nothing was taken
+                    db.session.rollback()
+                    outcome = "timeout"
+                with lock:
+                    counts[outcome] += 1
+                    if outcome == "ok":
+                        for pid, qty in basket.items():
+                            sold[pid] += qty
+            db.session.remove()
+
+    threads = [threading.Thread(target=worker) for _ in range(args.workers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    failures = []
+    with app.app_context():
+        for pid in product_ids:
+            final = db.session.get(Product, pid).quantity
+            expected = args.stock - sold[pid]
+            print(f"product {pid}: start={args.stock} sold={sold[pid]} final={final} expected={expected}")
+            if abs(final - expected) > 1e-9 or final < 0:
+                failures.append(pid)
+        Product.query.filter(Product.id.in_(product_ids)).update({"status": 9}, synchronize_session=False)
+        db.session.commit()
+
+    attempts = args.workers * args.sales
+    print(f"{attempts} attempts in {elapsed:.2f}s ({attempts / elapsed:.0f}/s): {counts}")
+    if failures:
+        print(f"FAIL: stock drift on products {failures}")
+        sys.exit(1)
+    print("OK: final quantities are exact")
+
+
+if __name__ == "__main__":
+    main()